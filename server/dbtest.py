@@ -1,10 +1,14 @@
+import time
 import unittest
-from datetime import datetime
+from datetime import datetime, timedelta
 
-from visualize import create_app
+from visualize import create_app, materialized_access
+from visualize.building_graph import building_graph, BuildingGraph
+from visualize.reachability import reachability, ReachabilityEngine
 from visualize.models import *
+from visualize.models import blacklist
 
-app = create_app()
+app = create_app({"TESTING": True})
 from visualize.models import db  # database is created in models module
 
 app.app_context().push()  # make all test use this context
@@ -123,6 +127,138 @@ class TestDbModels(unittest.TestCase):
 		self.assertEqual(len(res), 1)
 		self.assertEqual(res[0], card_reader_ab)
 
+	def test_purge_expired_blacklist(self):
+		"""Test that only the tokens that have expired are removed from the blacklist"""
+		for i in range(5):
+			blacklist.add_jti_to_blacklist("expired{}".format(i), datetime.now() - timedelta(hours=1))
+		blacklist.add_jti_to_blacklist("active", datetime.now() + timedelta(hours=1))
+
+		self.assertEqual(blacklist.purge_expired(batch_size=2), 5)
+		self.assertEqual([row.jti for row in blacklist.Blacklist.query.all()], ["active"])
+		self.assertTrue(blacklist.is_jti_in_blacklist("active"))
+
+	def test_effective_access(self):
+		"""Test that the effective access is updated per reader and access group, and that the checker finds differences"""
+		reader = Reader("fakeuser@fakesite.com", "password", "name", "surname")
+		room1 = Room(name="A", text_id="A")
+		room2 = Room(name="B", text_id="B")
+		ag = AccessGroup("G")
+		card_reader_ab = CardReader(room_a=room1, room_b=room2)
+		card_reader_ba = CardReader(room_a=room2, room_b=room1)
+		db.session.add_all([reader, room1, room2, ag, card_reader_ab, card_reader_ba])
+		db.session.commit()
+
+		db.session.add(HasAccessTo(reader=reader, card_reader=card_reader_ab, expiration_datetime=datetime.today()))
+		db.session.add(BelongsTo(reader=reader, ag=ag, expiration_datetime=datetime.today()))
+		materialized_access.refresh_reader(reader.id)
+		db.session.commit()
+		self.assertEqual([(a.room_id, a.source) for a in EffectiveAccess.query.all()], [(room2.id, "room")])
+
+		ag.card_readers = [card_reader_ba]
+		materialized_access.refresh_ag(ag.id)
+		db.session.commit()
+		self.assertEqual(EffectiveAccess.query.filter_by(room_id=room1.id).first().ag_id, ag.id)
+		self.assertEqual(materialized_access.check(), ([], []))
+
+		# access added without updating the table is found by the checker
+		HasAccessTo.query.delete()
+		db.session.commit()
+		missing, extra = materialized_access.check()
+		self.assertEqual((len(missing), len(extra)), (0, 1))
+
+		materialized_access.rebuild()
+		db.session.commit()
+		self.assertEqual(materialized_access.check(), ([], []))
+
+	def test_building_graph(self):
+		"""Test the questions about rooms and doors answered by the building graph, and that new doors are seen"""
+		room_a, room_b, room_c, room_d = [Room(name=text_id, text_id=text_id) for text_id in "ABCD"]
+		entrance = CardReader(room_b=room_a)
+		card_reader_ab = CardReader(room_a=room_a, room_b=room_b)
+		card_reader_ba = CardReader(room_a=room_b, room_b=room_a)
+		card_reader_bc = CardReader(room_a=room_b, room_b=room_c)
+		db.session.add_all([room_a, room_b, room_c, room_d, entrance, card_reader_ab, card_reader_ba, card_reader_bc])
+		db.session.commit()
+
+		self.assertEqual(building_graph.opposite(card_reader_ab.id), card_reader_ba.id)
+		self.assertIsNone(building_graph.opposite(card_reader_bc.id))
+		self.assertIsNone(building_graph.opposite(entrance.id))
+		self.assertEqual(building_graph.neighbours(room_b.id), {room_a.id, room_c.id})
+		self.assertEqual(building_graph.doors_of(room_a.id), {entrance.id, card_reader_ab.id, card_reader_ba.id})
+		self.assertEqual(building_graph.doors_between([room_b.id, room_c.id]), {card_reader_bc.id})
+		self.assertEqual(building_graph.entrances(), {entrance.id})
+		self.assertEqual(sorted(map(sorted, building_graph.components())),
+						 [[room_a.id, room_b.id, room_c.id], [room_d.id]])
+		self.assertEqual(building_graph.reachable([entrance.id, card_reader_ab.id]), {room_a.id, room_b.id})
+		self.assertEqual(building_graph.reachable([card_reader_bc.id]), set())
+		self.assertEqual(building_graph.reachable([card_reader_bc.id], start=[room_b.id]), {room_b.id, room_c.id})
+
+		card_reader_cd = CardReader(room_a=room_c, room_b=room_d)
+		db.session.add(card_reader_cd)
+		db.session.commit()
+		self.assertEqual(len(building_graph.components()), 1)
+		self.assertEqual(building_graph.text_id(room_d.id), "D")
+		self.assertEqual(building_graph.rooms_of([card_reader_cd.id]), {room_d.id})
+
+		# The graph of another worker is read again when it finds the building_change row of a new door
+		other = BuildingGraph()
+		sync_interval, app.config["BUILDING_GRAPH_SYNC_INTERVAL"] = app.config["BUILDING_GRAPH_SYNC_INTERVAL"], 3600
+		self.assertEqual(other.doors_of(room_d.id), {card_reader_cd.id})
+		exit_d = CardReader(room_a=room_d)
+		db.session.add(exit_d)
+		db.session.commit()
+		self.assertEqual(other.doors_of(room_d.id), {card_reader_cd.id})
+		app.config["BUILDING_GRAPH_SYNC_INTERVAL"] = 0
+		self.assertEqual(other.doors_of(room_d.id), {card_reader_cd.id, exit_d.id})
+		self.assertEqual(other.version, 2)
+		app.config["BUILDING_GRAPH_SYNC_INTERVAL"] = sync_interval
+
+	def test_reachability(self):
+		"""Test that a room is only reachable through doors the reader may open, and that changes are seen"""
+		reader = Reader("fakeuser@fakesite.com", "password", "name", "surname")
+		room_a, room_b = Room(name="A", text_id="A"), Room(name="B", text_id="B")
+		entrance = CardReader(room_b=room_a)
+		card_reader_ab = CardReader(room_a=room_a, room_b=room_b)
+		db.session.add_all([reader, room_a, room_b, entrance, card_reader_ab])
+		db.session.add(HasAccessTo(reader=reader, card_reader=card_reader_ab,
+								   expiration_datetime=datetime.now() + timedelta(days=1)))
+		materialized_access.refresh_reader(reader.id)
+		db.session.commit()
+		self.assertEqual(reachability.rooms(reader.id), set())
+
+		access = HasAccessTo(reader=reader, card_reader=entrance, expiration_datetime=datetime.now() + timedelta(days=1))
+		db.session.add(access)
+		materialized_access.refresh_reader(reader.id)
+		db.session.commit()
+		self.assertEqual(reachability.rooms_many([reader.id]), {reader.id: {room_a.id, room_b.id}})
+
+		# the access to the entrance expires
+		access.expiration_datetime = datetime.now() + timedelta(seconds=1)
+		materialized_access.refresh_reader(reader.id)
+		db.session.commit()
+		self.assertEqual(reachability.rooms(reader.id), {room_a.id, room_b.id})
+		time.sleep(1)
+		self.assertEqual(reachability.rooms(reader.id), set())
+
+		# Another worker sees the change of access when it reads the changes again
+		other = ReachabilityEngine()
+		self.assertEqual(other.rooms(reader.id), set())
+		access.expiration_datetime = datetime.now() + timedelta(days=1)
+		materialized_access.refresh_reader(reader.id)
+		db.session.commit()
+		sync_interval, app.config["DOOR_SYNC_INTERVAL"] = app.config["DOOR_SYNC_INTERVAL"], 3600
+		self.assertEqual(other.rooms(reader.id), set())
+		app.config["DOOR_SYNC_INTERVAL"] = 0
+		self.assertEqual(other.rooms(reader.id), {room_a.id, room_b.id})
+		app.config["DOOR_SYNC_INTERVAL"] = sync_interval
+
+		# The rooms of a reader marked while they are computed are not kept
+		engine = ReachabilityEngine()
+		read_doors = engine._doors
+		engine._doors = lambda reader_ids: (read_doors(reader_ids), engine.mark(reader_ids))[0]
+		self.assertEqual(engine.rooms(reader.id), {room_a.id, room_b.id})
+		self.assertNotIn(reader.id, engine._reachable)
+
 
 if __name__ == '__main__':
 	unittest.main()
@@ -1,16 +1,34 @@
 """
 This module is used to test the routes for the reader on the server.
 """
+import gzip
+import os
+import tempfile
+
 from flask import url_for
 from flask_jwt_extended import create_access_token
 from flask_testing import TestCase
 import json
+from sqlalchemy import create_engine, event, inspect as sqlalchemy_inspect, Column, Integer, MetaData, String, Table
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.pool import QueuePool
+import time
+from datetime import date, datetime, timedelta
 from script.create_db_data import populate_db
 
-from visualize import create_app, db
-from visualize.models import Reader, Approver, Admin
-
-app = create_app()
+from visualize import create_app, db, database, materialized_access, door_sync, swipe_log, bulk_import
+from visualize.models import Reader, Approver, Admin, EffectiveAccess, CardReader, Room, AccessGroup, RoomRequest, \
+	AccessGroupRequest, ApprovesRoomRequest, ApprovesAgRequest, HasAccessTo, BelongsTo, AccessChange, \
+	OccupancyCheckpoint, BuildingChange, blacklist, reader as reader_model
+from visualize.building_graph import building_graph
+from visualize.door_access import AccessIndex
+from visualize.id_watermark import IdWatermark
+from visualize.map_cache import map_cache
+from visualize.occupancy import occupancy
+from visualize.reader_search import reader_index, ReaderIndex
+
+app = create_app({"TESTING": True})
 app.app_context().push()  # make all test use this context
 db.drop_all()
 app.config["ENV"] = "testing"
@@ -144,7 +162,7 @@ class BaseTestCase(TestCase):
 
 	def create_app(self):
 		# app.run()
-		return create_app()
+		return create_app({"TESTING": True})
 
 	def setUp(self):
 		db.create_all()
@@ -155,6 +173,45 @@ class BaseTestCase(TestCase):
 		db.drop_all()
 
 
+class MainRouteTest(BaseTestCase):
+	"""class for unittests for the routes that need no role"""
+
+	def test_health(self):
+		"""testing the health report and the pool options of the database"""
+		response = self.client.get('/health')
+		self.assert200(response)
+		report = json.loads(response.data.decode("utf-8"))
+		self.assertEqual(report["status"], "ok")
+		self.assertEqual(report["database"]["backend"], db.engine.url.get_backend_name())
+
+		def fail(conn, cursor, statement, parameters, context, executemany):
+			if statement == "SELECT 1":
+				raise OperationalError(statement, {}, Exception("password authentication failed for user secret"))
+
+		event.listen(db.engine, "before_cursor_execute", fail)
+		try:
+			response = self.client.get('/health')
+		finally:
+			event.remove(db.engine, "before_cursor_execute", fail)
+		self.assertStatus(response, 503)
+		report = json.loads(response.data.decode("utf-8"))
+		self.assertEqual((report["status"], report["error"]), ("unavailable", "The database does not answer"))
+		self.assertNotIn("secret", response.data.decode("utf-8"))
+
+		config = dict(app.config, SQLALCHEMY_DATABASE_URI="sqlite://")
+		self.assertEqual(database.engine_options(config), {})
+		config.update(SQLALCHEMY_DATABASE_URI="postgresql://user@localhost/visualize", DB_POOL_SIZE=5,
+					  DB_MAX_OVERFLOW=3, DB_STATEMENT_TIMEOUT=1000)
+		options = database.engine_options(config)
+		self.assertEqual((options["pool_size"], options["max_overflow"]), (5, 3))
+		self.assertEqual(options["connect_args"], {"options": "-c statement_timeout=1000"})
+
+		engine = create_engine("sqlite://", poolclass=QueuePool, pool_size=2, max_overflow=2)
+		with engine.connect():
+			status = database.pool_status(engine)
+		self.assertEqual((status["size"], status["checked_out"], status["saturation"]), (2, 1, 0.25))
+
+
 class ReaderRouteTest(BaseTestCase):
 	"""class for unittests for reader routes."""
 
@@ -184,6 +241,81 @@ class ReaderRouteTest(BaseTestCase):
 		self.assertEqual(response_data['email'], email,
 						 "Check if sent email user is created with is the same as returned")
 
+	def test_logout(self):
+		"""testing that a token can not be used after logout"""
+		email = self.get_new_random_email()
+		self.populate_reader(email)
+
+		headers = self.login(email)
+
+		response = self.client.post('/logout', headers=headers)
+		self.assert200(response, "check if the logout request is ok")
+
+		response = self.client.get('/reader/self', headers=headers)
+		self.assert401(response, "check that the revoked token is refused")
+
+	def test_upgrade_blacklist(self):
+		"""testing that a blacklist table made before the expiry was stored is upgraded"""
+		db.session.commit()
+		blacklist.Blacklist.__table__.drop(db.engine)
+		Table("blacklist", MetaData(), Column("id", Integer, primary_key=True),
+			  Column("jti", String(36), nullable=False)).create(db.engine)
+		db.engine.execute("INSERT INTO blacklist (jti) VALUES ('a'), ('a'), ('b')")
+
+		blacklist.upgrade_table()
+		rows = blacklist.Blacklist.query.order_by(blacklist.Blacklist.jti).all()
+		self.assertEqual([row.jti for row in rows], ["a", "b"])
+		self.assertTrue(all(row.expires > datetime.now() for row in rows))
+		blacklist.add_jti_to_blacklist("c", datetime.now() + timedelta(hours=1))
+		self.assertTrue(blacklist.is_jti_in_blacklist("c"))
+		blacklist.upgrade_table()  # nothing to do the second time
+
+	def test_upgrade_reader(self):
+		"""testing that a reader table made before the token epoch was stored is upgraded and does not reuse ids"""
+		db.session.commit()
+		if db.engine.url.get_backend_name() == "sqlite":
+			# The table as it was made by SQLite, without AUTOINCREMENT
+			columns = "id, email, password, name, surname, card_id"
+			db.engine.execute("CREATE TABLE reader_baseline (id INTEGER NOT NULL, email VARCHAR NOT NULL, "
+							  "password VARCHAR NOT NULL, name VARCHAR NOT NULL, surname VARCHAR NOT NULL, "
+							  "card_id VARCHAR, PRIMARY KEY (id), UNIQUE (email))")
+			db.engine.execute("INSERT INTO reader_baseline ({0}) SELECT {0} FROM reader".format(columns))
+			db.engine.execute("DROP TABLE reader")
+			db.engine.execute("ALTER TABLE reader_baseline RENAME TO reader")
+		else:
+			db.engine.execute("ALTER TABLE reader DROP COLUMN token_epoch")
+
+		reader_model.upgrade_table()
+		self.assertIn("token_epoch", {c["name"] for c in sqlalchemy_inspect(db.engine).get_columns("reader")})
+		self.assertEqual(self.client.post('/login', data=json.dumps({"email": "c@c.c", "password": "abcABC123"}),
+										  content_type='application/json').status_code, 200)
+
+		last = Reader(self.get_new_random_email(), "abcABC123", "name", "surname")
+		db.session.add(last)
+		db.session.commit()
+		last_id = last.id
+		db.session.delete(last)
+		db.session.commit()
+		reader = Reader(self.get_new_random_email(), "abcABC123", "name", "surname")
+		db.session.add(reader)
+		db.session.commit()
+		self.assertGreater(reader.id, last_id)
+		reader_model.upgrade_table()  # nothing to do the second time
+
+	def test_rehash_on_login(self):
+		"""testing that the password is rehashed at login when the work factor changes"""
+		email = self.get_new_random_email()
+		self.populate_reader(email)
+		old_rounds = app.config["BCRYPT_LOG_ROUNDS"]
+
+		app.config["BCRYPT_LOG_ROUNDS"] = 5
+		self.login(email)
+		app.config["BCRYPT_LOG_ROUNDS"] = old_rounds
+
+		password = Reader.query.filter_by(email=email).first().password
+		self.assertTrue(password.startswith("$2b$05$"), "check that the password is hashed with the new work factor")
+		self.login(email)
+
 	def test_order_room(self):
 		"""test get_reader_rooms with a good request for the room isy1. """
 		room = "isy1"
@@ -275,6 +407,154 @@ class ReaderRouteTest(BaseTestCase):
 
 			self.assert200(response, "check if the request is ok")
 
+	def test_get_all_access_reachable(self):
+		""" test that a room is only reachable if the doors on the way from an entrance can be opened """
+		email = self.get_new_random_email()
+		headers = self.populate_reader(email)[3]
+
+		reader = Reader.query.filter_by(email=email).first()
+		room = Room.query.filter_by(text_id="ing27").first()
+		entrance = CardReader.query.filter_by(room_a_id=None, room_b_id=room.id).first()
+		door = CardReader.query.filter_by(room_a_id=room.id).first()
+		far = CardReader.query.filter(CardReader.room_a_id.notin_([room.id, door.room_b_id]),
+									  CardReader.room_b_id.notin_([room.id, door.room_b_id])).first()
+		for card_reader in [entrance, door, far]:
+			db.session.add(HasAccessTo(reader, card_reader, date.today() + timedelta(days=30)))
+		materialized_access.refresh_reader(reader.id)
+		db.session.commit()
+		room_text_ids = [room.text_id, door.room_b.text_id, far.room_b.text_id]
+
+		with app.test_client() as client:
+			response = client.get('/reader/access', headers=headers, content_type='application/json')
+			self.assert200(response)
+			data = json.loads(response.data.decode("utf-8"))
+			self.assertEqual([(data[text_id]["access"], data[text_id]["reachable"]) for text_id in room_text_ids],
+							 [(True, True), (True, True), (True, False)])
+
+
+	def test_map_etag(self):
+		""" test that the map is sent with an ETag, not sent again while it is unchanged and gzipped if accepted """
+		map_file = app.config["MAP_FILE"]
+		headers = self.login("c@c.c")
+		with tempfile.TemporaryDirectory() as folder, app.test_client() as client:
+			app.config["MAP_FILE"] = os.path.join(folder, "map_repr.pickle")
+			map_cache.reset()
+			try:
+				response = client.get('/reader/map', headers=headers)
+				self.assert200(response)
+				self.assertEqual(json.loads(response.data.decode("utf-8")), {})
+				empty_etag = response.headers["ETag"]
+
+				map_repr = {"isy": [{"x": 1, "y": 2, "width": 3, "height": 4}]}
+				self.assert200(client.post('/admin/map', data=json.dumps(map_repr), headers=headers,
+										   content_type='application/json'))
+				response = client.get('/reader/map', headers=dict(headers, **{"If-None-Match": empty_etag}))
+				self.assert200(response)
+				self.assertEqual(json.loads(response.data.decode("utf-8")), map_repr)
+				etag = response.headers["ETag"]
+				self.assertNotEqual(etag, empty_etag)
+
+				response = client.get('/reader/map', headers=dict(headers, **{"If-None-Match": etag}))
+				self.assertEqual((response.status_code, response.data), (304, b""))
+
+				gzip_headers = dict(headers, **{"Accept-Encoding": "gzip"})
+				response = client.get('/reader/map', headers=gzip_headers)
+				self.assertEqual(response.headers["Content-Encoding"], "gzip")
+				self.assertEqual(json.loads(gzip.decompress(response.data).decode("utf-8")), map_repr)
+				response = client.get('/reader/map', headers=dict(gzip_headers, **{"If-None-Match": response.headers["ETag"]}))
+				self.assertEqual(response.status_code, 304)
+			finally:
+				app.config["MAP_FILE"] = map_file
+				map_cache.reset()
+
+
+	def test_map_versions(self):
+		""" test that the map can be changed with JSON Patch and that clients can get only the changes """
+		map_file = app.config["MAP_FILE"]
+		headers = self.login("c@c.c")
+		with tempfile.TemporaryDirectory() as folder, app.test_client() as client:
+			app.config["MAP_FILE"] = os.path.join(folder, "map_repr.pickle")
+			map_cache.reset()
+			try:
+				isy = [{"x": 1, "y": 2, "width": 3, "height": 4}]
+				response = client.post('/admin/map', data=json.dumps({"isy": isy}), headers=headers,
+									   content_type='application/json')
+				self.assertEqual(json.loads(response.data.decode("utf-8"))["version"], 1)
+
+				def patch(version, operations):
+					return client.patch('/admin/map', data=json.dumps({"version": version, "operations": operations}),
+										headers=headers, content_type='application/json')
+
+				operations = [{"op": "add", "path": "/cyd", "value": isy}, {"op": "replace", "path": "/isy/0/x", "value": 5}]
+				response = patch(1, operations)
+				self.assert200(response)
+				self.assertEqual(json.loads(response.data.decode("utf-8"))["version"], 2)
+				self.assertStatus(patch(1, [{"op": "remove", "path": "/cyd"}]), 409)
+				self.assert400(patch(2, [{"op": "remove", "path": "/isy2"}]))
+				self.assert400(patch(2, [{"op": "move", "path": "/cyd"}]))
+
+				def since(version):
+					response = client.get('/reader/map', query_string={"since": version}, headers=headers)
+					self.assert200(response)
+					return json.loads(response.data.decode("utf-8"))
+
+				self.assertEqual(since(1), {"version": 2, "operations": operations})
+				self.assertEqual(since(0)["operations"], [{"op": "add", "path": "/isy", "value": isy}] + operations)
+				self.assertEqual(since(2), {"version": 2, "operations": []})
+				expected = {"isy": [dict(isy[0], x=5)], "cyd": isy}
+				self.assertEqual(since(3), {"version": 2, "map": expected})
+
+				response = client.get('/reader/map', headers=headers)
+				self.assertEqual(json.loads(response.data.decode("utf-8")), expected)
+				self.assertEqual(response.headers["X-Map-Version"], "2")
+			finally:
+				app.config["MAP_FILE"] = map_file
+				map_cache.reset()
+
+	def test_map_viewport(self):
+		""" test that only the shapes in the viewport are returned """
+		map_file = app.config["MAP_FILE"]
+		headers = self.login("c@c.c")
+		with tempfile.TemporaryDirectory() as folder, app.test_client() as client:
+			app.config["MAP_FILE"] = os.path.join(folder, "map_repr.pickle")
+			map_cache.reset()
+			try:
+				near = {"x": 0, "y": 0, "width": 10, "height": 10}
+				far = {"x": 1000, "y": 1000, "width": 10, "height": 10}
+				client.post('/admin/map', data=json.dumps({"isy": [near, far], "cyd": [far], "tema": [{"x": "a"}]}),
+							headers=headers, content_type='application/json')
+
+				def viewport(**query):
+					return client.get('/reader/map/viewport', query_string=query, headers=headers)
+
+				response = viewport(x=5, y=-5, width=20, height=5)
+				self.assert200(response)
+				self.assertEqual(json.loads(response.data.decode("utf-8")), {"version": 1, "map": {"isy": [near]}})
+				response = viewport(x=-1, y=-1, width=2000, height=2000)
+				self.assertEqual(json.loads(response.data.decode("utf-8"))["map"], {"isy": [near, far], "cyd": [far]})
+				response = viewport(x=100, y=100, width=10, height=10)
+				self.assertEqual(json.loads(response.data.decode("utf-8"))["map"], {})
+				self.assert400(viewport(x=0, y=0, width=10))
+				self.assert400(viewport(x=0, y=0, width=-10, height=10))
+
+				# A map with NaN or Infinity is refused before it is saved, huge rectangles are left out of the grid
+				for body in ('{"isy": [{"x": Infinity, "y": 0, "width": 10, "height": 10}]}',
+							 '{"isy": [{"x": 0, "y": NaN, "width": 10, "height": 10}]}'):
+					self.assert400(client.post('/admin/map', data=body, headers=headers,
+											   content_type='application/json'))
+				response = client.patch('/admin/map', data='{"version": 1, "operations": [{"op": "add", "path": '
+										'"/cyd/-", "value": {"x": -Infinity, "y": 0, "width": 1, "height": 1}}]}',
+										headers=headers, content_type='application/json')
+				self.assert400(response)
+				huge = {"x": 1e300, "y": -1e300, "width": 1e300, "height": 1e300}
+				client.post('/admin/map', data=json.dumps({"isy": [near, huge]}), headers=headers,
+							content_type='application/json')
+				response = viewport(x=5, y=-5, width=20, height=5)
+				self.assertEqual(json.loads(response.data.decode("utf-8")), {"version": 2, "map": {"isy": [near]}})
+			finally:
+				app.config["MAP_FILE"] = map_file
+				map_cache.reset()
+
 
 class ApproverRouteTest(BaseTestCase):
 	"""class for unittests for approver routes"""
@@ -360,6 +640,34 @@ class ApproverRouteTest(BaseTestCase):
 												content_type='application/json')
 						self.assert200(response2, "We get some data")
 
+	def test_approve_room_request_refreshes_access(self):
+		""" Test that approving a room the reader already has an entrance of keeps it with the new expiry."""
+		reader_email = self.get_new_random_email()
+		reader_headers = self.populate_reader(reader_email)[3]
+		approver_headers = self.login("b@b.b")
+
+		reader = Reader.query.filter_by(email=reader_email).first()
+		entrance = CardReader.query.filter_by(room_a_id=None, room_b_id=Room.query.filter_by(text_id="ing27").first().id) \
+			.first()
+		db.session.add(HasAccessTo(reader, entrance, date.today() + timedelta(days=1)))
+		db.session.commit()
+		reader_id, entrance_id = reader.id, entrance.id
+
+		with app.test_client() as client:
+			sent = json.dumps({"room_text_id": "ing27", "justification": "Because i can"})
+			self.assert200(client.post('/reader/room', data=sent, headers=reader_headers,
+									   content_type='application/json'))
+			request_id = RoomRequest.query.filter_by(reader_id=reader_id).first().id
+
+			sent = json.dumps({"request_id": request_id, "type": "Room", "is_access_granted": True})
+			response = client.post('approver/access', data=sent, headers=approver_headers,
+								   content_type='application/json')
+			self.assert200(response)
+
+		access = HasAccessTo.query.filter_by(reader_id=reader_id, card_reader_id=entrance_id).one()
+		self.assertGreater(access.expiration_datetime.date(), date.today() + timedelta(days=1))
+		self.assertEqual(materialized_access.check(), ([], []))
+
 	def test_approve_ag_request(self):
 		""" Test if its possible to approve ag request."""
 		reader_email = self.get_new_random_email()
@@ -390,6 +698,67 @@ class ApproverRouteTest(BaseTestCase):
 												content_type='application/json')
 						self.assert200(response2, "We get some data")
 
+	def test_bulk_decisions(self):
+		"""test that deciding many requests at once gives the same access as deciding them one at a time"""
+		approver_headers = self.login("b@b.b")
+		emails = [self.get_new_random_email(), self.get_new_random_email()]
+		for email in emails:
+			reader_headers = self.populate_reader(email)[3]
+			with app.test_client() as client:
+				# isy and cyd are next to the room of access group 1 and isy1 is next to isy
+				for room in ["isy", "isy1", "cyd"]:
+					client.post('/reader/room', data=json.dumps({"room_text_id": room, "justification": "test"}),
+								headers=reader_headers, content_type='application/json')
+				client.post('/reader/ag', data=json.dumps({"ag_id": 1, "justification": "test"}),
+							headers=reader_headers, content_type='application/json')
+
+		def orders(email):
+			with app.test_client() as client:
+				response = client.get("approver/orders?reader=" + email, headers=approver_headers)
+				return [(o["request_id"], o["type"]) for o in json.loads(response.data.decode("utf-8"))["orders"]]
+
+		def access(email):
+			reader_id = Reader.query.filter_by(email=email).first().id
+			return ({card_reader_id for (card_reader_id,) in
+					 db.session.query(HasAccessTo.card_reader_id).filter_by(reader_id=reader_id)},
+					{ag_id for (ag_id,) in db.session.query(BelongsTo.ag_id).filter_by(reader_id=reader_id)})
+
+		# The access group first, the rooms next to its room are then reached from it
+		one_at_a_time = sorted(orders(emails[0]), key=lambda order: order[1] != "AG")
+		together = orders(emails[1])
+		self.assertEqual(len(together), 4)
+		items = [{"request_id": request_id, "type": request_type, "is_access_granted": True}
+				 for request_id, request_type in together]
+		items += [{"request_id": together[0][0], "type": together[0][1], "is_access_granted": False},
+				  {"request_id": 0, "type": "Room", "is_access_granted": True},
+				  {"request_id": 1, "type": "Door", "is_access_granted": True}]
+
+		with app.test_client() as client:
+			for request_id, request_type in one_at_a_time:
+				client.post('approver/access', headers=approver_headers, content_type='application/json',
+							data=json.dumps({"request_id": request_id, "type": request_type, "is_access_granted": True}))
+			response = client.post('approver/access/bulk', data=json.dumps({"requests": items}),
+								   headers=approver_headers, content_type='application/json')
+			self.assert200(response)
+			results = json.loads(response.data.decode("utf-8"))["results"]
+			self.assertEqual([result["ok"] for result in results], [True] * 4 + [False] * 3)
+
+			response = client.post('approver/access/bulk', data=json.dumps({"requests": [{"request_id": 1}]}),
+								   headers=approver_headers, content_type='application/json')
+			self.assert400(response)
+
+			# A token with the approver role of an approver that is not in the database
+			token = create_access_token(self.get_new_random_email(), user_claims={"role": "approver", "reader_id": 0})
+			response = client.post('approver/access/bulk', data=json.dumps({"requests": items}),
+								   headers={'Authorization': 'Bearer {}'.format(token)},
+								   content_type='application/json')
+			self.assert400(response)
+
+		self.assertEqual(orders(emails[1]), [])
+		self.assertTrue(access(emails[1])[0])
+		self.assertEqual(access(emails[0]), access(emails[1]))
+		self.assertEqual(materialized_access.check(), ([], []))
+
 	def test_get_all_orders_for_logged_in(self):
 		""" Test to see all orders for current approver."""
 		reader_email = self.get_new_random_email()
@@ -452,6 +821,66 @@ class ApproverRouteTest(BaseTestCase):
 
 			self.assert200(response, "The request was from an approver/admin")
 
+	def test_search_readers(self):
+		"""test that readers are found by the start of their email, name and surname, also when added or deleted"""
+		reader_index.reset()
+		approver_headers = self.login("b@b.b")
+		admin_headers = self.login("c@c.c")
+		reader_email = self.get_new_random_email()
+
+		def search(query):
+			with app.test_client() as client:
+				response = client.get("approver/readers/search?" + query, headers=approver_headers)
+				return response.status_code, json.loads(response.data.decode("utf-8"))
+
+		status, result = search("q=" + reader_email[:5])
+		self.assertEqual(status, 200)
+		self.assertNotIn(reader_email, [reader["email"] for reader in result["readers"]])
+
+		self.populate_reader(reader_email)
+		status, result = search("q=" + reader_email)
+		self.assertEqual(result["readers"][0]["email"], reader_email)
+		status, result = search("q=TES testso&limit=50")
+		self.assertIn(reader_email, [reader["email"] for reader in result["readers"]])
+		self.assertTrue(all(reader["surname"].lower().startswith("testso") for reader in result["readers"]))
+		status, result = search("q=a&limit=2")
+		self.assertEqual(len(result["readers"]), 2)
+
+		with app.test_client() as client:
+			client.delete("admin/user/" + reader_email, headers=admin_headers)
+		status, result = search("q=" + reader_email)
+		self.assertEqual(result["readers"], [])
+		self.assertEqual(search("q=test&limit=0")[0], 400)
+
+	def test_search_readers_of_other_worker(self):
+		"""test that the index of another worker finds readers renamed after it was read, when it is read again"""
+		other = ReaderIndex()
+		reader_email = self.get_new_random_email()
+		self.populate_reader(reader_email)
+		self.assertEqual([r["email"] for r in other.search(reader_email)], [reader_email])
+
+		reader = Reader.query.filter_by(email=reader_email).first()
+		reader.name = "Renamedreader"
+		db.session.commit()
+		self.assertEqual(other.search("renamedreader"), [])
+
+		reload_interval, self.app.config["READER_SEARCH_RELOAD_INTERVAL"] = \
+			self.app.config["READER_SEARCH_RELOAD_INTERVAL"], 0
+		self.assertEqual([r["email"] for r in other.search("renamedreader")], [reader_email])
+		self.app.config["READER_SEARCH_RELOAD_INTERVAL"] = reload_interval
+
+	def test_search_readers_committed_late(self):
+		"""test that a reader whose id was skipped by a sync, because it was not committed yet, is found later"""
+		other = ReaderIndex()
+		other.search("a")
+		reader_email = self.get_new_random_email()
+		self.populate_reader(reader_email)
+		reader = Reader.query.filter_by(email=reader_email).first()
+		# A sync that read a higher id while the reader was not committed
+		other._rows.seen([reader.id + 1], timeout=60)
+		self.assertEqual([r["email"] for r in other.search(reader_email)], [reader_email])
+		self.assertNotIn(reader.id, other._rows.gaps)
+
 	def test_reject_room_request(self):
 		""" Test if its possible to reject room request."""
 		reader_email = self.get_new_random_email()
@@ -666,6 +1095,35 @@ class AdminRouteTest(BaseTestCase):
 			self.assertEqual(len(known_users), lenght_of_expected_list,
 							 "Checks that we find the 3 users always expected")
 
+	def test_readers_pages(self):
+		"""test that the readers read a page at a time are the same as all readers, with their roles"""
+		admin_headers = self.login("c@c.c")
+		self.populate_reader(self.get_new_random_email())  # after the admin by id, before it by role
+
+		def get(query):
+			with app.test_client() as client:
+				response = client.get("admin/readers?" + query, headers=admin_headers)
+				return response.status_code, json.loads(response.data.decode("utf-8"))
+
+		status, everything = get("")
+		self.assertEqual(status, 200)
+		self.assertNotIn("next_cursor", everything)
+		roles = {user["email"]: user["role"] for user in everything["users"]}
+		self.assertEqual([roles["a@a.a"], roles["b@b.b"], roles["c@c.c"]], ["reader", "approver", "admin"])
+		order = ["reader", "approver", "admin"]
+		self.assertEqual([user["role"] for user in everything["users"]],
+						 sorted(roles.values(), key=order.index), "check that all readers are grouped by role")
+
+		pages, cursor = [], ""
+		while cursor is not None:
+			status, page = get("limit=7&cursor=" + cursor)
+			self.assertLessEqual(len(page["users"]), 7)
+			pages += page["users"]
+			cursor = page["next_cursor"]
+		self.assertCountEqual(pages, everything["users"])
+		self.assertEqual(get("limit=0")[0], 400)
+		self.assertEqual(get("cursor=nonsense")[0], 400)
+
 	def test_upgrade_to_approver(self):
 		""" tests uppgrade to approver with a new reader"""
 		admin_headers = self.login("c@c.c")
@@ -749,6 +1207,51 @@ class AdminRouteTest(BaseTestCase):
 		approver = Admin.query.filter_by(email=approver_email).first()
 		self.assertNotEqual(approver, None, "check that reader now is admin")
 
+	def test_upgrade_revokes_token(self):
+		"""tests that the role in the token is checked and that old tokens are revoked when the role changes"""
+		admin_headers = self.login("c@c.c")
+
+		reader_email = self.get_new_random_email()
+		self.populate_reader(reader_email)
+		reader_header = self.login(reader_email)
+
+		with app.test_client() as client:
+			request = client.get('admin/readers', headers=reader_header)
+			self.assert400(request, "check that a reader can not use admin routes")
+
+			sent = json.dumps({"email": reader_email})
+			request = client.post('admin/upgrade_to_admin', data=sent, headers=admin_headers,
+								  content_type='application/json')
+			self.assert200(request, "check that request returns ok")
+
+			request = client.get('reader/self', headers=reader_header)
+			self.assert401(request, "check that the token with the old role is revoked")
+
+			request = client.get('admin/readers', headers=self.login(reader_email))
+			self.assert200(request, "check that a new token has the new role")
+
+	def test_deleted_reader_id_not_reused(self):
+		"""tests that a reader created after a deleted one does not get its id and its revoked tokens"""
+		admin_headers = self.login("c@c.c")
+		reader_email = self.get_new_random_email()
+		self.populate_reader(reader_email)
+		deleted_id = Reader.query.filter_by(email=reader_email).first().id
+
+		with app.test_client() as client:
+			request = client.delete('admin/user/{}'.format(reader_email), headers=admin_headers)
+			self.assert200(request, "check that the reader is deleted")
+
+		new_email = self.get_new_random_email()
+		self.populate_reader(new_email)
+		self.assertGreater(Reader.query.filter_by(email=new_email).first().id, deleted_id)
+		self.assert200(self.client.get('reader/self', headers=self.login(new_email)))
+
+		# A revocation that is rolled back is not kept in memory
+		reader = Reader.query.filter_by(email=new_email).first()
+		blacklist.revoke_reader_tokens(reader)
+		db.session.rollback()
+		self.assertEqual(blacklist.revocation_cache.reader_epoch(reader.id), 0)
+
 	def test_create_ag(self):
 		"""test to create an ag."""
 		# utökning:
@@ -758,6 +1261,7 @@ class AdminRouteTest(BaseTestCase):
 
 
 		admin_headers = self.login("c@c.c")
+		version, changes = building_graph.version, BuildingChange.query.count()
 		with app.test_client() as client:
 			sent = json.dumps({"ag_name": "test_ag",
 							   "approvers": ["b@b.b"],
@@ -771,6 +1275,92 @@ class AdminRouteTest(BaseTestCase):
 			)
 			self.assert200(request, "check that request returns ok")
 
+		# The card readers of the access group changed, not the building
+		self.assertEqual(BuildingChange.query.count(), changes)
+		self.assertEqual(building_graph.version, version)
+
+	def test_effective_access_consistent(self):
+		"""test that the effective access stays consistent when access groups and users change"""
+		admin_headers = self.login("c@c.c")
+		self.assertEqual(materialized_access.check(), ([], []), "check that the populated database is consistent")
+
+		# a generated reader (not an approver) that has some access
+		reader = next(r for r in Reader.query.filter(Reader.email.like("%@hotmail.com"))
+					  if Approver.query.get(r.id) is None)
+		self.assertNotEqual(EffectiveAccess.query.filter_by(reader_id=reader.id).count(), 0)
+
+		with app.test_client() as client:
+			sent = json.dumps({"ag_name": "test_ag",
+							   "approvers": ["b@b.b"],
+							   "room_text_ids": ["isy1", "isy2", "isy"]
+							   })
+			response = client.post('admin/ag', data=sent, headers=admin_headers, content_type='application/json')
+			self.assert200(response)
+			response = client.delete(url_for("admin.delete_user", reader_email=reader.email), headers=admin_headers)
+			self.assert200(response)
+
+		self.assertEqual(EffectiveAccess.query.filter_by(reader_id=reader.id).count(), 0)
+
+		self.assertEqual(materialized_access.check(), ([], []), "check that the changes updated the table")
+
+	def test_rebuild_empty_effective_access(self):
+		"""test that an effective_access table made for a database with access in it is filled when the server starts"""
+		self.assertFalse(materialized_access.rebuild_if_empty())
+		EffectiveAccess.query.delete()
+		db.session.commit()
+		self.assertTrue(materialized_access.rebuild_if_empty())
+		self.assertEqual(materialized_access.check(), ([], []))
+		self.assertGreater(EffectiveAccess.query.count(), 0)
+
+	def test_occupancy(self):
+		"""test that successful swipes move people between rooms and that the state can be replayed"""
+		admin_headers = self.login("c@c.c")
+		app.config["DOOR_CONTROLLER_KEY"] = "door-key"
+		sync_interval, app.config["OCCUPANCY_SYNC_INTERVAL"] = app.config["OCCUPANCY_SYNC_INTERVAL"], 0
+		swipe_log.init_app(app)
+		swipe_log.drop_days_before(date.today() + timedelta(days=1))
+		OccupancyCheckpoint.query.delete()
+		db.session.commit()
+		occupancy.reset()
+
+		a, b = Reader.query.filter_by(email="a@a.a").first(), Reader.query.filter_by(email="b@b.b").first()
+		door_1, door_2 = CardReader.query.filter(CardReader.room_b_id != None).limit(2).all()
+		room_1, room_2 = door_1.room_b.text_id, door_2.room_b.text_id
+		now = time.time()
+		swipes = [[a.card_id, door_1.id, now, True], [b.card_id, door_1.id, now, True],
+				  [a.card_id, door_2.id, now + 1, True], [b.card_id, door_2.id, now + 1, False]]
+
+		with app.test_client() as client:
+			client.post("door/swipes", data=json.dumps({"swipes": swipes}), headers={"X-Door-Key": "door-key"},
+						content_type="application/json")
+			swipe_log.flush()
+
+			# Without a checkpoint the occupancy is built in the background while requests are turned away
+			result = client.get("admin/rooms/occupancy", headers=admin_headers)
+			self.assertStatus(result, 503)
+			self.assertIn("Retry-After", result.headers)
+			occupancy.wait(10)
+			self.assertEqual(OccupancyCheckpoint.query.count(), 1)
+
+			result = client.get("admin/rooms/occupancy", headers=admin_headers)
+			self.assert200(result)
+			data = json.loads(result.data.decode("utf-8"))
+			self.assertEqual(data["inside"], 2)
+			self.assertEqual(data["occupancy"].get(room_2), 1 + (room_1 == room_2))
+
+			result = client.get("admin/evacuation", headers=admin_headers)
+			inside = {p["email"]: p["room"] for p in json.loads(result.data.decode("utf-8"))["inside"]}
+			self.assertEqual(inside, {"a@a.a": room_2, "b@b.b": room_1})
+
+		# The same state is rebuilt from the whole log and then from the checkpoint saved by the replay
+		counts = occupancy.counts()
+		self.assertEqual(occupancy.replay(from_scratch=True), len(swipes))
+		self.assertEqual(occupancy.counts(), counts)
+		occupancy.reset()
+		self.assertEqual(occupancy.replay(), 0)
+		self.assertEqual(occupancy.counts(), counts)
+		app.config["OCCUPANCY_SYNC_INTERVAL"] = sync_interval
+
 	def test_get_reader(self):
 		"""test to get a reader with get_reader"""
 		admin_headers = self.login("c@c.c")
@@ -945,6 +1535,46 @@ class AdminRouteTest(BaseTestCase):
 
 			self.assertStatus(result, 400)
 
+	def test_create_readers_bulk(self):
+		"""test to import readers from CSV, the bad rows are reported and the good ones created"""
+		admin_headers = self.login("c@c.c")
+		emails = [self.get_new_random_email() for i in range(3)]
+		sent = "email,name,surname,password\n" \
+			"{},Anna,Berg,abcABC123\n" \
+			"{},Bo,Ek,bad\n" \
+			"{},Cia,Lind,abcABC123\n" \
+			"c@c.c,Dan,Holm,abcABC123\n".format(*emails)
+
+		with app.test_client() as client:
+			result = client.post(
+				"admin/readers/bulk",
+				headers=admin_headers,
+				data=sent,
+				content_type="text/csv",
+			)
+			self.assert200(result)
+			report = json.loads(result.data.decode("utf-8"))
+			self.assertEqual(report["created"], 2)
+			self.assertEqual([row["line"] for row in report["failed"]], [3, 5])
+
+		self.assertNotEqual(Reader.query.filter_by(email=emails[0]).first(), None)
+		self.assertEqual(Reader.query.filter_by(email=emails[1]).first(), None)
+		self.assertNotEqual(Reader.query.filter_by(email=emails[2]).first(), None)
+
+		# The imported readers can log in
+		self.login(emails[2])
+
+		# Larger imports are hashed in one pool of processes, shared by the imports that follow
+		for i in range(2):
+			lines = [json.dumps({"email": self.get_new_random_email(), "name": "Eva", "surname": "Falk",
+								 "password": "abcABC123"}) for j in range(bulk_import.IN_PROCESS_HASHES)]
+			pool = bulk_import._pool
+			self.assertEqual(bulk_import.import_readers(lines, "jsonl")["created"], len(lines))
+			self.assertIsNotNone(bulk_import._pool)
+			if i:
+				self.assertIs(bulk_import._pool, pool)
+		self.login(self.get_old_email())
+
 	def test_get_all_orders(self):
 		"""test to get all orders with test_get_all_orders"""
 		admin_headers = self.login("c@c.c")
@@ -956,6 +1586,88 @@ class AdminRouteTest(BaseTestCase):
 			)
 			self.assert200(request, "check that request returns ok")
 
+	def test_orders_query_count(self):
+		"""test that the number of queries for the orders does not grow with the number of orders"""
+		admin_headers = self.login("c@c.c")
+		approver_headers = self.login("b@b.b")
+		statements = []
+
+		def count(url, headers):
+			with app.test_client() as client:
+				del statements[:]
+				self.assert200(client.get(url, headers=headers))
+				return len(statements)
+
+		def add_orders(n):
+			approver = Approver.query.filter_by(email="b@b.b").first()
+			readers = Reader.query.limit(n).all()
+			rooms, ags = Room.query.limit(n).all(), AccessGroup.query.limit(n).all()
+			for i in range(n):
+				room_request = RoomRequest(readers[i], rooms[i % len(rooms)], "test")
+				ag_request = AccessGroupRequest(readers[i], ags[i % len(ags)], "test")
+				db.session.add_all([room_request, ag_request, ApprovesRoomRequest(room_request, approver),
+									ApprovesAgRequest(ag_request, approver)])
+			db.session.commit()
+
+		def listener(conn, cursor, statement, *args):
+			statements.append(statement)
+
+		# The statements of every engine are counted, the test client uses another app than the test case
+		event.listen(Engine, "before_cursor_execute", listener)
+		try:
+			add_orders(2)
+			count("admin/orders", admin_headers), count("approver/orders", approver_headers)  # warm up the caches
+			before = [count("admin/orders", admin_headers), count("approver/orders", approver_headers)]
+			add_orders(20)
+			after = [count("admin/orders", admin_headers), count("approver/orders", approver_headers)]
+		finally:
+			event.remove(Engine, "before_cursor_execute", listener)
+		self.assertEqual(before, after)
+
+	def test_orders_pages_and_filters(self):
+		"""test that the orders read a page at a time are the same as all orders, and the filters"""
+		admin_headers = self.login("c@c.c")
+		approver = Approver.query.filter_by(email="b@b.b").first()
+		readers, rooms, ags = Reader.query.limit(10).all(), Room.query.limit(3).all(), AccessGroup.query.limit(3).all()
+		for i, reader in enumerate(readers):
+			room_request = RoomRequest(reader, rooms[i % 3], "test")
+			ag_request = AccessGroupRequest(reader, ags[i % 3], "test")
+			db.session.add_all([room_request, ag_request, ApprovesRoomRequest(room_request, approver),
+								ApprovesAgRequest(ag_request, approver)])
+		db.session.commit()
+		email, room = readers[0].email, rooms[0].text_id
+
+		def get(query):
+			with app.test_client() as client:
+				response = client.get("admin/orders?" + query, headers=admin_headers)
+				return response.status_code, json.loads(response.data.decode("utf-8"))
+
+		status, everything = get("")
+		self.assertEqual(status, 200)
+		self.assertNotIn("next_cursor", everything)
+
+		pages, cursor = [], ""
+		while cursor is not None:
+			status, page = get("limit=3&cursor=" + cursor)
+			self.assertLessEqual(len(page["orders"]), 3)
+			pages += page["orders"]
+			cursor = page["next_cursor"]
+		# The pages are ordered by time, the whole list has the room requests first
+		self.assertEqual(sorted(pages, key=lambda o: o["type"] == "AG"), everything["orders"])
+		types = [o["type"] for o in everything["orders"]]
+		self.assertEqual(types, sorted(types, key=lambda t: t == "AG"))
+
+		status, page = get("type=AG&reader=" + email)
+		self.assertTrue(page["orders"])
+		self.assertTrue(all(o["type"] == "AG" and o["reader"]["email"] == email for o in page["orders"]))
+		status, page = get("room=" + room)
+		self.assertTrue(all(o["type"] == "Room" and o["room_id"] == room for o in page["orders"]))
+		self.assertEqual(len([o for o in page["orders"] if o["justification"] == "test"]), 4)
+		status, page = get("to=2000-01-01")
+		self.assertEqual(page["orders"], [])
+		self.assertEqual(get("limit=0")[0], 400)
+		self.assertEqual(get("cursor=nonsense")[0], 400)
+
 	def test_remove_ag(self):
 		""" test to remove ag from approvers approval area with ermove_ag"""
 		# utökning: kolla approvers yta innan och efter
@@ -987,3 +1699,175 @@ class AdminRouteTest(BaseTestCase):
 				content_type='application/json',
 			)
 			self.assert200(request, "check that request returns ok")
+
+
+class DoorRouteTest(BaseTestCase):
+	"""class for unittests for door controller routes"""
+
+	def swipe(self, client, card_reader_id, card_id, key="door-key"):
+		"""swipes a card at a card reader"""
+		return client.post(
+			"door/{}/swipe".format(card_reader_id),
+			data=json.dumps({"card_id": card_id}),
+			headers={"X-Door-Key": key},
+			content_type="application/json",
+		)
+
+	def test_swipe(self):
+		"""test that a card opens the card readers the reader has access to, until the card is removed"""
+		app.config["DOOR_CONTROLLER_KEY"] = "door-key"
+		reader = Reader.query.filter_by(email="a@a.a").first()
+		allowed = {a.card_reader_id for a in EffectiveAccess.query.filter_by(reader_id=reader.id)}
+		not_allowed = EffectiveAccess.query.filter(~EffectiveAccess.card_reader_id.in_(allowed)).first()
+
+		with app.test_client() as client:
+			self.assert401(self.swipe(client, min(allowed), reader.card_id, key="wrong"))
+
+			result = self.swipe(client, min(allowed), reader.card_id)
+			self.assert200(result)
+			self.assertTrue(json.loads(result.data.decode("utf-8"))["allowed"])
+
+			result = self.swipe(client, not_allowed.card_reader_id, reader.card_id)
+			self.assertFalse(json.loads(result.data.decode("utf-8"))["allowed"])
+
+			result = self.swipe(client, min(allowed), "not a card")
+			self.assertFalse(json.loads(result.data.decode("utf-8"))["allowed"])
+
+			# The index is updated when the card is removed
+			card_id = reader.card_id
+			client.delete("admin/card/a@a.a", headers=self.login("c@c.c"))
+			result = self.swipe(client, min(allowed), card_id)
+			self.assertFalse(json.loads(result.data.decode("utf-8"))["allowed"])
+
+	def test_index_of_other_worker(self):
+		"""test that an index that was not told about a change reads it from the access changes"""
+		reader = Reader.query.filter_by(email="a@a.a").first()
+		card_id = reader.card_id
+		card_reader_id = EffectiveAccess.query.filter_by(reader_id=reader.id).first().card_reader_id
+		other_index = AccessIndex()  # the index of another worker, not marked when this process commits
+		self.assertTrue(other_index.is_allowed(card_id, card_reader_id))
+
+		with app.test_client() as client:
+			self.assert200(client.delete("admin/card/a@a.a", headers=self.login("c@c.c")))
+
+		# The index is used in the app of the test case, the changes are read at once
+		interval, self.app.config["DOOR_SYNC_INTERVAL"] = self.app.config["DOOR_SYNC_INTERVAL"], 0
+		try:
+			self.assertFalse(other_index.is_allowed(card_id, card_reader_id))
+		finally:
+			self.app.config["DOOR_SYNC_INTERVAL"] = interval
+
+	def test_allowlist_and_sync(self):
+		"""test that a controller gets its allow-list and then the changes after its version"""
+		app.config["DOOR_CONTROLLER_KEY"] = "door-key"
+		headers = {"X-Door-Key": "door-key"}
+		reader = Reader.query.filter_by(email="a@a.a").first()
+		card_reader_id = EffectiveAccess.query.filter_by(reader_id=reader.id).first().card_reader_id
+		card_id = reader.card_id
+
+		with app.test_client() as client:
+			result = client.get("door/{}/allowlist".format(card_reader_id), headers=headers)
+			self.assert200(result)
+			version, cards = door_sync.parse_allowlist(result.data)
+			self.assertIn(card_id, cards)
+			self.assertEqual(str(version), result.headers["X-Access-Version"])
+
+			result = client.get("door/sync?since={}&card_reader_id={}".format(version, card_reader_id),
+								headers=headers)
+			self.assertEqual(json.loads(result.data.decode("utf-8"))["changes"], [])
+
+			client.delete("admin/card/a@a.a", headers=self.login("c@c.c"))
+
+			result = client.get("door/sync?since={}&card_reader_id={}".format(version, card_reader_id),
+								headers=headers)
+			feed = json.loads(result.data.decode("utf-8"))
+			self.assertEqual([(c["kind"], c["card_id"]) for c in feed["changes"]], [("block", card_id)])
+			self.assertGreater(feed["version"], version)
+
+	def test_sync_waits_for_missing_versions(self):
+		"""test that rows committed with a lower id than rows already read are not skipped"""
+		watermark = IdWatermark()
+		watermark.seen([1, 2, 5], timeout=60)
+		self.assertEqual((watermark.last_id, watermark.gaps, watermark.safe_id), (5, [3, 4], 2))
+		watermark.seen([4], timeout=60)
+		self.assertEqual((watermark.gaps, watermark.safe_id), ([3], 2))
+		watermark.seen([6], timeout=0)  # the gaps have timed out
+		self.assertEqual((watermark.last_id, watermark.gaps), (6, []))
+
+		# A controller is not moved past a recent missing version, version 4 may still be committed
+		start = door_sync.current_version()
+		now = datetime.now()
+		db.session.add_all([AccessChange(version=start + v, kind="reset", changed=now) for v in (1, 2, 3, 5)])
+		db.session.commit()
+		self.assertEqual(door_sync._committed_version(start, start + 5, 60), start + 3)
+		self.assertEqual(door_sync._committed_version(start, start + 5, 0), start + 5)
+		AccessChange.query.filter(AccessChange.version > start).update({"changed": now - timedelta(minutes=5)})
+		db.session.commit()
+		self.assertEqual(door_sync._committed_version(start, start + 5, 60), start + 5)
+
+	def test_check(self):
+		"""test that many cards and card readers are checked at once, at the given times"""
+		app.config["DOOR_CONTROLLER_KEY"] = "door-key"
+		headers = {"X-Door-Key": "door-key"}
+		reader = Reader.query.filter_by(email="a@a.a").first()
+		access = EffectiveAccess.query.filter_by(reader_id=reader.id).first()
+		allowed = {a.card_reader_id for a in EffectiveAccess.query.filter_by(reader_id=reader.id)}
+		not_allowed = EffectiveAccess.query.filter(~EffectiveAccess.card_reader_id.in_(allowed)).first()
+		now = int(time.time())
+		checks = [[reader.card_id, access.card_reader_id, now],
+				  [reader.card_id, not_allowed.card_reader_id, now],
+				  ["not a card", access.card_reader_id, now],
+				  [reader.card_id, access.card_reader_id, access.expires.timestamp() + 1]]
+
+		with app.test_client() as client:
+			result = client.post("door/check", data=json.dumps({"checks": checks}), headers=headers,
+								 content_type="application/json")
+			self.assert200(result)
+			self.assertEqual(json.loads(result.data.decode("utf-8"))["results"], [True, False, False, False])
+
+			result = client.post("door/check", data=json.dumps({"checks": [["card", "door", now]]}), headers=headers,
+								 content_type="application/json")
+			self.assert400(result)
+
+	def test_swipes(self):
+		"""test that swipes are buffered, written to the table of their day and refused when the log is behind"""
+		app.config["DOOR_CONTROLLER_KEY"] = "door-key"
+		headers = {"X-Door-Key": "door-key"}
+		# The swipe log of the app used by the client, without the swipes of earlier runs
+		swipe_log.init_app(app)
+		swipe_log.drop_days_before(date.today() + timedelta(days=1))
+		now = time.time()
+		swipes = [["card1", 1, now, True], ["card2", 2, now + 1, False]]
+
+		with app.test_client() as client:
+			result = client.post("door/swipes", data=json.dumps({"swipes": swipes}), headers=headers,
+								 content_type="application/json")
+			self.assertStatus(result, 202)
+			swipe_log.flush()
+			self.assertEqual(swipe_log.swipes_of_day(date.today()), [tuple(s) for s in swipes])
+			self.assertEqual(swipe_log.swipes_of_day(date.today(), card_reader_id=2), [tuple(swipes[1])])
+
+			max_size, app.config["SWIPE_BUFFER_MAX"] = app.config["SWIPE_BUFFER_MAX"], 1
+			result = client.post("door/swipes", data=json.dumps({"swipes": swipes}), headers=headers,
+								 content_type="application/json")
+			self.assertStatus(result, 503)
+			self.assertIn("Retry-After", result.headers)
+			self.assertEqual(swipe_log.pending(), 0)
+			app.config["SWIPE_BUFFER_MAX"] = max_size
+
+			result = client.post("door/swipes", data=json.dumps({"swipes": [["card1", 1, now]]}), headers=headers,
+								 content_type="application/json")
+			self.assert400(result)
+
+			# Timestamps that are not a time the controller can have swiped at are refused
+			for timestamp in [float("nan"), float("inf"), 1e20, -1e13, now - 30 * 24 * 3600, now + 3600]:
+				result = client.post("door/swipes", data=json.dumps({"swipes": [["card1", 1, timestamp, True]]}),
+									 headers=headers, content_type="application/json")
+				self.assert400(result)
+
+		# A swipe that can not be written is set aside, the swipes after it are still written
+		swipe_log.add([["card3", 1, float("nan"), True], ["card4", 1, now + 2, True]])
+		self.assertEqual(swipe_log.flush(), 1)
+		self.assertEqual(swipe_log.pending(), 0)
+		self.assertEqual(swipe_log.rejected()[-1][0], "card3")
+		self.assertIn(("card4", 1, now + 2, True), swipe_log.swipes_of_day(date.fromtimestamp(now + 2)))
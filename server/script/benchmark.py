@@ -0,0 +1,28 @@
+"""
+Small helpers shared by the benchmark scripts in this folder.
+"""
+from time import perf_counter
+
+
+def measure(function, n):
+	"""Calls function n times and returns a list of the durations in seconds"""
+	durations = []
+	for i in range(n):
+		start = perf_counter()
+		function()
+		durations.append(perf_counter() - start)
+	return durations
+
+
+def percentile(durations, p):
+	"""Returns the p:th percentile of a list of durations"""
+	ordered = sorted(durations)
+	index = min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))
+	return ordered[index]
+
+
+def report(name, durations):
+	"""Prints mean, median and 99th percentile of the durations in milliseconds"""
+	mean = sum(durations) / len(durations)
+	print("{:<40} n={:<7} mean={:8.3f}ms p50={:8.3f}ms p99={:8.3f}ms".format(
+		name, len(durations), mean * 1000, percentile(durations, 50) * 1000, percentile(durations, 99) * 1000))
@@ -0,0 +1,95 @@
+"""
+Benchmark of get_all_access_helper for a building with thousands of rooms and a reader with hundreds of grants.
+The room lookup as it was before (a scan of the grant lists for every room) is timed next to the dict index.
+
+Note that this resets the configured database, just like create_db_data.py.
+Run from the server folder with: python -m script.benchmark_access
+"""
+from datetime import datetime, timedelta
+
+from script.benchmark import measure, report
+from visualize import create_app, materialized_access
+from visualize.blueprints.reader import get_all_access_helper, _access_by_room_helper
+from visualize.models import db, Reader, Room, CardReader, HasAccessTo, AccessGroup, BelongsTo, gives_access_to, \
+	EffectiveAccess
+
+app = create_app()
+app.app_context().push()
+
+ROOMS = 5000
+ROOM_GRANTS = 300
+ACCESS_GROUPS = 10
+ROOMS_PER_AG = 20
+REQUESTS = 20
+
+
+def setup():
+	"""Creates the rooms with one card reader each and a reader with access to some of them"""
+	db.session.remove()
+	db.drop_all()
+	db.create_all()
+	expires = datetime.now() + timedelta(days=90)
+
+	db.session.bulk_insert_mappings(Room, [{"id": i, "name": "Room {}".format(i), "text_id": "R{}".format(i)}
+										   for i in range(1, ROOMS + 1)])
+	db.session.bulk_insert_mappings(CardReader, [{"id": i, "room_a_id": 1, "room_b_id": i}
+												 for i in range(1, ROOMS + 1)])
+	reader = Reader("bench@bench.se", "abcABC123", "Bench", "Mark")
+	db.session.add(reader)
+	db.session.flush()
+
+	# direct grants spread over the building
+	step = ROOMS // ROOM_GRANTS
+	db.session.bulk_insert_mappings(HasAccessTo, [
+		{"reader_id": reader.id, "card_reader_id": i, "expiration_datetime": expires}
+		for i in range(1, ROOMS + 1, step)])
+
+	# access groups covering consecutive rooms
+	for ag_id in range(1, ACCESS_GROUPS + 1):
+		db.session.add(AccessGroup("Group {}".format(ag_id)))
+		db.session.flush()
+		first = ag_id * ROOMS_PER_AG * 7
+		db.session.execute(gives_access_to.insert(), [{"ag_id": ag_id, "cr_id": cr_id}
+													  for cr_id in range(first, first + ROOMS_PER_AG)])
+		db.session.add(BelongsTo(reader, AccessGroup.query.get(ag_id), expires))
+	materialized_access.rebuild()
+	db.session.commit()
+
+
+def scan_lookup(grants, rooms):
+	"""The lookup before the index: the grant list is scanned for every room"""
+	for room in rooms:
+		for grant in grants:
+			if grant[0] == room:
+				break
+
+
+def index_lookup(access, rooms):
+	"""The lookup with the index: the access is put in a dict once and every room is found in constant time"""
+	by_room = _access_by_room_helper(access)
+	for room in rooms:
+		by_room.get(room.id)
+
+
+def run():
+	setup()
+	rooms = Room.query.all()
+	grants = db.session.query(Room, HasAccessTo) \
+		.join(CardReader, CardReader.room_b_id == Room.id) \
+		.join(HasAccessTo, HasAccessTo.card_reader_id == CardReader.id) \
+		.all()
+	print("{} rooms, {} direct grants, {} access groups".format(len(rooms), len(grants), ACCESS_GROUPS))
+
+	report("room lookup scan (before)", measure(lambda: scan_lookup(grants, rooms), REQUESTS))
+	access = EffectiveAccess.query.all()
+	report("room lookup index (after)", measure(lambda: index_lookup(access, rooms), REQUESTS))
+
+	filter_rooms = ["R{}".format(i) for i in range(1, ROOMS + 1, 2)]
+	with app.test_request_context("/reader/access"):
+		report("get_all_access_helper", measure(lambda: get_all_access_helper("bench@bench.se"), REQUESTS))
+		report("get_all_access_helper with filter",
+			   measure(lambda: get_all_access_helper("bench@bench.se", filter_rooms), REQUESTS))
+
+
+if __name__ == "__main__":
+	run()
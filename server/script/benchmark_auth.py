@@ -0,0 +1,74 @@
+"""
+Benchmark of the per-request authentication overhead with and without the revocation cache,
+and of the blueprint guards before and after the token is decoded only once per request.
+
+Note that this resets the configured database, just like create_db_data.py.
+Run from the server folder with: python -m script.benchmark_auth
+"""
+import uuid
+from datetime import datetime, timedelta
+
+from flask import request
+from flask_jwt_extended import create_access_token, decode_token, get_jwt_identity, verify_jwt_in_request
+
+from script.benchmark import measure, report
+from visualize import create_app
+from visualize.auth import current_auth, has_role
+from visualize.models import db, Reader, Approver, blacklist
+from visualize.models.blacklist import Blacklist
+
+app = create_app()
+app.app_context().push()
+
+REQUESTS = 500
+
+
+def setup(revoked_tokens):
+	"""Creates a reader and fills the blacklist with the given number of revoked tokens"""
+	db.session.remove()
+	db.drop_all()
+	db.create_all()
+	db.session.add(Approver("bench@bench.se", "abcABC123", "Bench", "Mark"))
+	expires = datetime.now() + timedelta(days=1)
+	db.session.bulk_insert_mappings(Blacklist, [{"jti": str(uuid.uuid4()), "expires": expires}
+												for i in range(revoked_tokens)])
+	db.session.commit()
+	blacklist.revocation_cache.load()
+	return {"Authorization": "Bearer {}".format(create_access_token(identity="bench@bench.se"))}
+
+
+def old_guard():
+	"""The approver guard as it was before the auth context: verify, decode again and query the role"""
+	verify_jwt_in_request()
+	email = decode_token(request.headers.get("Authorization")[7:])["identity"]
+	Approver.query.filter_by(email=email).first()
+	return get_jwt_identity()  # the handler reading the identity
+
+
+def new_guard():
+	"""The approver guard using the auth context, the token is decoded once and the role read from the claims"""
+	has_role(current_auth(), "approver")
+	return current_auth().identity  # the handler reading the identity
+
+
+def run_guards(headers):
+	for name, guard in [("guard before", old_guard), ("guard after", new_guard)]:
+		def request_with_guard():
+			with app.test_request_context("/approver/orders", headers=headers):
+				guard()
+		report(name, measure(request_with_guard, REQUESTS))
+
+
+def run():
+	client = app.test_client()
+	for revoked_tokens in [0, 10000, 100000]:
+		headers = setup(revoked_tokens)
+		for cache in [False, True]:
+			app.config["JWT_BLACKLIST_CACHE"] = cache
+			durations = measure(lambda: client.get("/reader/self", headers=headers), REQUESTS)
+			report("blacklist={} cache={}".format(revoked_tokens, cache), durations)
+	run_guards(setup(0))
+
+
+if __name__ == "__main__":
+	run()
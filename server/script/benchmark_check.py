@@ -0,0 +1,77 @@
+"""
+Benchmark of the batched access checks at /door/check with 10k (card, card reader, time) checks per call.
+
+Note that this resets the configured database, just like create_db_data.py.
+Run from the server folder with: python -m script.benchmark_check
+"""
+import json
+import time
+import uuid
+from datetime import datetime, timedelta
+from random import Random
+
+from sqlalchemy import event
+
+from script.benchmark import measure, report
+from visualize import create_app, materialized_access, password_hashing
+from visualize.models import db, Reader, Room, CardReader, HasAccessTo
+
+app = create_app()
+app.app_context().push()
+app.config["DOOR_CONTROLLER_KEY"] = "benchmark"
+
+READERS = 10000
+CARD_READERS = 1000
+ACCESS_PER_READER = 10
+CHECKS_PER_CALL = 10000
+CALLS = 10
+
+
+def setup():
+	"""Creates the readers and card readers and gives every reader access to some of the card readers"""
+	db.session.remove()
+	db.drop_all()
+	db.create_all()
+	random = Random(1)
+	expires = datetime.now() + timedelta(days=90)
+
+	db.session.bulk_insert_mappings(Room, [{"id": i, "name": "Room {}".format(i), "text_id": "R{}".format(i)}
+										   for i in range(1, CARD_READERS + 1)])
+	db.session.bulk_insert_mappings(CardReader, [{"id": i, "room_a_id": 1, "room_b_id": i}
+												 for i in range(1, CARD_READERS + 1)])
+	pw_hash = password_hashing.generate_password_hash("abcABC123")
+	db.session.bulk_insert_mappings(Reader, [
+		{"id": i, "email": "bench{}@bench.se".format(i), "password": pw_hash, "name": "Bench", "surname": "Mark",
+		 "card_id": uuid.uuid4().hex, "token_epoch": 0} for i in range(1, READERS + 1)])
+	db.session.bulk_insert_mappings(HasAccessTo, [
+		{"reader_id": reader_id, "card_reader_id": card_reader_id, "expiration_datetime": expires}
+		for reader_id in range(1, READERS + 1)
+		for card_reader_id in random.sample(range(1, CARD_READERS + 1), ACCESS_PER_READER)])
+	materialized_access.rebuild()
+	db.session.commit()
+
+
+def run():
+	setup()
+	random = Random(2)
+	cards = [card_id for (card_id,) in db.session.query(Reader.card_id)]
+	now = int(time.time())
+	body = json.dumps({"checks": [[random.choice(cards), random.randint(1, CARD_READERS), now]
+								  for i in range(CHECKS_PER_CALL)]})
+	db.session.remove()
+
+	statements = []
+	event.listen(db.engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+
+	client = app.test_client()
+	headers = {"X-Door-Key": "benchmark"}
+	durations = measure(lambda: client.post("/door/check", data=body, headers=headers,
+											content_type="application/json"), CALLS)
+
+	print("{} queries per call".format(len(statements) // CALLS))
+	report("{} checks per call".format(CHECKS_PER_CALL), durations)
+	print("{:.0f} checks/s".format(CHECKS_PER_CALL * CALLS / sum(durations)))
+
+
+if __name__ == "__main__":
+	run()
@@ -0,0 +1,117 @@
+"""
+Benchmark of an approver clearing a backlog of requests, one request at a time with /approver/access and all at once
+with /approver/access/bulk.
+
+The building is a lobby with an entrance and rooms around it, every reader can get into the lobby through an access
+group. The readers have requested rooms and access groups, the same backlog is decided both ways and the access the
+readers end up with is compared.
+Note that this resets the configured database, just like create_db_data.py.
+Run from the server folder with: python -m script.benchmark_decisions
+"""
+import json
+from datetime import datetime, timedelta
+from random import Random
+from time import perf_counter
+
+from flask_jwt_extended import create_access_token
+
+from visualize import create_app, password_hashing, materialized_access
+from visualize.models import db, Reader, Approver, Room, CardReader, AccessGroup, BelongsTo, HasAccessTo, \
+	RoomRequest, AccessGroupRequest, ApprovesRoomRequest, ApprovesAgRequest, gives_access_to
+
+app = create_app()
+app.app_context().push()
+
+ROOMS = 500
+READERS = 1000
+AGS = 20
+BACKLOG = [50, 200, 1000]  # number of requests, a fifth of them for access groups
+
+
+def setup(requests):
+	"""Creates the building, the readers and the backlog of requests waiting for reader 1"""
+	db.session.remove()
+	db.drop_all()
+	db.create_all()
+	random = Random(1)
+	expires = datetime.now() + timedelta(days=90)
+
+	# Room 1 is the lobby, card reader 1 is its entrance and the other rooms have a door each way to it
+	db.session.bulk_insert_mappings(Room, [{"id": i, "name": "Room {}".format(i), "text_id": "R{}".format(i)}
+										   for i in range(1, ROOMS + 1)])
+	card_readers = [{"room_a_id": None, "room_b_id": 1}]
+	for i in range(2, ROOMS + 1):
+		card_readers += [{"room_a_id": 1, "room_b_id": i}, {"room_a_id": i, "room_b_id": 1}]
+	db.session.bulk_insert_mappings(CardReader, card_readers)
+
+	# Access group 1 opens the entrance, the others a few rooms each
+	db.session.bulk_insert_mappings(AccessGroup, [{"id": i, "name": "AG {}".format(i)} for i in range(1, AGS + 1)])
+	db.session.execute(gives_access_to.insert(), [{"ag_id": 1, "cr_id": 1}] + [
+		{"ag_id": ag_id, "cr_id": cr_id} for ag_id in range(2, AGS + 1)
+		for cr_id in random.sample(range(2, len(card_readers) + 1), 5)])
+
+	pw_hash = password_hashing.generate_password_hash("abcABC123")
+	db.session.bulk_insert_mappings(Reader, [
+		{"id": i, "email": "bench{}@bench.se".format(i), "password": pw_hash, "name": "Bench", "surname": "Mark",
+		 "token_epoch": 0} for i in range(1, READERS + 1)])
+	db.session.execute(Approver.__table__.insert(), [{"reader_id": 1}])
+	db.session.bulk_insert_mappings(BelongsTo, [{"reader_id": i, "ag_id": 1, "expiration_datetime": expires}
+												for i in range(1, READERS + 1)])
+
+	# One request for every reader and room or access group, in a random order
+	room_requests = random.sample([(reader_id, room_id) for reader_id in range(2, READERS + 1)
+								   for room_id in range(2, ROOMS + 1)], requests - requests // 5)
+	ag_requests = random.sample([(reader_id, ag_id) for reader_id in range(2, READERS + 1)
+								 for ag_id in range(2, AGS + 1)], requests // 5)
+	db.session.bulk_insert_mappings(RoomRequest, [
+		{"id": i, "reader_id": reader_id, "room_id": room_id, "justification": "benchmark"}
+		for i, (reader_id, room_id) in enumerate(room_requests, start=1)])
+	db.session.bulk_insert_mappings(ApprovesRoomRequest, [
+		{"room_request_id": i, "approver_id": 1, "start_datetime": datetime.now()}
+		for i in range(1, len(room_requests) + 1)])
+	db.session.bulk_insert_mappings(AccessGroupRequest, [
+		{"id": i, "reader_id": reader_id, "ag_id": ag_id, "justification": "benchmark"}
+		for i, (reader_id, ag_id) in enumerate(ag_requests, start=1)])
+	db.session.bulk_insert_mappings(ApprovesAgRequest, [
+		{"ag_request_id": i, "approver_id": 1, "start_datetime": datetime.now()}
+		for i in range(1, len(ag_requests) + 1)])
+	db.session.commit()
+	materialized_access.rebuild()
+	db.session.commit()
+
+	# The access groups first, as the bulk decision does
+	return [{"request_id": i, "type": "AG", "is_access_granted": True} for i in range(1, len(ag_requests) + 1)] + \
+		[{"request_id": i, "type": "Room", "is_access_granted": True} for i in range(1, len(room_requests) + 1)]
+
+
+def access():
+	"""Returns the direct access and access groups of all readers"""
+	return set(db.session.query(HasAccessTo.reader_id, HasAccessTo.card_reader_id)), \
+		set(db.session.query(BelongsTo.reader_id, BelongsTo.ag_id))
+
+
+def run():
+	client = app.test_client()
+	for requests in BACKLOG:
+		items = setup(requests)
+		headers = {"Authorization": "Bearer {}".format(create_access_token(identity="bench1@bench.se"))}
+		start = perf_counter()
+		for item in items:
+			client.post("/approver/access", data=json.dumps(item), headers=headers, content_type="application/json")
+		one_at_a_time = perf_counter() - start
+		expected = access()
+
+		setup(requests)
+		start = perf_counter()
+		response = client.post("/approver/access/bulk", data=json.dumps({"requests": items}), headers=headers,
+							   content_type="application/json")
+		together = perf_counter() - start
+		assert all(result["ok"] for result in json.loads(response.data.decode("utf-8"))["results"])
+		assert access() == expected and materialized_access.check() == ([], [])
+
+		print("{} requests: one at a time {:.0f}ms, all at once {:.0f}ms".format(
+			requests, one_at_a_time * 1000, together * 1000))
+
+
+if __name__ == "__main__":
+	run()
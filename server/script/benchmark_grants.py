@@ -0,0 +1,130 @@
+"""
+Benchmark of the access given when a room request is approved, in a large building.
+
+The building is a grid of rooms with a door each way between rooms next to each other and entrances along one side,
+the readers can open every door through an access group. Rooms are approved for one reader the way it was done before
+(the doors found with three queries and added one object at a time) and for another reader with the INSERT ... SELECT
+of access_grants.py, both using the card reader indexes. Every approval is committed, as in
+/approver/access.
+Note that this resets the configured database, just like create_db_data.py.
+Run from the server folder with: python -m script.benchmark_grants
+"""
+from datetime import date, timedelta
+from random import Random
+
+from sqlalchemy import and_, or_
+
+from script.benchmark import measure, report
+from visualize import create_app, password_hashing
+from visualize.access_grants import grant_rooms
+from visualize.models import db, Reader, Room, CardReader, AccessGroup, BelongsTo, HasAccessTo, RoomRequest, \
+	gives_access_to
+
+app = create_app()
+app.app_context().push()
+
+SIZE = 100  # the building is SIZE x SIZE rooms
+APPROVALS = 50
+HALF_YEAR = 183  # number of days in half a year
+
+
+def room_id(row, column):
+	return row * SIZE + column + 1
+
+
+def setup():
+	"""Creates the building, access group 1 with every card reader and readers 1 and 2 in it"""
+	db.session.remove()
+	db.drop_all()
+	db.create_all()
+	expires = date.today() + timedelta(days=90)
+
+	db.session.bulk_insert_mappings(Room, [{"id": room_id(row, column), "name": "Room {} {}".format(row, column),
+											"text_id": "R{}-{}".format(row, column)}
+										   for row in range(SIZE) for column in range(SIZE)])
+	card_readers = [{"room_a_id": None, "room_b_id": room_id(row, 0)} for row in range(SIZE)]
+	for row in range(SIZE):
+		for column in range(SIZE):
+			for next_row, next_column in [(row + 1, column), (row, column + 1)]:
+				if next_row < SIZE and next_column < SIZE:
+					card_readers += [{"room_a_id": room_id(row, column), "room_b_id": room_id(next_row, next_column)},
+									 {"room_a_id": room_id(next_row, next_column), "room_b_id": room_id(row, column)}]
+	db.session.bulk_insert_mappings(CardReader, card_readers)
+	db.session.add(AccessGroup(name="Everywhere"))
+	db.session.execute(gives_access_to.insert(), [{"ag_id": 1, "cr_id": i} for i in range(1, len(card_readers) + 1)])
+
+	pw_hash = password_hashing.generate_password_hash("abcABC123")
+	db.session.bulk_insert_mappings(Reader, [
+		{"id": i, "email": "bench{}@bench.se".format(i), "password": pw_hash, "name": "Bench", "surname": "Mark",
+		 "token_epoch": 0} for i in (1, 2)])
+	db.session.bulk_insert_mappings(BelongsTo, [{"reader_id": i, "ag_id": 1, "expiration_datetime": expires}
+												for i in (1, 2)])
+	db.session.commit()
+
+
+def old_grant(reader, room_id, expires):
+	"""The access given for an approved room request as it was before"""
+	room_from = db.aliased(Room)
+	room_reader_from = db.aliased(CardReader)
+	readers_in = CardReader.query \
+		.join(Room, Room.id == CardReader.room_a_id) \
+		.join(room_from, room_from.id == CardReader.room_b_id) \
+		.join(room_reader_from, room_reader_from.room_b_id == room_from.id) \
+		.join(HasAccessTo, HasAccessTo.card_reader_id == room_reader_from.id, isouter=True) \
+		.join(gives_access_to, gives_access_to.c.cr_id == room_reader_from.id, isouter=True) \
+		.join(AccessGroup, AccessGroup.id == gives_access_to.c.ag_id, isouter=True) \
+		.join(BelongsTo, BelongsTo.ag_id == AccessGroup.id, isouter=True) \
+		.filter(Room.id == room_id, or_(HasAccessTo.reader_id == reader.id, BelongsTo.reader_id == reader.id)) \
+		.all()
+	query = db.session.query(CardReader, HasAccessTo) \
+		.join(HasAccessTo, and_(HasAccessTo.card_reader_id == CardReader.id, HasAccessTo.reader_id == reader.id),
+			  isouter=True) \
+		.filter(and_(CardReader.id.in_([card_reader.id for card_reader in readers_in]),
+					 HasAccessTo.reader_id == None)).all()
+	reader_ids = [column[0].id for column in query]
+
+	room_reader_from = db.aliased(CardReader)
+	opposites = db.session.query(CardReader, room_reader_from) \
+		.join(room_reader_from, and_(room_reader_from.room_a_id == CardReader.room_b_id,
+									 room_reader_from.room_b_id == CardReader.room_a_id)) \
+		.filter(CardReader.id.in_(reader_ids)).all()
+	for reader_to, reader_from in opposites:
+		db.session.add(HasAccessTo(reader, reader_to, expires))
+		db.session.add(HasAccessTo(reader, reader_from, expires))
+	for card_reader in CardReader.query.filter_by(room_b_id=room_id, room_a_id=None).all():
+		db.session.add(HasAccessTo(reader, card_reader, expires))
+	db.session.commit()
+
+
+def run():
+	setup()
+	expires = date.today() + timedelta(days=HALF_YEAR)
+
+	# Rooms that are not next to each other, the old way fails on grants the reader already has
+	random = Random(1)
+	rooms = random.sample([room_id(row, column) for row in range(0, SIZE, 3) for column in range(0, SIZE, 3)],
+						  APPROVALS)
+	requests = []
+	for room in rooms:
+		request = RoomRequest(Reader.query.get(2), Room.query.get(room), "benchmark")
+		db.session.add(request)
+		db.session.flush()
+		requests.append(request.id)
+	db.session.commit()
+
+	old_rooms, new_requests = iter(rooms), iter(requests)
+	reader = Reader.query.get(1)
+	report("before", measure(lambda: old_grant(reader, next(old_rooms), expires), APPROVALS))
+
+	def new_grant():
+		grant_rooms([next(new_requests)], expires)
+		db.session.commit()
+	report("insert ... select", measure(new_grant, APPROVALS))
+
+	old = {card_reader_id for (card_reader_id,) in db.session.query(HasAccessTo.card_reader_id).filter_by(reader_id=1)}
+	new = {card_reader_id for (card_reader_id,) in db.session.query(HasAccessTo.card_reader_id).filter_by(reader_id=2)}
+	print("{} card readers granted before, {} now, the same: {}".format(len(old), len(new), old == new))
+
+
+if __name__ == "__main__":
+	run()
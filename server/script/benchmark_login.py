@@ -0,0 +1,74 @@
+"""
+Benchmark of the login throughput at several bcrypt work factors.
+
+A number of clients log in at the same time while another client keeps making cheap requests,
+showing that the server keeps answering while bcrypt runs in the pool.
+Note that this resets the configured database, just like create_db_data.py.
+Run from the server folder with: python -m script.benchmark_login
+"""
+import json
+import threading
+from time import perf_counter
+
+from flask_jwt_extended import create_access_token
+
+from script.benchmark import report
+from visualize import create_app, password_hashing
+from visualize.models import db, Reader
+
+app = create_app()
+app.app_context().push()
+
+CLIENTS = 8
+LOGINS_PER_CLIENT = 4
+PASSWORD = "abcABC123"
+
+
+def setup(rounds):
+	"""Creates the readers that will log in, hashed with the given work factor"""
+	app.config["BCRYPT_LOG_ROUNDS"] = rounds
+	db.session.remove()
+	db.drop_all()
+	db.create_all()
+	pw_hash = password_hashing.generate_password_hash(PASSWORD)
+	db.session.bulk_insert_mappings(Reader, [
+		{"email": "bench{}@bench.se".format(i), "password": pw_hash, "name": "Bench", "surname": "Mark"}
+		for i in range(CLIENTS)])
+	db.session.commit()
+
+
+def login_client(i):
+	"""Logs in LOGINS_PER_CLIENT times as one of the readers"""
+	client = app.test_client()
+	sent = json.dumps({"email": "bench{}@bench.se".format(i), "password": PASSWORD})
+	for n in range(LOGINS_PER_CLIENT):
+		client.post("/login", data=sent, content_type="application/json")
+
+
+def run():
+	for rounds in [4, 8, 10, 12]:
+		setup(rounds)
+		headers = {"Authorization": "Bearer {}".format(create_access_token(identity="bench0@bench.se"))}
+
+		threads = [threading.Thread(target=login_client, args=(i,)) for i in range(CLIENTS)]
+		start = perf_counter()
+		for thread in threads:
+			thread.start()
+
+		# Cheap requests made while the logins are running
+		client = app.test_client()
+		durations = []
+		while any(thread.is_alive() for thread in threads):
+			request_start = perf_counter()
+			client.get("/reader/self", headers=headers)
+			durations.append(perf_counter() - request_start)
+
+		for thread in threads:
+			thread.join()
+		elapsed = perf_counter() - start
+		print("rounds={:<3} {:6.1f} logins/s".format(rounds, CLIENTS * LOGINS_PER_CLIENT / elapsed))
+		report("  /reader/self during logins", durations)
+
+
+if __name__ == "__main__":
+	run()
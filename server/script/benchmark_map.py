@@ -0,0 +1,117 @@
+"""
+Benchmark of /reader/map with the map of a campus of 5000 rooms.
+
+The map is answered the way it was before (the pickle read and encoded for every request) and from the map kept in
+memory, as JSON, as gzip and as 304 Not Modified for a client that already has it. Then a change of one room is
+saved by posting the whole map and with a JSON Patch, and read back by a client with the version before. Last, the
+shapes in a viewport of 2000 x 2000 are looked up with the grid of map_grid.py and by looking at every shape.
+Note that this resets the configured database, just like create_db_data.py.
+Run from the server folder with: python -m script.benchmark_map
+"""
+import json
+import os
+import pickle
+import tempfile
+from random import Random
+
+from flask_jwt_extended import create_access_token
+
+from script.benchmark import measure, report
+from visualize import create_app, password_hashing
+from visualize.help_functions import ok
+from visualize.map_cache import map_cache
+from visualize.map_grid import MapGrid
+from visualize.models import db, Admin
+
+app = create_app()
+app.app_context().push()
+
+ROOMS = 5000
+
+
+def campus_map():
+	"""Returns a map of rooms with one to three rectangles each"""
+	random = Random(1)
+	return {"R{}".format(i): [{"x": random.randrange(100000), "y": random.randrange(100000),
+							   "width": random.randrange(50, 500), "height": random.randrange(50, 500)}
+							  for _ in range(random.randint(1, 3))] for i in range(ROOMS)}
+
+
+def setup():
+	"""Creates an admin to save and ask for the map"""
+	db.session.remove()
+	db.drop_all()
+	db.create_all()
+	db.session.add(Admin("bench@bench.se", password_hashing.generate_password_hash("abcABC123"), "Bench", "Mark"))
+	db.session.commit()
+
+
+def run():
+	setup()
+	client = app.test_client()
+	headers = {"Authorization": "Bearer {}".format(create_access_token(identity="bench@bench.se"))}
+
+	with tempfile.TemporaryDirectory() as folder:
+		app.config["MAP_FILE"] = os.path.join(folder, "map_repr.pickle")
+		with open(app.config["MAP_FILE"], "wb") as file:  # the map saved before versions were kept
+			pickle.dump(campus_map(), file)
+		map_cache.reset()
+
+		def old_load():
+			with app.test_request_context():
+				with open(app.config["MAP_FILE"], "rb") as file:
+					app.make_response(ok(pickle.load(file))).get_data()
+		report("before, pickle read every time", measure(old_load, 50))
+
+		def get(extra_headers):
+			return client.get("/reader/map", headers=dict(headers, **extra_headers))
+
+		response = get({})
+		print("map: {} bytes, {} gzipped".format(len(response.data), len(get({"Accept-Encoding": "gzip"}).data)))
+		report("from memory", measure(lambda: get({}), 50))
+		report("from memory, gzip", measure(lambda: get({"Accept-Encoding": "gzip"}), 50))
+		report("not modified", measure(lambda: get({"If-None-Match": response.headers["ETag"]}), 50))
+
+		random = Random(2)
+		campus = campus_map()
+
+		def move_room():
+			campus["R{}".format(random.randrange(ROOMS))][0]["x"] += 10
+			return client.post("/admin/map", data=json.dumps(campus), headers=headers, content_type="application/json")
+		report("save the whole map", measure(move_room, 20))
+
+		versions = [int(get({}).headers["X-Map-Version"])]
+
+		def patch_room():
+			operations = [{"op": "replace", "path": "/R{}/0/x".format(random.randrange(ROOMS)), "value": 10}]
+			patched = client.patch("/admin/map", data=json.dumps({"version": versions[-1], "operations": operations}),
+								   headers=headers, content_type="application/json")
+			versions.append(json.loads(patched.data.decode("utf-8"))["version"])
+		report("patch one room", measure(patch_room, 20))
+
+		version = versions[-1]
+		changes = client.get("/reader/map", query_string={"since": version - 1}, headers=headers)
+		print("changes since the version before: {} bytes".format(len(changes.data)))
+		report("changes since the version before",
+			   measure(lambda: client.get("/reader/map", query_string={"since": version - 1}, headers=headers), 50))
+
+		report("build the grid", measure(lambda: MapGrid(campus), 20))
+		grid = MapGrid(campus)
+		viewports = [(random.randrange(98000), random.randrange(98000), 2000, 2000) for _ in range(50)]
+
+		def scan(x, y, width, height):
+			return {text_id: [s for s in shapes if s["x"] <= x + width and x <= s["x"] + s["width"]
+							  and s["y"] <= y + height and y <= s["y"] + s["height"]] for text_id, shapes in campus.items()}
+		report("viewport, every shape looked at", measure(lambda: scan(*random.choice(viewports)), 50))
+		report("viewport, grid", measure(lambda: grid.viewport(*random.choice(viewports)), 50))
+
+		def viewport():
+			x, y, width, height = random.choice(viewports)
+			return client.get("/reader/map/viewport", query_string={"x": x, "y": y, "width": width, "height": height},
+							  headers=headers)
+		print("viewport: {} bytes".format(len(viewport().data)))
+		report("viewport", measure(viewport, 50))
+
+
+if __name__ == "__main__":
+	run()
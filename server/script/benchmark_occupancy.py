@@ -0,0 +1,81 @@
+"""
+Benchmark of the room occupancy: replaying the swipe log after a restart and answering /admin/rooms/occupancy.
+
+A million swipes of 10k cards moving between the rooms are written to the log of today. The occupancy is then
+replayed from the whole log, and from the checkpoint that replay saved plus the swipes written after it.
+Note that this resets the configured database, just like create_db_data.py.
+Run from the server folder with: python -m script.benchmark_occupancy
+"""
+import time
+import uuid
+from datetime import date, timedelta
+from random import Random
+from time import perf_counter
+
+from script.benchmark import measure, report
+from visualize import create_app, swipe_log
+from visualize.models import db, Room, CardReader
+from visualize.occupancy import occupancy
+
+app = create_app()
+app.app_context().push()
+
+ROOMS = 500
+CARDS = 10000
+SWIPES = 1000000
+LATER_SWIPES = 10000  # written after the checkpoint
+
+
+def setup():
+	"""Creates rooms connected by card readers both ways, and an entrance and exit"""
+	db.session.remove()
+	db.drop_all()
+	db.create_all()
+	swipe_log.drop_days_before(date.today() + timedelta(days=1))
+
+	db.session.bulk_insert_mappings(Room, [{"id": i, "name": "Room {}".format(i), "text_id": "R{}".format(i)}
+										   for i in range(1, ROOMS + 1)])
+	card_readers = [{"room_a_id": None, "room_b_id": 1}, {"room_a_id": 1, "room_b_id": None}]
+	for i in range(2, ROOMS + 1):
+		card_readers += [{"room_a_id": i // 2, "room_b_id": i}, {"room_a_id": i, "room_b_id": i // 2}]
+	db.session.bulk_insert_mappings(CardReader, card_readers)
+	db.session.commit()
+	return CardReader.query.count()
+
+
+def write_swipes(n, cards, card_readers, random):
+	"""Writes n random swipes to the log in batches"""
+	now = time.time()
+	with db.engine.connect() as connection:
+		for i in range(0, n, 100000):
+			swipe_log.write(connection, [
+				[random.choice(cards), random.randint(1, card_readers), now, random.random() < 0.95]
+				for j in range(min(100000, n - i))])
+
+
+def run():
+	card_readers = setup()
+	random = Random(1)
+	cards = [uuid.uuid4().hex for i in range(CARDS)]
+	write_swipes(SWIPES, cards, card_readers, random)
+
+	start = perf_counter()
+	read = occupancy.replay(from_scratch=True)
+	elapsed = perf_counter() - start
+	print("replay of the whole log: {} swipes in {:.2f}s, {:.0f} swipes/s".format(read, elapsed, read / elapsed))
+
+	write_swipes(LATER_SWIPES, cards, card_readers, random)
+	occupancy.reset()
+	start = perf_counter()
+	read = occupancy.replay()
+	print("replay from the checkpoint: {} swipes in {:.0f}ms".format(read, (perf_counter() - start) * 1000))
+
+	counts = occupancy.counts()
+	print("{} people in {} rooms".format(sum(counts.values()), len(counts)))
+	app.config["OCCUPANCY_SYNC_INTERVAL"] = 3600  # the answer from memory, without reading the log
+	report("occupancy counts", measure(occupancy.counts, 1000))
+	report("inside", measure(occupancy.inside, 100))
+
+
+if __name__ == "__main__":
+	run()
@@ -0,0 +1,95 @@
+"""
+Benchmark of the order feed at /admin/orders and /approver/orders as the backlog of orders grows.
+
+For every backlog size the whole feed is read once, then pages of 50 orders are read at the start and deep in the feed
+with a cursor, and with a filter on a reader. The pages should cost the same whatever the size of the backlog.
+Note that this resets the configured database, just like create_db_data.py.
+Run from the server folder with: python -m script.benchmark_orders
+"""
+import json
+from datetime import datetime, timedelta
+from random import Random
+from time import perf_counter
+
+from flask_jwt_extended import create_access_token
+
+from script.benchmark import measure, report
+from visualize import create_app, password_hashing
+from visualize.models import db, Reader, Approver, Admin, Room, AccessGroup, RoomRequest, AccessGroupRequest, \
+	ApprovesRoomRequest, ApprovesAgRequest
+
+app = create_app()
+app.app_context().push()
+
+BACKLOGS = [1000, 10000, 50000]
+READERS = 1000
+ROOMS = 100
+AGS = 20
+PAGE = 50
+
+
+def setup(orders):
+	"""Creates the readers, an approver and admin and the given number of orders, half for rooms and half for AGs"""
+	db.session.remove()
+	db.drop_all()
+	db.create_all()
+	random = Random(1)
+
+	pw_hash = password_hashing.generate_password_hash("abcABC123")
+	db.session.bulk_insert_mappings(Reader, [
+		{"id": i, "email": "bench{}@bench.se".format(i), "password": pw_hash, "name": "Bench", "surname": "Mark",
+		 "token_epoch": 0} for i in range(1, READERS + 1)])
+	# Reader 1 is an approver and reader 2 an admin
+	db.session.execute(Approver.__table__.insert(), [{"reader_id": 1}, {"reader_id": 2}])
+	db.session.execute(Admin.__table__.insert(), [{"approver_id": 2}])
+	db.session.bulk_insert_mappings(Room, [{"id": i, "name": "Room {}".format(i), "text_id": "R{}".format(i)}
+										   for i in range(1, ROOMS + 1)])
+	db.session.bulk_insert_mappings(AccessGroup, [{"id": i, "name": "AG {}".format(i)} for i in range(1, AGS + 1)])
+
+	start = datetime.now() - timedelta(days=365)
+	for model, approves, column, n in ((RoomRequest, ApprovesRoomRequest, "room", ROOMS),
+									   (AccessGroupRequest, ApprovesAgRequest, "ag", AGS)):
+		db.session.bulk_insert_mappings(model, [
+			{"id": i, "reader_id": random.randint(3, READERS), column + "_id": random.randint(1, n),
+			 "datetime_requested": start + timedelta(minutes=random.randint(0, 500000)), "justification": "benchmark"}
+			for i in range(1, orders // 2 + 1)])
+		db.session.bulk_insert_mappings(approves, [
+			{column + "_request_id": i, "approver_id": 1, "start_datetime": start} for i in range(1, orders // 2 + 1)])
+	db.session.commit()
+	# Without statistics SQLite sorts all orders for the first page instead of reading the index on datetime_requested,
+	# a database in use has them
+	db.session.execute("ANALYZE")
+	db.session.commit()
+
+
+def headers(email):
+	return {"Authorization": "Bearer {}".format(create_access_token(identity=email))}
+
+
+def run():
+	client = app.test_client()
+	for orders in BACKLOGS:
+		setup(orders)
+		admin = headers("bench2@bench.se")
+		print("{} orders".format(orders))
+
+		start = perf_counter()
+		data = client.get("/admin/orders", headers=admin).data
+		print("  all orders: {:.0f}ms, {} bytes".format((perf_counter() - start) * 1000, len(data)))
+
+		# The cursor of a page in the middle of the feed
+		cursor = ""
+		for i in range(orders // PAGE // 2 // 10):
+			page = json.loads(client.get("/admin/orders?limit={}&cursor={}".format(PAGE * 10, cursor),
+										 headers=admin).data.decode("utf-8"))
+			cursor = page["next_cursor"]
+
+		report("  first page", measure(lambda: client.get("/admin/orders?limit={}".format(PAGE), headers=admin), 20))
+		report("  middle page", measure(lambda: client.get(
+			"/admin/orders?limit={}&cursor={}".format(PAGE, cursor), headers=admin), 20))
+		report("  page of reader", measure(lambda: client.get(
+			"/admin/orders?limit={}&reader=bench10@bench.se".format(PAGE), headers=admin), 20))
+
+
+if __name__ == "__main__":
+	run()
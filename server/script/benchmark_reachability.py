@@ -0,0 +1,127 @@
+"""
+Benchmark of the rooms 10k readers can reach from the entrances, computed in one batch.
+
+The building is a grid of rooms with a door each way between rooms next to each other and entrances along one side.
+Every access group opens the doors of a random part of the building and the readers belong to a few of them and have
+been given a few doors directly, so many readers have access to rooms they can not get into. The batch is timed when
+nothing is known, when everything is remembered and after the access of some readers changed, and readers one at a
+time for comparison.
+Note that this resets the configured database, just like create_db_data.py.
+Run from the server folder with: python -m script.benchmark_reachability
+"""
+from datetime import datetime, timedelta
+from random import Random
+from time import perf_counter
+
+from script.benchmark import measure, report
+from visualize import create_app, password_hashing, materialized_access
+from visualize.building_graph import building_graph, record_change
+from visualize.models import db, Reader, Room, CardReader, AccessGroup, BelongsTo, HasAccessTo, EffectiveAccess, \
+	gives_access_to
+from visualize.reachability import reachability
+
+app = create_app()
+app.app_context().push()
+
+SIZE = 30  # the building is SIZE x SIZE rooms
+READERS = 10000
+AGS = 50
+CHANGED = 100  # readers given a new door between the batches
+
+
+def room_id(row, column):
+	return row * SIZE + column + 1
+
+
+def setup():
+	"""Creates the building, the access groups and the readers and computes their effective access"""
+	db.session.remove()
+	db.drop_all()
+	db.create_all()
+	random = Random(1)
+	expires = datetime.now() + timedelta(days=90)
+
+	db.session.bulk_insert_mappings(Room, [{"id": room_id(row, column), "name": "Room {} {}".format(row, column),
+											"text_id": "R{}-{}".format(row, column)}
+										   for row in range(SIZE) for column in range(SIZE)])
+	card_readers = [(None, room_id(row, 0)) for row in range(SIZE)]
+	for row in range(SIZE):
+		for column in range(SIZE):
+			for next_row, next_column in [(row + 1, column), (row, column + 1)]:
+				if next_row < SIZE and next_column < SIZE:
+					card_readers += [(room_id(row, column), room_id(next_row, next_column)),
+									 (room_id(next_row, next_column), room_id(row, column))]
+	db.session.bulk_insert_mappings(CardReader, [{"id": i, "room_a_id": room_a, "room_b_id": room_b}
+												 for i, (room_a, room_b) in enumerate(card_readers, start=1)])
+
+	# Every access group opens the doors between the rooms of a random rectangle
+	db.session.bulk_insert_mappings(AccessGroup, [{"id": i, "name": "AG {}".format(i)} for i in range(1, AGS + 1)])
+	gives = []
+	for ag_id in range(1, AGS + 1):
+		top, left = random.randrange(SIZE), random.randrange(SIZE)
+		rows, columns = range(top, min(SIZE, top + 10)), range(left, min(SIZE, left + 10))
+		rooms = {room_id(row, column) for row in rows for column in columns}
+		gives += [{"ag_id": ag_id, "cr_id": i} for i, (room_a, room_b) in enumerate(card_readers, start=1)
+				  if room_b in rooms and (room_a is None or room_a in rooms)]
+	db.session.execute(gives_access_to.insert(), gives)
+
+	pw_hash = password_hashing.generate_password_hash("abcABC123")
+	db.session.bulk_insert_mappings(Reader, [
+		{"id": i, "email": "bench{}@bench.se".format(i), "password": pw_hash, "name": "Bench", "surname": "Mark",
+		 "token_epoch": 0} for i in range(1, READERS + 1)])
+	db.session.bulk_insert_mappings(BelongsTo, [
+		{"reader_id": i, "ag_id": ag_id, "expiration_datetime": expires}
+		for i in range(1, READERS + 1) for ag_id in random.sample(range(1, AGS + 1), random.randint(1, 3))])
+	db.session.bulk_insert_mappings(HasAccessTo, [
+		{"reader_id": i, "card_reader_id": cr_id, "expiration_datetime": expires}
+		for i in range(1, READERS + 1) for cr_id in random.sample(range(1, len(card_readers) + 1), 5)])
+	record_change()  # the rooms and card readers were inserted in bulk
+	db.session.commit()
+	materialized_access.rebuild()
+	db.session.commit()
+	return len(card_readers)
+
+
+def run():
+	card_readers = setup()
+	reader_ids = list(range(1, READERS + 1))
+	random = Random(2)
+
+	start = perf_counter()
+	building_graph.version
+	print("reading the building graph: {:.0f}ms".format((perf_counter() - start) * 1000))
+
+	start = perf_counter()
+	reachable = reachability.rooms_many(reader_ids)
+	print("{} readers, nothing remembered: {:.0f}ms".format(READERS, (perf_counter() - start) * 1000))
+
+	report("{} readers, all remembered".format(READERS), measure(lambda: reachability.rooms_many(reader_ids), 10))
+
+	changed = random.sample(reader_ids, CHANGED)
+	existing = set(db.session.query(HasAccessTo.reader_id, HasAccessTo.card_reader_id)
+				   .filter(HasAccessTo.reader_id.in_(changed)))
+	db.session.bulk_insert_mappings(HasAccessTo, [
+		{"reader_id": i, "card_reader_id": cr_id, "expiration_datetime": datetime.now() + timedelta(days=90)}
+		for i in changed for cr_id in [random.randint(1, card_readers)] if (i, cr_id) not in existing])
+	materialized_access.refresh_readers(changed)
+	db.session.commit()
+	start = perf_counter()
+	reachable.update(reachability.rooms_many(reader_ids))
+	print("{} readers, {} changed: {:.0f}ms".format(READERS, CHANGED, (perf_counter() - start) * 1000))
+
+	reachability.reset()
+	start = perf_counter()
+	for reader_id in reader_ids[:1000]:
+		reachability.rooms(reader_id)
+	print("1000 readers one at a time, nothing remembered: {:.0f}ms".format((perf_counter() - start) * 1000))
+
+	access = {}
+	for reader_id, room in db.session.query(EffectiveAccess.reader_id, EffectiveAccess.room_id):
+		access.setdefault(reader_id, set()).add(room)
+	with_access = sum(len(rooms) for rooms in access.values())
+	in_reach = sum(len(rooms) for rooms in reachable.values())
+	print("rooms with access per reader: {:.1f}, reachable: {:.1f}".format(with_access / READERS, in_reach / READERS))
+
+
+if __name__ == "__main__":
+	run()
@@ -0,0 +1,92 @@
+"""
+Benchmark of the user directory at /admin/readers as the number of users grows.
+
+For every number of users the directory is built as it was before, from three lists of ORM objects where the readers
+that are approvers are removed with a membership test in a list, and with the single query of directory.py. Pages of
+100 readers are read at the start and in the middle of the directory.
+Note that this resets the configured database, just like create_db_data.py.
+Run from the server folder with: python -m script.benchmark_readers
+"""
+from time import perf_counter
+
+from flask_jwt_extended import create_access_token
+
+from script.benchmark import measure, report
+from visualize import create_app, password_hashing, directory
+from visualize.models import db, Reader, Approver, Admin
+
+app = create_app()
+app.app_context().push()
+
+USERS = [10000, 50000, 100000]
+APPROVERS = 0.01  # the share of the users that are approvers, a tenth of them are admins
+PAGE = 100
+
+
+def setup(users):
+	"""Creates the users, the first ones are the approvers and admins"""
+	db.session.remove()
+	db.drop_all()
+	db.create_all()
+
+	pw_hash = password_hashing.generate_password_hash("abcABC123")
+	db.session.bulk_insert_mappings(Reader, [
+		{"id": i, "email": "bench{}@bench.se".format(i), "password": pw_hash, "name": "Bench", "surname": str(i),
+		 "card_id": "card{}".format(i), "token_epoch": 0} for i in range(1, users + 1)])
+	approvers = int(users * APPROVERS)
+	db.session.execute(Approver.__table__.insert(), [{"reader_id": i} for i in range(1, approvers + 1)])
+	db.session.execute(Admin.__table__.insert(), [{"approver_id": i} for i in range(1, approvers // 10 + 1)])
+	db.session.commit()
+
+
+def old_readers():
+	"""The directory as it was built before"""
+	admins = [{"name": x.name, "surname": x.surname, "email": x.email, "card_id": x.card_id} for x in Admin.query.all()]
+	approvers = [{"name": x.name, "surname": x.surname, "email": x.email, "card_id": x.card_id}
+				 for x in Approver.query.all()]
+	readers = [{"name": x.name, "surname": x.surname, "email": x.email, "card_id": x.card_id}
+			   for x in Reader.query.all()]
+	new_readers = []
+	for reader in readers:
+		if reader not in approvers:
+			reader["role"] = "reader"
+			new_readers.append(reader)
+	new_approvers = []
+	for approver in approvers:
+		if approver not in admins:
+			approver["role"] = "approver"
+			new_approvers.append(approver)
+	for admin in admins:
+		admin["role"] = "admin"
+	return new_readers + new_approvers + admins
+
+
+def run():
+	client = app.test_client()
+	for users in USERS:
+		setup(users)
+		headers = {"Authorization": "Bearer {}".format(create_access_token(identity="bench1@bench.se"))}
+		print("{} users".format(users))
+
+		start = perf_counter()
+		old = old_readers()
+		print("  before: {:.0f}ms".format((perf_counter() - start) * 1000))
+		db.session.remove()
+
+		start = perf_counter()
+		new, cursor = directory.readers()
+		print("  single query: {:.0f}ms".format((perf_counter() - start) * 1000))
+		assert sorted(old, key=lambda user: user["email"]) == sorted(new, key=lambda user: user["email"])
+
+		start = perf_counter()
+		data = client.get("/admin/readers", headers=headers).data
+		print("  /admin/readers: {:.0f}ms, {} bytes".format((perf_counter() - start) * 1000, len(data)))
+
+		middle = users // 2  # the ids of the readers are 1 to users
+		report("  first page", measure(lambda: client.get("/admin/readers?limit={}".format(PAGE), headers=headers), 50))
+		report("  middle page", measure(lambda: client.get(
+			"/admin/readers?limit={}&cursor={}".format(PAGE, middle), headers=headers), 50))
+
+
+if __name__ == "__main__":
+	run()
@@ -0,0 +1,76 @@
+"""
+Benchmark of the reader search at /approver/readers/search with 100k readers.
+
+The readers get random names from names.txt. The first search builds the index, after that searches for one, two
+and three letters of a name, a full name and an email are timed, as well as a search right after a reader was added.
+Note that this resets the configured database, just like create_db_data.py.
+Run from the server folder with: python -m script.benchmark_search
+"""
+import os
+from random import Random
+from time import perf_counter
+
+from flask_jwt_extended import create_access_token
+
+from script.benchmark import measure, report
+from visualize import create_app, password_hashing
+from visualize.models import db, Reader, Approver
+from visualize.reader_search import reader_index
+
+app = create_app()
+app.app_context().push()
+
+READERS = 100000
+NAMES = os.path.join(os.path.dirname(__file__), "names.txt")
+
+
+def setup():
+	"""Creates the readers, the first one is an approver"""
+	db.session.remove()
+	db.drop_all()
+	db.create_all()
+	reader_index.reset()
+	random = Random(1)
+	with open(NAMES) as file:
+		names = [line.strip() for line in file if line.strip()]
+
+	pw_hash = password_hashing.generate_password_hash("abcABC123")
+	readers = []
+	for i in range(1, READERS + 1):
+		name, surname = random.choice(names), random.choice(names)
+		readers.append({"id": i, "email": "{}.{}{}@bench.se".format(name, surname, i).lower(), "password": pw_hash,
+						"name": name, "surname": surname, "token_epoch": 0})
+	db.session.bulk_insert_mappings(Reader, readers)
+	db.session.execute(Approver.__table__.insert(), [{"reader_id": 1}])
+	db.session.commit()
+	return readers
+
+
+def run():
+	readers = setup()
+	client = app.test_client()
+	headers = {"Authorization": "Bearer {}".format(create_access_token(identity=readers[0]["email"]))}
+	name, surname, email = readers[500]["name"], readers[500]["surname"], readers[500]["email"]
+
+	def search(text):
+		return client.get("/approver/readers/search", query_string={"q": text}, headers=headers)
+
+	start = perf_counter()
+	search(name)
+	print("first search, building the index: {:.0f}ms".format((perf_counter() - start) * 1000))
+
+	for text in [name[:1], name[:2], name[:3], name, name + " " + surname, email]:
+		report("search {!r}".format(text), measure(lambda: search(text), 100))
+
+	def add_and_search():
+		readers.append({"id": len(readers) + 1, "email": "new{}@bench.se".format(len(readers) + 1),
+						"password": readers[0]["password"], "name": name, "surname": surname, "token_epoch": 0})
+		db.session.bulk_insert_mappings(Reader, readers[-1:])
+		db.session.commit()
+		search(name + " " + surname)
+
+	report("add a reader and search", measure(add_and_search, 20))
+
+
+if __name__ == "__main__":
+	run()
@@ -0,0 +1,100 @@
+"""
+Load benchmark of the card swipe decisions at /door/<card_reader_id>/swipe.
+
+Thousands of readers with access to some of the card readers swipe their cards at the same time. Every client runs
+in its own process with its own index, like the workers of a server, and the latency of the whole request includes
+the Flask test client. The decision latency is also reported for the index lookup alone.
+Note that this resets the configured database, just like create_db_data.py.
+Run from the server folder with: python -m script.benchmark_swipe
+"""
+import json
+import multiprocessing
+import os
+import uuid
+from datetime import datetime, timedelta
+from random import Random
+from time import perf_counter
+
+from script.benchmark import measure, report
+from visualize import create_app, materialized_access, password_hashing
+from visualize.door_access import access_index
+from visualize.models import db, Reader, Room, CardReader, HasAccessTo
+
+app = create_app()
+app.app_context().push()
+app.config["DOOR_CONTROLLER_KEY"] = "benchmark"
+
+READERS = 10000
+CARD_READERS = 1000
+ACCESS_PER_READER = 10
+CLIENTS = os.cpu_count() or 1  # one client process per core
+SWIPES_PER_CLIENT = 2500
+
+
+def setup():
+	"""Creates the readers and card readers and gives every reader access to some of the card readers"""
+	db.session.remove()
+	db.drop_all()
+	db.create_all()
+	random = Random(1)
+	expires = datetime.now() + timedelta(days=90)
+
+	db.session.bulk_insert_mappings(Room, [{"id": i, "name": "Room {}".format(i), "text_id": "R{}".format(i)}
+										   for i in range(1, CARD_READERS + 1)])
+	db.session.bulk_insert_mappings(CardReader, [{"id": i, "room_a_id": 1, "room_b_id": i}
+												 for i in range(1, CARD_READERS + 1)])
+	pw_hash = password_hashing.generate_password_hash("abcABC123")
+	db.session.bulk_insert_mappings(Reader, [
+		{"id": i, "email": "bench{}@bench.se".format(i), "password": pw_hash, "name": "Bench", "surname": "Mark",
+		 "card_id": uuid.uuid4().hex, "token_epoch": 0} for i in range(1, READERS + 1)])
+	db.session.bulk_insert_mappings(HasAccessTo, [
+		{"reader_id": reader_id, "card_reader_id": card_reader_id, "expiration_datetime": expires}
+		for reader_id in range(1, READERS + 1)
+		for card_reader_id in random.sample(range(1, CARD_READERS + 1), ACCESS_PER_READER)])
+	materialized_access.rebuild()
+	db.session.commit()
+
+
+def swipes(seed, n):
+	"""Returns n random (card reader id, card id) swipes"""
+	random = Random(seed)
+	cards = [card_id for (card_id,) in db.session.query(Reader.card_id)]
+	return [(random.randint(1, CARD_READERS), random.choice(cards)) for i in range(n)]
+
+
+def swipe_client(seed):
+	"""Sends swipes one at a time from a worker process and returns how long every request took"""
+	db.engine.dispose()  # the connections of the parent process can not be shared
+	access_index.load()
+	swipe_list = swipes(seed, SWIPES_PER_CLIENT)
+	client = app.test_client()
+	durations = []
+	for card_reader_id, card_id in swipe_list:
+		start = perf_counter()
+		client.post("/door/{}/swipe".format(card_reader_id), data=json.dumps({"card_id": card_id}),
+					headers={"X-Door-Key": "benchmark"}, content_type="application/json")
+		durations.append(perf_counter() - start)
+	return sum(durations), durations
+
+
+def run():
+	setup()
+	start = perf_counter()
+	access_index.load()
+	print("Index of {} readers loaded in {:.0f}ms".format(READERS, (perf_counter() - start) * 1000))
+
+	lookups = iter(swipes(0, 100000))
+	report("index lookup", measure(lambda: access_index.is_allowed(*reversed(next(lookups))), 100000))
+
+	db.session.remove()
+	with multiprocessing.get_context("fork").Pool(CLIENTS) as pool:
+		results = pool.map(swipe_client, range(1, CLIENTS + 1))
+
+	# every client swipes for about the same time, the slowest one decides the throughput
+	elapsed = max(busy for busy, durations in results)
+	print("{} clients: {:.0f} swipes/s".format(CLIENTS, CLIENTS * SWIPES_PER_CLIENT / elapsed))
+	report("swipe request", [d for busy, durations in results for d in durations])
+
+
+if __name__ == "__main__":
+	run()
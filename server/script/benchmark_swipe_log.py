@@ -0,0 +1,98 @@
+"""
+Sustained throughput benchmark of the swipe log at /door/swipes.
+
+Several door controllers send batches of swipes as fast as they can for a while. The batches are buffered and written by
+the writer thread of the swipe log, when it falls behind the batches are refused with 503 and the controller waits for
+the Retry-After time before sending again. The write speed of a single flush is also measured.
+Note that this resets the configured database, just like create_db_data.py.
+Run from the server folder with: python -m script.benchmark_swipe_log
+"""
+import json
+import threading
+import time
+import uuid
+from datetime import date, timedelta
+from random import Random
+from time import perf_counter
+
+from script.benchmark import report
+from visualize import create_app, swipe_log
+from visualize.models import db
+
+app = create_app()
+app.app_context().push()
+app.config["DOOR_CONTROLLER_KEY"] = "benchmark"
+
+CONTROLLERS = 4
+BATCH = 1000
+DURATION = 10  # seconds
+CARDS = [uuid.uuid4().hex for i in range(10000)]
+CARD_READERS = 1000
+
+
+def batch(random):
+	"""Returns a batch of random swipes made now"""
+	now = time.time()
+	return [[random.choice(CARDS), random.randint(1, CARD_READERS), now, random.random() < 0.95] for i in range(BATCH)]
+
+
+def controller(seed, end, results):
+	"""Sends batches until the end time and records the latency of every accepted batch and the refused batches"""
+	random = Random(seed)
+	client = app.test_client()
+	durations, refused = [], 0
+	while time.monotonic() < end:
+		body = json.dumps({"swipes": batch(random)})
+		start = perf_counter()
+		response = client.post("/door/swipes", data=body, headers={"X-Door-Key": "benchmark"},
+							   content_type="application/json")
+		if response.status_code == 202:
+			durations.append(perf_counter() - start)
+		else:
+			refused += 1
+			time.sleep(int(response.headers["Retry-After"]))
+	results.append((durations, refused))
+
+
+def run():
+	db.session.remove()
+	db.drop_all()
+	db.create_all()
+	swipe_log.drop_days_before(date.today() + timedelta(days=1))
+
+	# A single flush of many buffered swipes
+	random = Random(0)
+	app.config["SWIPE_FLUSH_SIZE"] = 10 ** 9  # the writer thread must not flush while measuring
+	for i in range(100):
+		swipe_log.add(batch(random))
+	start = perf_counter()
+	written = swipe_log.flush()
+	print("flush of {} swipes: {:.0f} swipes/s".format(written, written / (perf_counter() - start)))
+	app.config["SWIPE_FLUSH_SIZE"] = 5000
+
+	# Controllers sending at the same time for DURATION seconds
+	results = []
+	end = time.monotonic() + DURATION
+	threads = [threading.Thread(target=controller, args=(seed, end, results)) for seed in range(1, CONTROLLERS + 1)]
+	start = perf_counter()
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join()
+	sent = perf_counter() - start
+	behind = swipe_log.pending()
+	swipe_log.flush()
+	elapsed = perf_counter() - start
+
+	accepted = sum(len(durations) for durations, refused in results) * BATCH
+	refused = sum(refused for durations, refused in results)
+	stored = sum(len(swipe_log.swipes_of_day(day)) for day in swipe_log.days())
+	print("{} controllers: {:.0f} swipes/s accepted, {} batches refused, {} swipes pending at the end".format(
+		CONTROLLERS, accepted / sent, refused, behind))
+	print("{:.0f} swipes/s written, {} of {} accepted swipes stored".format(
+		stored / elapsed, stored - written, accepted))
+	report("batch of {} swipes".format(BATCH), [d for durations, refused in results for d in durations])
+
+
+if __name__ == "__main__":
+	run()
@@ -5,7 +5,7 @@ from datetime import date, timedelta
 from random import choice, sample, seed, randint
 from time import time
 
-from visualize import create_app
+from visualize import create_app, materialized_access
 from visualize.models import *
 
 # Gustavs spännande lösning
@@ -304,6 +304,10 @@ def populate_db():
 	for card_reader in [card_reader for card_reader in card_readers if not card_reader.room_a_id]:
 		add_all_to_db([add_cardreader_to_all(card_reader)])
 
+	print("Build the effective access of all readers (time passed {})".format(time() - t))
+	materialized_access.rebuild()
+	db.session.commit()
+
 	print("Done creating database (time passed {})".format(time() - t))
 	return
 
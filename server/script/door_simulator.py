@@ -0,0 +1,150 @@
+"""
+Simulator of door controllers keeping local allow-lists in sync with the server, for benchmarking the sync protocol.
+
+Every simulated controller downloads the allow-list of its card reader from /door/<card_reader_id>/allowlist and then
+polls /door/sync for the changes after its version. Before some of the rounds of polls access is granted and revoked
+and cards are blocked on the server, in the other rounds nothing has changed. At the end the local allow-list of every controller is compared with a fresh download.
+Note that this resets the configured database, just like create_db_data.py.
+Run from the server folder with: python -m script.door_simulator
+"""
+import json
+import uuid
+from datetime import datetime, timedelta
+from random import Random
+from time import perf_counter
+
+from script.benchmark import report
+from visualize import create_app, materialized_access, password_hashing, door_sync, door_access
+from visualize.models import db, Reader, Room, CardReader, HasAccessTo
+
+app = create_app()
+app.app_context().push()
+app.config["DOOR_CONTROLLER_KEY"] = "simulator"
+HEADERS = {"X-Door-Key": "simulator"}
+
+READERS = 5000
+CONTROLLERS = 1000
+ACCESS_PER_READER = 10
+ROUNDS = 20
+CHANGE_EVERY = 4  # access is changed before every 4th round
+CHANGES_PER_ROUND = 20
+
+
+class Controller:
+	"""A door controller with a local copy of the allow-list of its card reader"""
+
+	def __init__(self, card_reader_id):
+		self.card_reader_id = card_reader_id
+		self.version = 0
+		self.cards = {}
+
+	def download(self, client):
+		"""Downloads the whole allow-list, returns the number of bytes received"""
+		data = client.get("/door/{}/allowlist".format(self.card_reader_id), headers=HEADERS).data
+		self.version, self.cards = door_sync.parse_allowlist(data)
+		return len(data)
+
+	def poll(self, client):
+		"""Fetches and applies the changes after the local version, returns the number of bytes received"""
+		received = 0
+		more = True
+		while more:
+			response = client.get("/door/sync?since={}&card_reader_id={}".format(self.version, self.card_reader_id),
+								  headers=HEADERS)
+			received += len(response.data)
+			feed = json.loads(response.data.decode("utf-8"))
+			if feed["reset"] or any(change["kind"] == "reset" for change in feed["changes"]):
+				return received + self.download(client)
+			for change in feed["changes"]:
+				if change["kind"] == "grant":
+					self.cards[change["card_id"]] = change["expires"]
+				else:  # revoke and block
+					self.cards.pop(change["card_id"], None)
+			self.version = feed["version"]
+			more = feed["more"]
+		return received
+
+
+def setup():
+	"""Creates the readers and card readers and gives every reader access to some of the card readers"""
+	db.session.remove()
+	db.drop_all()
+	db.create_all()
+	random = Random(1)
+	expires = datetime.now() + timedelta(days=90)
+
+	db.session.bulk_insert_mappings(Room, [{"id": i, "name": "Room {}".format(i), "text_id": "R{}".format(i)}
+										   for i in range(1, CONTROLLERS + 1)])
+	db.session.bulk_insert_mappings(CardReader, [{"id": i, "room_a_id": 1, "room_b_id": i}
+												 for i in range(1, CONTROLLERS + 1)])
+	pw_hash = password_hashing.generate_password_hash("abcABC123")
+	db.session.bulk_insert_mappings(Reader, [
+		{"id": i, "email": "sim{}@sim.se".format(i), "password": pw_hash, "name": "Sim", "surname": "Ulator",
+		 "card_id": uuid.uuid4().hex, "token_epoch": 0} for i in range(1, READERS + 1)])
+	db.session.bulk_insert_mappings(HasAccessTo, [
+		{"reader_id": reader_id, "card_reader_id": card_reader_id, "expiration_datetime": expires}
+		for reader_id in range(1, READERS + 1)
+		for card_reader_id in random.sample(range(1, CONTROLLERS + 1), ACCESS_PER_READER)])
+	materialized_access.rebuild()
+	db.session.commit()
+
+
+def change_access(random):
+	"""Grants, revokes and blocks like approvers and admins would, through the same functions as the routes"""
+	for i in range(CHANGES_PER_ROUND):
+		reader = Reader.query.get(random.randint(1, READERS))
+		action = random.random()
+		if action < 0.5:
+			card_reader = CardReader.query.get(random.randint(1, CONTROLLERS))
+			if not HasAccessTo.query.get((reader.id, card_reader.id)):
+				db.session.add(HasAccessTo(reader, card_reader, datetime.now() + timedelta(days=30)))
+		elif action < 0.95:
+			access = HasAccessTo.query.filter_by(reader_id=reader.id).first()
+			if access:
+				db.session.delete(access)
+		elif reader.card_id:
+			door_sync.card_blocked(reader.card_id, reader.id)
+			reader.block_card()
+			door_access.readers_changed([reader.id])
+		materialized_access.refresh_reader(reader.id)
+		db.session.commit()
+
+
+def run():
+	setup()
+	client = app.test_client()
+	controllers = [Controller(i) for i in range(1, CONTROLLERS + 1)]
+
+	start = perf_counter()
+	downloaded = sum(controller.download(client) for controller in controllers)
+	print("{} controllers downloaded {} bytes in {:.0f}ms".format(
+		CONTROLLERS, downloaded, (perf_counter() - start) * 1000))
+
+	random = Random(2)
+	durations = {True: [], False: []}
+	received = 0
+	for round_number in range(ROUNDS):
+		changed = round_number % CHANGE_EVERY == 0
+		if changed:
+			change_access(random)
+		for controller in controllers:
+			start = perf_counter()
+			received += controller.poll(client)
+			durations[changed].append(perf_counter() - start)
+
+	polls = len(durations[True]) + len(durations[False])
+	print("{} polls, {:.1f} bytes per poll".format(polls, received / polls))
+	report("poll after changes", durations[True])
+	report("poll without changes", durations[False])
+
+	# The local allow-lists must be the same as the ones on the server
+	wrong = 0
+	for controller in controllers:
+		local = controller.cards
+		controller.download(client)
+		wrong += local != controller.cards
+	print("{} of {} controllers out of sync".format(wrong, CONTROLLERS))
+
+
+if __name__ == "__main__":
+	run()
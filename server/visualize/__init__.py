@@ -1,21 +1,36 @@
 import os
 
 from cerberus import Validator
-from flask import Flask
+from flask import Flask, current_app
 from flask_cors import CORS
 from flask_jwt_extended import JWTManager
 
-from visualize.models import db, bcrypt, blacklist
+from visualize import auth, database, password_hashing, swipe_log
+from visualize.commands import register_commands
+from visualize.models import db, bcrypt, blacklist, reader
 
 jwt = JWTManager()
 validator = Validator()
 validator.require_all = True
 
 
+@jwt.user_claims_loader
+def add_claims_to_access_token(identity):
+	return auth.claims_for_identity(identity)
+
+
 @jwt.token_in_blacklist_loader
 def check_if_token_in_blacklist(decrypted_token):
 	jti = decrypted_token['jti']
-	return blacklist.is_jti_in_blacklist(jti)
+	claims = decrypted_token.get(current_app.config["JWT_USER_CLAIMS"], {})
+	sync_interval = current_app.config["JWT_BLACKLIST_SYNC_INTERVAL"] if current_app.config["JWT_BLACKLIST_CACHE"] \
+		else None
+
+	# Tokens issued before the role of the reader changed are revoked
+	if "reader_id" in claims and \
+			blacklist.is_reader_epoch_revoked(claims["reader_id"], claims.get("epoch", 0), sync_interval):
+		return True
+	return blacklist.is_jti_in_blacklist(jti, sync_interval)
 
 
 def create_app(test_config=None):
@@ -32,6 +47,7 @@ def create_app(test_config=None):
 
 	if test_config is not None:
 		app.config.from_object("config.TestingConfig")
+		app.config.from_mapping(test_config)
 
 	# ensure the instance folder exists
 	try:
@@ -41,21 +57,36 @@ def create_app(test_config=None):
 
 	# load secret and specific config for just this application
 	app.config.from_pyfile("config.py")
+	# options given in the instance config are kept
+	app.config["SQLALCHEMY_ENGINE_OPTIONS"] = dict(database.engine_options(app.config),
+												   **app.config.get("SQLALCHEMY_ENGINE_OPTIONS", {}))
 
 	CORS(app)
 	jwt.init_app(app)
 	db.init_app(app)
 	bcrypt.init_app(app)
+	password_hashing.init_app(app)
+	swipe_log.init_app(app)
+
+	register_commands(app)
 
 	with app.app_context():
 		from visualize.blueprints.main import main_bp
 		from visualize.blueprints.admin import admin_bp
 		from visualize.blueprints.reader import reader_bp
 		from visualize.blueprints.approver import approver_bp
+		from visualize.blueprints.door import door_bp
 		app.register_blueprint(main_bp, url_prefix="/")
 		app.register_blueprint(admin_bp, url_prefix="/admin")
 		app.register_blueprint(reader_bp, url_prefix="/reader")
 		app.register_blueprint(approver_bp, url_prefix="/approver")
+		app.register_blueprint(door_bp, url_prefix="/door")
 
 		db.create_all()
+		reader.upgrade_table()
+		blacklist.upgrade_table()
+		# A database from before effective_access existed has just got it empty
+		from visualize import materialized_access
+		materialized_access.rebuild_if_empty()
+		blacklist.revocation_cache.load()
 		return app
@@ -0,0 +1,116 @@
+"""
+This module gives readers access to the rooms of approved room requests.
+
+A room request gives the reader the doors both ways between the room and the rooms next to it that the reader can
+already get into, and the entrances of the room (card readers without a room A). The card readers of all the requests
+are selected in SQL and written with a single INSERT ... SELECT ... ON CONFLICT DO UPDATE, so grants the reader
+already has are kept and get the new expiry instead of failing on the primary key.
+"""
+from sqlalchemy import and_, or_, select, literal, union, func, true
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import Insert
+
+from visualize.models import db, RoomRequest, HasAccessTo, BelongsTo, CardReader, gives_access_to
+
+has_access_to = HasAccessTo.__table__
+belongs_to = BelongsTo.__table__
+room_request = RoomRequest.__table__
+card_reader = CardReader.__table__
+
+
+class UpsertFromSelect(Insert):
+	"""INSERT ... SELECT ... ON CONFLICT DO UPDATE, with the syntax SQLite and PostgreSQL share, see upsert_from_select"""
+	conflict_keys = ()
+	updated_columns = ()
+
+
+@compiles(UpsertFromSelect)
+def _compile_upsert(upsert, compiler, **kw):
+	return "{} ON CONFLICT ({}) DO UPDATE SET {}".format(
+		compiler.visit_insert(upsert, **kw), ", ".join(upsert.conflict_keys),
+		", ".join("{0} = excluded.{0}".format(column) for column in upsert.updated_columns))
+
+
+def upsert_from_select(table, columns, query, keys, updated):
+	"""
+	Returns an INSERT of the rows of the select into the columns of the table, where the rows that already have the
+	same keys get the updated columns from the select instead. The select must have a WHERE clause, otherwise SQLite
+	takes the ON CONFLICT for the constraint of a join.
+	"""
+	upsert = UpsertFromSelect(table).from_select(columns, query)
+	upsert.conflict_keys, upsert.updated_columns = keys, updated
+	return upsert
+
+
+def room_grants(room_request_ids):
+	"""Returns a select of the (reader_id, card_reader_id) pairs the room requests give access to"""
+	door = card_reader.alias("door")  # from the room to a room next to it
+	opposite = card_reader.alias("opposite")  # back into the room
+	into = card_reader.alias("into")  # into the room next to it, that the reader can open
+
+	# The doors, and the same with opposite.id:
+	# SELECT room_request.reader_id, door.id FROM room_request
+	# JOIN card_reader AS door ON door.room_a_id = room_request.room_id
+	# JOIN card_reader AS opposite ON opposite.room_a_id = door.room_b_id AND opposite.room_b_id = door.room_a_id
+	# JOIN card_reader AS into ON into.room_b_id = door.room_b_id
+	# LEFT OUTER JOIN has_access_to ON has_access_to.card_reader_id = into.id
+	#   AND has_access_to.reader_id = room_request.reader_id
+	# LEFT OUTER JOIN gives_access_to ON gives_access_to.cr_id = into.id
+	# LEFT OUTER JOIN belongs_to ON belongs_to.ag_id = gives_access_to.ag_id
+	#   AND belongs_to.reader_id = room_request.reader_id
+	# WHERE room_request.id IN [room_request_ids]
+	# AND (has_access_to.reader_id IS NOT NULL OR belongs_to.reader_id IS NOT NULL)
+
+	doors = room_request \
+		.join(door, door.c.room_a_id == room_request.c.room_id) \
+		.join(opposite, and_(opposite.c.room_a_id == door.c.room_b_id, opposite.c.room_b_id == door.c.room_a_id)) \
+		.join(into, into.c.room_b_id == door.c.room_b_id) \
+		.outerjoin(has_access_to, and_(has_access_to.c.card_reader_id == into.c.id,
+									   has_access_to.c.reader_id == room_request.c.reader_id)) \
+		.outerjoin(gives_access_to, gives_access_to.c.cr_id == into.c.id) \
+		.outerjoin(belongs_to, and_(belongs_to.c.ag_id == gives_access_to.c.ag_id,
+									belongs_to.c.reader_id == room_request.c.reader_id))
+	reachable = and_(room_request.c.id.in_(room_request_ids),
+					 or_(has_access_to.c.reader_id != None, belongs_to.c.reader_id != None))
+
+	# The entrances:
+	# SELECT room_request.reader_id, card_reader.id FROM room_request
+	# JOIN card_reader ON card_reader.room_b_id = room_request.room_id AND card_reader.room_a_id IS NULL
+	# WHERE room_request.id IN [room_request_ids]
+
+	return union(
+		select([room_request.c.reader_id, door.c.id.label("card_reader_id")]).select_from(doors).where(reachable),
+		select([room_request.c.reader_id, opposite.c.id]).select_from(doors).where(reachable),
+		select([room_request.c.reader_id, card_reader.c.id])
+		.select_from(room_request.join(card_reader, and_(card_reader.c.room_b_id == room_request.c.room_id,
+														 card_reader.c.room_a_id == None)))
+		.where(room_request.c.id.in_(room_request_ids))).alias("grants")
+
+
+def grant_rooms(room_request_ids, expires):
+	"""
+	Gives the readers of the room requests access to their rooms until expires. A room can lead to another room
+	in the same requests, so the grants are selected again until no new ones are found, as if the requests were
+	approved one at a time.
+	"""
+	room_request_ids = list(room_request_ids)
+	reader_ids = select([room_request.c.reader_id]).where(room_request.c.id.in_(room_request_ids))
+	count = select([func.count()]).select_from(has_access_to).where(has_access_to.c.reader_id.in_(reader_ids))
+
+	granted = db.session.execute(count).scalar()
+	while True:
+		grants = room_grants(room_request_ids)
+
+		# INSERT INTO has_access_to (reader_id, card_reader_id, expiration_datetime)
+		# SELECT grants.reader_id, grants.card_reader_id, [expires] FROM ([room_grants]) AS grants WHERE true
+		# ON CONFLICT (reader_id, card_reader_id) DO UPDATE SET expiration_datetime = excluded.expiration_datetime
+
+		db.session.execute(upsert_from_select(
+			has_access_to, ["reader_id", "card_reader_id", "expiration_datetime"],
+			select([grants.c.reader_id, grants.c.card_reader_id,
+					literal(expires, type_=has_access_to.c.expiration_datetime.type)]).where(true()),
+			["reader_id", "card_reader_id"], ["expiration_datetime"]))
+
+		before, granted = granted, db.session.execute(count).scalar()
+		if granted == before:
+			return
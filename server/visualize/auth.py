@@ -0,0 +1,102 @@
+"""
+This module contains the logic for the roles of the users.
+The role and id of a reader is resolved once when the token is created and stored as claims in the token,
+so checking the role of a request does not need any database access.
+"""
+from collections import namedtuple
+from functools import wraps
+
+from flask import request, _request_ctx_stack
+from flask_jwt_extended import verify_jwt_in_request, get_jwt_claims, get_jwt_identity
+from sqlalchemy import case
+
+from visualize.help_functions import bad_request
+from visualize.models import db, Reader, Approver, Admin
+
+# The roles ordered from the least to the most privileged, every role has the rights of the roles before it.
+ROLES = ["reader", "approver", "admin"]
+
+# The user making the current request, as given by its token
+AuthContext = namedtuple("AuthContext", ["identity", "role", "reader_id"])
+
+
+def role_column():
+	"""Returns the SQL expression of the role of a reader, for queries outer joining the approver and admin tables"""
+	return case([(Admin.__table__.c.approver_id.isnot(None), "admin"),
+				 (Approver.__table__.c.reader_id.isnot(None), "approver")], else_="reader")
+
+
+def with_roles(query):
+	"""Outer joins the approver and admin tables to a query of readers, role_column() can then be selected"""
+	approver = Approver.__table__
+	admin = Admin.__table__
+	return query.outerjoin(approver, approver.c.reader_id == Reader.id) \
+		.outerjoin(admin, admin.c.approver_id == Reader.id)
+
+
+def find_reader_with_role(email):
+	"""Returns the reader with the given email and its role, found with a single query."""
+
+	# SELECT reader.*,
+	# CASE WHEN admin.approver_id IS NOT NULL THEN 'admin' WHEN approver.reader_id IS NOT NULL THEN 'approver'
+	# ELSE 'reader' END FROM reader
+	# LEFT OUTER JOIN approver ON approver.reader_id = reader.id
+	# LEFT OUTER JOIN admin ON admin.approver_id = reader.id
+	# WHERE reader.email = [email]
+
+	row = with_roles(db.session.query(Reader, role_column())).filter(Reader.email == email).first()
+	if row is None:
+		return None, None
+	reader, role = row
+	return reader, role
+
+
+def reader_claims(reader, role):
+	"""Returns the claims stored in the tokens of the reader."""
+	return {"role": role, "reader_id": reader.id, "epoch": reader.token_epoch or 0}
+
+
+def claims_for_identity(email):
+	"""Returns the claims for the reader with the given email, or no claims if the reader does not exist."""
+	reader, role = find_reader_with_role(email)
+	if reader is None:
+		return {}
+	return reader_claims(reader, role)
+
+
+def current_auth():
+	"""
+	Returns the AuthContext of the current request. The token is decoded and verified the first time
+	this is called during a request, later calls reuse the result.
+	"""
+	ctx = _request_ctx_stack.top
+	auth = getattr(ctx, "visualize_auth", None)
+	if auth is None:
+		verify_jwt_in_request()
+		claims = get_jwt_claims()
+		auth = AuthContext(get_jwt_identity(), claims.get("role"), claims.get("reader_id"))
+		ctx.visualize_auth = auth
+	return auth
+
+
+def has_role(auth, role):
+	"""Checks if the user of the auth context has at least the rights of the given role."""
+	return auth.role in ROLES and ROLES.index(auth.role) >= ROLES.index(role)
+
+
+def role_required(role):
+	"""
+	Decorator that verifies the token of the request and checks that the user has at least the given role.
+	The role is read from the token claims, no database access is done.
+	"""
+	def decorator(function):
+		@wraps(function)
+		def wrapper(*args, **kwargs):
+			# CORS preflight requests do not carry a token
+			if request.method == "OPTIONS":
+				return function(*args, **kwargs)
+			if not has_role(current_auth(), role):
+				return bad_request("User is not {}".format("an " + role if role[0] in "aeiou" else "a " + role))
+			return function(*args, **kwargs)
+		return wrapper
+	return decorator
@@ -2,40 +2,37 @@
 This module contains the logic for the calls that are related to the reader role.
 The url for the calls in this module is http://127.0.0.1:5000/admin/<route>
 """
-import pickle
+import io
 
 # Standard flask libraries
-from flask import Blueprint, request
-from flask_jwt_extended import jwt_required, get_jwt_identity, decode_token
+from flask import Blueprint, request, make_response
 
 # Logical database operators
-from sqlalchemy import and_, or_
+from sqlalchemy import or_
 
 # Help functions for validation and simplifications
-from visualize.help_functions import ok, bad_request, created, validate_password
-from visualize import validator
+from visualize.help_functions import ok, bad_request, created, conflict, service_unavailable, validate_password
+from visualize import validator, materialized_access, door_access, door_sync, order_feed, directory, map_patch
+from visualize.building_graph import building_graph
+from visualize.bulk_import import import_readers
+from visualize.map_cache import map_cache, MapConflict
+from visualize.occupancy import occupancy, evacuation_list, OccupancyNotReady
+from visualize.reader_search import reader_index
+from visualize.schemas import USER_SCHEMA
+# The user making the request and the check of its role
+from visualize.auth import current_auth, role_required
 
 # The database structure
-from visualize.models import db, AccessGroup, Reader, Approver, Admin, Room, RoomRequest, AccessGroupRequest, \
-	ResponsibleForAg, ResponsibleForRoom, CardReader, ApprovesAgRequest, \
-	gives_access_to, ApprovesRoomRequest
+from visualize.models import db, AccessGroup, Reader, Approver, Admin, Room, AccessGroupRequest, \
+	ResponsibleForAg, ResponsibleForRoom, CardReader, ApprovesAgRequest, blacklist
 
 admin_bp = Blueprint('admin', __name__)
 
 
 @admin_bp.before_request  # before_request is run before every request in blueprint route
-@jwt_required
+@role_required("admin")
 def is_admin():
 	""" Checks if the request comes from a user that is admin."""
-	try:
-		email = decode_token(request.headers.get('Authorization')[7:])["identity"]
-
-		current_admin = Admin.query.filter_by(email=email).first()
-	except IndexError:
-		return bad_request("User is not an admin")
-
-	if current_admin is None:
-		return bad_request("User is not an admin")
 
 
 @admin_bp.route("/upgrade_to_approver", methods=["POST"])
@@ -65,6 +62,8 @@ def upgrade_to_approver():
 	# Insert a new row in the Approver table, where reader_id is set to that of the specified reader.
 	# To circumvent Flask object problems (inheritance etc.), this is done in "pure" SQL syntax.
 	db.session.execute("INSERT INTO approver (reader_id) VALUES ({0});".format(reader_to_upgrade.id))
+	# The role is stored in the tokens of the reader, they have to log in again to get the new one.
+	blacklist.revoke_reader_tokens(reader_to_upgrade)
 	db.session.commit()
 
 	return ok("Reader is now an approver!")
@@ -107,6 +106,8 @@ def upgrade_to_admin():
 	# Insert a new row in the Admin table, where reader_id is set to that of the specified approver.
 	# To circumvent Flask object problems (inheritance etc.), this is done in "pure" SQL syntax.
 	db.session.execute("INSERT INTO admin (approver_id) VALUES ({0});".format(approver_to_upgrade.id))
+	# The role is stored in the tokens of the user, they have to log in again to get the new one.
+	blacklist.revoke_reader_tokens(approver_to_upgrade)
 	db.session.commit()
 
 	return ok("User is now an admin!")
@@ -114,13 +115,54 @@ def upgrade_to_admin():
 
 @admin_bp.route("/map", methods=["POST"])
 def save_map():
-	"""Saves the representation of the map in locale file"""
+	"""Saves the whole representation of the map as a new version"""
 	# Checks if the request is a json
 	if not request.is_json:
 		return bad_request("Missing JSON in request")
+	if not isinstance(request.json, dict):
+		return bad_request("The map must be an object with the shapes of every room")
 
-	pickle.dump(request.json, open("map_repr.pickle", "wb"))
-	return ok("File has been saved!")
+	try:
+		version = map_cache.save(request.json)
+	except MapConflict as e:
+		return conflict(str(e))
+	except ValueError as e:
+		return bad_request(str(e))
+	building_graph.reset()  # the map can come with rooms and doors added in the database
+	return ok({"message": "File has been saved!", "version": version})
+
+
+@admin_bp.route("/map", methods=["PATCH"])
+def patch_map():
+	"""
+	Changes the map with JSON Patch operations, see map_patch.py. The version is the one the operations were made for,
+	if the map has changed since then nothing is changed and 409 is returned.
+	"""
+	schema = {
+		"version": {"type": "integer", "min": 0},
+		"operations": {"type": "list", "schema": {"type": "dict", "schema": {
+			"op": {"type": "string", "allowed": map_patch.OPERATIONS},
+			"path": {"type": "string"},
+			"value": {"required": False, "nullable": True},
+		}}},
+	}
+
+	# Checks if the request is a json
+	if not request.is_json:
+		return bad_request("Missing JSON in request")
+
+	# Checks if any of the input is illegal
+	if not validator(request.json, schema):
+		return bad_request(validator.errors)
+
+	try:
+		version = map_cache.patch(request.json["version"], request.json["operations"])
+	except MapConflict as e:
+		return conflict(str(e))
+	except ValueError as e:
+		return bad_request(str(e))
+	building_graph.reset()
+	return ok({"message": "Map has been changed!", "version": version})
 
 
 @admin_bp.route("/ag", methods=["POST"])
@@ -192,22 +234,18 @@ def create_ag():
 
 	# Get a list of all card readers that link the rooms together
 	list_of_room_ids = [room.id for room in list_of_rooms]
-	list_of_card_readers = CardReader.query.filter(
-		and_(
-			CardReader.room_b_id.in_(list_of_room_ids),
-			CardReader.room_a_id.in_(list_of_room_ids)
-		)
-	).all()
+	card_reader_ids = building_graph.doors_between(list_of_room_ids)
 
 	# Check if the rooms are connected to eachother by card readers
-	temp_rooms = Room.query.filter(Room.id.in_([cr.room_b_id for cr in list_of_card_readers])).all()
-	requested_rooms = [room.text_id for room in list_of_rooms]
-	resulting_rooms = [room.text_id for room in temp_rooms]
-	diff = [room for room in requested_rooms if room not in resulting_rooms]
+	connected_rooms = building_graph.rooms_of(card_reader_ids)
+	diff = [room.text_id for room in list_of_rooms if room.id not in connected_rooms]
 	if diff:
 		return bad_request("The room(s) {} has no card readers connecting to the rest of the rooms!".format(diff))
 
+	list_of_card_readers = CardReader.query.filter(CardReader.id.in_(card_reader_ids)).all()
 	ag.card_readers = list_of_card_readers
+	db.session.flush()  # gives a new access group its id
+	materialized_access.refresh_ag(ag.id)
 	db.session.commit()
 	return ok("Access Group was successfully created!")
 
@@ -242,11 +280,38 @@ def get_all_rooms():
 	return {"rooms": [room.text_id for room in Room.query.all()]}, 200
 
 
+@admin_bp.route("/rooms/occupancy", methods=["GET"])
+def get_occupancy():
+	"""Returns the number of people in every room with people in it, from the swipes at the card readers."""
+	try:
+		counts = occupancy.counts()
+	except OccupancyNotReady as e:
+		return occupancy_not_ready(e)
+	return ok({"occupancy": counts, "inside": sum(counts.values())})
+
+
+@admin_bp.route("/evacuation", methods=["GET"])
+def get_evacuation_list():
+	"""Returns everyone inside the building and the room they are in, sorted by room."""
+	try:
+		inside = evacuation_list()
+	except OccupancyNotReady as e:
+		return occupancy_not_ready(e)
+	return ok({"inside": inside})
+
+
+def occupancy_not_ready(e):
+	"""The 503 response while the occupancy is built from the swipe log"""
+	response = make_response(service_unavailable(str(e)))
+	response.headers["Retry-After"] = "5"
+	return response
+
+
 @admin_bp.route("user/<reader_email>", methods=["DELETE"])
 def delete_user(reader_email):
 	"""Permanently deletes a reader, approver or admin and all attached information from the database."""
 	reader = Reader.query.filter_by(email=reader_email).first()
-	email = get_jwt_identity()
+	email = current_auth().identity
 
 	if not reader:
 		return bad_request("Reader {} does not exist.".format(reader_email))
@@ -257,6 +322,10 @@ def delete_user(reader_email):
 	approver = Approver.query.filter_by(reader_id=reader.id).first()
 	admin = Admin.query.filter_by(approver_id=reader.id).first()
 
+	# Tokens of the deleted user must not be usable any more
+	blacklist.revoke_reader_tokens(reader)
+	materialized_access.remove_reader(reader.id)
+
 	if admin:
 		db.session.delete(admin)
 	elif approver:
@@ -265,6 +334,7 @@ def delete_user(reader_email):
 		db.session.delete(reader)
 
 	db.session.commit()
+	reader_index.remove(reader.id)
 
 	return ok("Reader was successfully deleted")
 
@@ -280,7 +350,9 @@ def remove_card(email):
 	if not reader.card_id:
 		return bad_request("Card has already been cleared.")
 
+	door_sync.card_blocked(reader.card_id, reader.id)
 	reader.block_card()
+	door_access.readers_changed([reader.id])
 	db.session.commit()
 
 	return ok("Card for reader was cleared.")
@@ -311,15 +383,8 @@ def create_user(Role):
 	if not request.is_json:
 		return bad_request("Missing JSON in request")
 
-	schema = {
-		"email": {"type": "string", "regex": "^[a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\\.[a-zA-Z0-9-.]+$"},
-		"name": {"type": "string", "regex": "[a-zA-Z]+$", "minlength": 2, "maxlength": 12},
-		"surname": {"type": "string", "regex": "[a-zA-Z]+$", "minlength": 2, "maxlength": 12},
-		"password": {"type": "string"}
-	}
-
 	# Checks if input is illegal
-	if not validator(request.json, schema):
+	if not validator(request.json, USER_SCHEMA):
 		s = validator
 		return bad_request(validator.errors)
 
@@ -345,97 +410,45 @@ def create_user(Role):
 	return created("{} successfully created!".format(Role.__tablename__.capitalize()))
 
 
-@admin_bp.route("/readers", methods=["GET"])
-def get_all_readers_roles():
-	"""Returns a list of all the readers names and email"""
-	admins = [{"name": x.name, "surname": x.surname, "email": x.email, "card_id": x.card_id} for x in Admin.query.all()]
-	approvers = [{"name": x.name, "surname": x.surname, "email": x.email, "card_id": x.card_id} for x in Approver.query.all()]
-	readers = [{"name": x.name, "surname": x.surname, "email": x.email, "card_id": x.card_id} for x in Reader.query.all()]
-
-	# Removes the users which are not only readers
-	new_readers = []
-	for reader in readers:
-		if reader not in approvers:
-			reader["role"] = "reader"
-			new_readers.append(reader)
+@admin_bp.route("/readers/bulk", methods=["POST"])
+def create_readers_bulk():
+	"""
+	Creates many readers at once from a CSV file (with the header email,name,surname,password)
+	or from JSON lines. Returns the number of created readers and the rows that failed.
+	"""
+	if request.mimetype == "text/csv":
+		file_format = "csv"
+	elif request.mimetype in ["application/x-ndjson", "application/jsonl"]:
+		file_format = "jsonl"
+	else:
+		return bad_request("Content type must be text/csv or application/x-ndjson")
 
-	new_approvers = []
-	# Removes the users which are not only approvers
-	for approver in approvers:
-		if approver not in admins:
-			approver["role"] = "approver"
-			new_approvers.append(approver)
+	lines = io.TextIOWrapper(request.stream, encoding="utf-8", newline="")
+	return ok(import_readers(lines, file_format))
 
-	for admin in admins:
-		admin["role"] = "admin"
 
-	return ok({"users": new_readers + new_approvers + admins})
+@admin_bp.route("/readers", methods=["GET"])
+def get_all_readers_roles():
+	"""
+	Returns a list of all the readers names, email, card and role.
+	The list can be read a page at a time, see directory.py.
+	"""
+	try:
+		return ok(directory.page(request.args))
+	except ValueError as e:
+		return bad_request(str(e))
 
 
 @admin_bp.route("/orders", methods=["GET"])
 def get_all_orders():
-	"""Returns a list of ALL the orders for rooms and AGs, with reader and approver specified for each."""
-
-	# Get a list of all the orders of access groups of all responsible approvers.
-	ag_relation = ApprovesAgRequest.query \
-		.join(AccessGroupRequest, AccessGroupRequest.id == ApprovesAgRequest.ag_request_id) \
-		.join(Reader, Reader.id == AccessGroupRequest.reader_id) \
-		.join(AccessGroup, AccessGroup.id == AccessGroupRequest.ag_id).all()
-	ag_orders = []
-	for ag in ag_relation:
-		# Gets all the rooms in the access group
-		room_relation = Room.query \
-			.join(CardReader, CardReader.room_b_id == Room.id) \
-			.join(gives_access_to, gives_access_to.c.cr_id == CardReader.id) \
-			.filter_by(ag_id=ag.ag_request.ag.id)
-		json = {
-			"type": "AG",
-			"rooms": [room.text_id for room in room_relation],
-			"reader": {
-				"email": ag.ag_request.reader.email,
-				"name": ag.ag_request.reader.name,
-				"surname": ag.ag_request.reader.surname
-			},
-			"approver": {
-				"email": ag.ag_request.request_approver.approver.email,
-				"name": ag.ag_request.request_approver.approver.name,
-				"surname": ag.ag_request.request_approver.approver.surname
-			},
-			"access_name": ag.ag_request.ag.name,
-			"request_id": ag.ag_request.id,
-			"ag_id": ag.ag_request.ag.id,
-			"justification": ag.ag_request.justification,
-			"requested_datetime": ag.ag_request.datetime_requested.strftime('%Y-%m-%d')
-		}
-		ag_orders.append(json)
-
-	# Get a list of all the orders of rooms this approver is responsible for.
-	room_relation = ApprovesRoomRequest.query \
-		.join(RoomRequest, RoomRequest.id == ApprovesRoomRequest.room_request_id) \
-		.join(Reader, Reader.id == RoomRequest.reader_id) \
-		.join(Room, Room.id == RoomRequest.room_id).all()
-	room_orders = [
-		{
-			"type": "Room",
-			"reader": {
-				"email": x.room_request.reader.email,
-				"name": x.room_request.reader.name,
-				"surname": x.room_request.reader.surname,
-			},
-			"approver": {
-				"email": x.room_request.request_approver.approver.email,
-				"name": x.room_request.request_approver.approver.name,
-				"surname": x.room_request.request_approver.approver.surname
-			},
-
-			"access_name": x.room_request.room.name,
-			"request_id": x.room_request.id,
-			"room_id": x.room_request.room.text_id,
-			"justification": x.room_request.justification,
-			"requested_datetime": x.room_request.datetime_requested.strftime('%Y-%m-%d')
-		} for x in room_relation]
-
-	return ok({"orders": room_orders + ag_orders})
+	"""
+	Returns a list of ALL the orders for rooms and AGs, with reader and approver specified for each.
+	The list can be filtered and read a page at a time, see order_feed.py.
+	"""
+	try:
+		return ok(order_feed.page(request.args))
+	except ValueError as e:
+		return bad_request(str(e))
 
 
 @admin_bp.route("/remove_for_approver/ag", methods=["POST"])
@@ -0,0 +1,142 @@
+"""
+This module contains the logic for the calls made by the door controllers.
+The url for the calls in this module is http://127.0.0.1:5000/door/<route>
+"""
+import hmac
+import math
+import time
+
+from cerberus import Validator
+# Standard flask libraries
+from flask import Blueprint, request, current_app, make_response
+
+# Help functions for validation and simplifications
+from visualize.help_functions import ok, accepted, bad_request, unauthorized, service_unavailable
+# The in-memory index of which cards may open which card readers
+from visualize.door_access import access_index, check_many
+# The versioned allow-lists for controllers that work offline
+from visualize import door_sync
+# The log of who swiped where
+from visualize import swipe_log
+from visualize.schemas import SWIPE_SCHEMA
+
+door_bp = Blueprint('door', __name__)
+MAX_CHECKS = 20000  # max number of checks in one call to /door/check
+MAX_SWIPES = 20000  # max number of swipes in one call to /door/swipes
+
+
+@door_bp.before_request  # before_request is run before every request in blueprint route
+def is_door_controller():
+	"""Checks that the request comes from a door controller, i.e. that it has the shared key."""
+	if request.method == "OPTIONS":
+		return None
+	key = current_app.config["DOOR_CONTROLLER_KEY"]
+	if not key or not hmac.compare_digest(request.headers.get("X-Door-Key", ""), key):
+		return unauthorized("Not a door controller")
+
+
+@door_bp.route("/<int:card_reader_id>/swipe", methods=["POST"])
+def swipe(card_reader_id):
+	"""Answers if the card may open the card reader right now"""
+
+	# Checks if the request is a json
+	if not request.is_json:
+		return bad_request("Missing JSON in request")
+
+	validator = Validator(SWIPE_SCHEMA, require_all=True, allow_unknown=True)
+	if not validator(request.json):
+		return bad_request(validator.errors)
+
+	card_id = request.json["card_id"]
+	allowed = access_index.is_allowed(card_id, card_reader_id)
+	return ok({"card_reader_id": card_reader_id, "allowed": allowed})
+
+
+@door_bp.route("/<int:card_reader_id>/allowlist", methods=["GET"])
+def get_allowlist(card_reader_id):
+	"""
+	Returns the allow-list of the card reader as binary data, the format is described in door_sync.py.
+	The version of the allow-list is also given in the X-Access-Version header.
+	"""
+	data = door_sync.allowlist(card_reader_id)
+	version = door_sync.HEADER.unpack_from(data)[0]
+	response = make_response(data)
+	response.headers["Content-Type"] = "application/octet-stream"
+	response.headers["X-Access-Version"] = str(version)
+	return response
+
+
+@door_bp.route("/sync", methods=["GET"])
+def sync():
+	"""
+	Returns the grants, revocations and blocked cards after the version given as since.
+	Controllers give their card_reader_id to only get the changes for their card reader.
+	"""
+	since = request.args.get("since", 0, type=int)
+	card_reader_id = request.args.get("card_reader_id", None, type=int)
+	if since < 0:
+		return bad_request("since must be a version, 0 or greater")
+
+	return ok(door_sync.changes_since(since, card_reader_id))
+
+
+@door_bp.route("/check", methods=["POST"])
+def check():
+	"""
+	Checks many cards and card readers at once, e.g. for audits. The body is {"checks": [[card_id, card_reader_id,
+	timestamp], ...]} where timestamp is seconds since the epoch, the answer has a true or false for every check.
+	The checks are made against the current access and its expiry, access that has been revoked is not known.
+	"""
+
+	# Checks if the request is a json
+	if not request.is_json:
+		return bad_request("Missing JSON in request")
+
+	# Checked by hand, the shared validator is not thread safe and too slow for thousands of checks
+	checks = request.json.get("checks")
+	if not isinstance(checks, list):
+		return bad_request({"checks": ["must be of list type"]})
+	if len(checks) > MAX_CHECKS:
+		return bad_request({"checks": ["max length is {}".format(MAX_CHECKS)]})
+	for i, c in enumerate(checks):
+		if not (isinstance(c, list) and len(c) == 3 and isinstance(c[0], str) and isinstance(c[1], int)
+				and isinstance(c[2], (int, float))):
+			return bad_request({"checks": [{i: ["must be [card_id, card_reader_id, timestamp]"]}]})
+
+	return ok({"results": check_many(checks)})
+
+
+@door_bp.route("/swipes", methods=["POST"])
+def add_swipes():
+	"""
+	Adds the swipes made at the card readers to the swipe log. The body is {"swipes": [[card_id, card_reader_id,
+	timestamp, allowed], ...]} where timestamp is seconds since the epoch and allowed tells if the door opened.
+	The swipes are written a moment later, when the log can not keep up the batch is refused with 503 and
+	the controller sends it again after the number of seconds in the Retry-After header.
+	"""
+
+	# Checks if the request is a json
+	if not request.is_json:
+		return bad_request("Missing JSON in request")
+
+	swipes = request.json.get("swipes")
+	if not isinstance(swipes, list):
+		return bad_request({"swipes": ["must be of list type"]})
+	if len(swipes) > MAX_SWIPES:
+		return bad_request({"swipes": ["max length is {}".format(MAX_SWIPES)]})
+	# The timestamp picks the table of the day, so it must be a time the controllers can have swiped at
+	now = time.time()
+	oldest, newest = now - current_app.config["SWIPE_MAX_AGE"], now + current_app.config["SWIPE_MAX_AHEAD"]
+	for i, s in enumerate(swipes):
+		if not (isinstance(s, list) and len(s) == 4 and isinstance(s[0], str) and isinstance(s[1], int)
+				and isinstance(s[2], (int, float)) and isinstance(s[3], bool)):
+			return bad_request({"swipes": [{i: ["must be [card_id, card_reader_id, timestamp, allowed]"]}]})
+		if not (math.isfinite(s[2]) and oldest <= s[2] <= newest):
+			message = "timestamp must be between {} and {}".format(int(oldest), int(newest))
+			return bad_request({"swipes": [{i: [message]}]})
+
+	if not swipe_log.add(swipes):
+		response = make_response(service_unavailable("The swipe log is behind, try again later"))
+		response.headers["Retry-After"] = str(int(current_app.config["SWIPE_FLUSH_INTERVAL"]) or 1)
+		return response
+	return accepted({"accepted": len(swipes)})
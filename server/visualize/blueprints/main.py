@@ -3,19 +3,23 @@ This module contains the logik for the calls that are related to the reader role
 The url for the calls in this module is http://127.0.0.1:5000/<route>
 """
 
+from datetime import datetime
+
 # Standard flask libraries
-from flask import Blueprint, request
+from flask import Blueprint, request, current_app
 # Handle authorization
 from flask_jwt_extended import (
 	jwt_required, create_access_token, get_raw_jwt
 
 )
+from sqlalchemy.exc import SQLAlchemyError
 
+# Resolves the role of the reader
+from visualize.auth import find_reader_with_role, reader_claims
 # Help functions for validation and simplifications
 from visualize.help_functions import *
-from visualize.models import Admin, Approver, blacklist
-# The database structure
-from visualize.models.reader import Reader
+from visualize.database import pool_status
+from visualize.models import db, blacklist
 
 main_bp = Blueprint('main', __name__)
 
@@ -40,7 +44,8 @@ def login():
 	if not password:
 		return bad_request("The password field can not be empty")
 
-	reader = Reader.query.filter_by(email=email).first()
+	# Gets the reader and its role
+	reader, role = find_reader_with_role(email)
 
 	# If non existing email
 	if not reader:
@@ -50,18 +55,13 @@ def login():
 	if not reader.check_password(password):
 		return bad_request("ERROR: Wrong password.")
 
-	approver = Approver.query.filter_by(reader_id=reader.id).first()
-	admin = Admin.query.filter_by(approver_id=reader.id).first()
-
-	# Gets the users role
-	role = "reader"
-	if approver:
-		role = "approver"
-	if admin:
-		role = "admin"
+	# Rehash the password if the configured work factor has changed since it was hashed
+	if reader.password_needs_rehash():
+		reader.set_password(password)
+		db.session.commit()
 
-	# Create the users access token
-	token = create_access_token(identity=email)
+	# Create the users access token, the role is stored in the token so it does not have to be queried again
+	token = create_access_token(identity=email, user_claims=reader_claims(reader, role))
 
 	json = {"access_token": token, "email": reader.email, "name": reader.name, "surname": reader.surname, "role": role}
 	return ok(json)
@@ -70,8 +70,25 @@ def login():
 @main_bp.route('/logout', methods=["POST"])
 @jwt_required
 def logout_user():
-	print("logout")
-	jti = get_raw_jwt()['jti']
-	blacklist.add_jti_to_blacklist(str(jti))
+	token = get_raw_jwt()
+	blacklist.add_jti_to_blacklist(str(token['jti']), datetime.fromtimestamp(token['exp']))
 	return ok("logged out")
 
+
+@main_bp.route("/health", methods=["GET"])
+def health():
+	"""
+	Returns if the database answers and the state of its connection pool, with the share of the connections in use as
+	saturation. Answers 503 if the database does not answer.
+	"""
+	# The pool is read before the check, which uses a connection of its own
+	status = pool_status(db.engine)
+	try:
+		with db.engine.connect() as connection:
+			connection.execute("SELECT 1")
+	except SQLAlchemyError:
+		# The error of the driver can name the host and the user of the database, it is only logged
+		current_app.logger.exception("The database does not answer the health check")
+		message, status_code = service_unavailable("The database does not answer")
+		return dict(message, status="unavailable", database=status), status_code
+	return ok({"status": "ok", "database": status})
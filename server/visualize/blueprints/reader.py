@@ -3,19 +3,20 @@ This module contains the logic for the calls that are related to the reader role
 The url for the calls in this module is http://127.0.0.1:5000/reader/<route>
 """
 
-import pickle
 # Standard flask libraries
 from flask import Blueprint, request
-# For handling JSON web tokens for authorization
-from flask_jwt_extended import jwt_required, get_jwt_identity, decode_token
 
+# The user making the request and the check of its role
+from visualize.auth import current_auth, role_required
 # Help functions for validation and simplifications
 from visualize.help_functions import ok, bad_request
-from visualize import validator
+from visualize import validator, map_grid
+from visualize.map_cache import map_cache
+from visualize.reachability import reachability
 
 from visualize.models import db, Reader, BelongsTo, RoomRequest, AccessGroupRequest, ResponsibleForAg, \
 	ResponsibleForRoom, AccessGroup, HasAccessTo, ApprovesRoomRequest, ApprovesAgRequest, CardReader, \
-	gives_access_to, Room, RequestStatus
+	gives_access_to, Room, RequestStatus, EffectiveAccess
 
 from datetime import date
 from dateutil.relativedelta import relativedelta
@@ -24,40 +25,59 @@ reader_bp = Blueprint('reader', __name__)
 
 
 @reader_bp.before_request  # before_request is run before every request in blueprint route
-@jwt_required
+@role_required("reader")
 def is_reader():
-	""" Checks if the request comes from a user that is admin."""
-	try:
-		email = decode_token(request.headers.get('Authorization')[7:])["identity"]
-
-		current_admin = Reader.query.filter_by(email=email).first()
-	except IndexError:
-		return bad_request("User is not an admin")
-
-	if current_admin is None:
-		return bad_request("User is not an admin")
+	""" Checks if the request comes from a user that is reader."""
 
 
 @reader_bp.route("/self", methods=["GET"])  # Empty route does not work with my tests
 def get_current_reader():
 	"""Returns the current users data"""
 
-	# Get the email from the reader
-	email = get_jwt_identity()
-	current_reader = Reader.query.filter_by(email=email).first()
+	# Get the reader from the id in its token
+	auth = current_auth()
+	current_reader = Reader.query.get(auth.reader_id) if auth.reader_id is not None else None
 
 	# Checks if the reader is in the database
 	if current_reader is None:
-		return bad_request("{} is not in the database.".format(email))
+		return bad_request("{} is not in the database.".format(auth.identity))
 
 	return ok(current_reader.serialize)
 
 
 @reader_bp.route("/map", methods=["GET"])
 def load_map():
-	"""Loads the representation of the map from local file"""
-	map_repr = pickle.load(open("map_repr.pickle", "rb"))
-	return ok(map_repr)
+	"""
+	Returns the representation of the map, or 304 if the ETag in If-None-Match is still the current one.
+	With ?since=<version> only the JSON Patch operations from that version to the latest are returned, or the whole
+	map if they are not known. The version of the map is in the X-Map-Version header.
+	"""
+	if "since" not in request.args:
+		return map_cache.response(request)
+
+	since = request.args.get("since", type=int)
+	if since is None:
+		return bad_request("since must be a version number")
+	entry, operations = map_cache.changes_since(since)
+	if operations is None:
+		return ok({"version": entry.version, "map": entry.map})
+	return ok({"version": entry.version, "operations": operations})
+
+
+@reader_bp.route("/map/viewport", methods=["GET"])
+def load_map_viewport():
+	"""
+	Returns the shapes of the map that overlap the viewport ?x=&y=&width=&height=, in the units of the map, as
+	{"version": version, "map": {room text_id: [shapes]}}. Only the shapes in the viewport are returned, so a room
+	partly in it has only some of its shapes.
+	"""
+	try:
+		x, y, width, height = map_grid.parse_args(request.args)
+	except ValueError as e:
+		return bad_request(str(e))
+
+	entry = map_cache.get()
+	return ok({"version": entry.version, "map": entry.grid.viewport(x, y, width, height)})
 
 
 @reader_bp.route("/room", methods=["POST"])
@@ -73,7 +93,7 @@ def order_room():
 	}
 
 	# Get the email, room and the justification for the access to said room.
-	email = get_jwt_identity()
+	email = current_auth().identity
 	room_text_id = request.json.get("room_text_id")
 	justification = request.json.get("justification")
 
@@ -137,7 +157,7 @@ def order_ag():
 	}
 
 	# Get the email, access group and the justification for the access to said access group.
-	email = get_jwt_identity()
+	email = current_auth().identity
 	ag_id = request.json.get("ag_id")
 	justification = request.json.get("justification")
 
@@ -182,7 +202,7 @@ def get_orders():
 	"""Returns a list of all requests done"""
 
 	# Get the email from the user making the request
-	email = get_jwt_identity()
+	email = current_auth().identity
 
 	# Checks if the reader exists in the database
 	reader = Reader.query.filter_by(email=email).first()
@@ -215,19 +235,19 @@ def get_orders():
 	return ok({"orders": room_orders + ag_orders})
 
 
-def _find_room_helper(room_obj_list, room):
-	"""simple list search for finding object in first part of a tuple"""
-	for r_obj in room_obj_list:
-		if r_obj[0] == room:
-			return r_obj[1]
-	return None
+def _access_by_room_helper(access_list):
+	"""Builds a dict from room id to the first effective access found for that room"""
+	access = {}
+	for a in access_list:
+		access.setdefault(a.room_id, a)
+	return access
 
 
 @reader_bp.route("/access", methods=["GET"])
 def get_all_access():
 	"""Returns a list of all access the logged in user currently has"""
 	# Get the email from the user making the request
-	email = get_jwt_identity()
+	email = current_auth().identity
 	return get_all_access_helper(email)
 
 
@@ -239,48 +259,45 @@ def get_all_access_helper(email, room_filter=None):
 	if not reader:
 		return bad_request("Reader does not exist.")
 
-	# get room and belongsto for all rooms current user has access to from access groups as a list of tuples
-	ag_access = db.session.query(Room, BelongsTo) \
-		.join(CardReader, CardReader.room_b_id == Room.id) \
-		.join(gives_access_to, gives_access_to.c.cr_id == CardReader.id) \
-		.join(AccessGroup, AccessGroup.id == gives_access_to.c.ag_id) \
-		.join(BelongsTo, BelongsTo.ag_id == AccessGroup.id) \
-		.filter_by(reader_id=reader.id) \
-		.all()
-
-	# get room and belongs to for all rooms current user has access to as a list of tuples
-	room_access = db.session.query(Room, HasAccessTo) \
-		.join(CardReader, CardReader.room_b_id == Room.id) \
-		.join(HasAccessTo, HasAccessTo.card_reader_id == CardReader.id) \
-		.filter_by(reader_id=reader.id) \
-		.all()
+	# get all access of the reader, from access groups and given directly, with a single indexed read
+	access = EffectiveAccess.query.filter_by(reader_id=reader.id).order_by(EffectiveAccess.id).all()
+	ag_access = [a for a in access if a.source == "ag"]
+	room_access = [a for a in access if a.source == "room"]
 
 	# build a dict to return in JSON format
 	return_dict = {}
 
 	date_next_month = date.today() + relativedelta(months=+1)
 
+	# index the access by room id so every room is found in constant time
+	ag_by_room = _access_by_room_helper(ag_access)
+	r_by_room = _access_by_room_helper(room_access)
+
+	# the rooms the reader can get into from outside the building with the doors it may open now
+	reachable = reachability.rooms(reader.id)
+
 	all_rooms = Room.query.all()
-	if room_filter == None:  # equals is intended, empty list should not enter.
-		room_filter = [r.text_id for r in all_rooms]
+	if room_filter is not None:  # an empty list should still filter out every room
+		room_filter = set(room_filter)
 
 	for room in all_rooms:
-		ag = _find_room_helper(ag_access, room)
-		r = _find_room_helper(room_access, room)
+		ag = ag_by_room.get(room.id)
+		r = r_by_room.get(room.id)
 
-		has_access = ((ag is not None) or (r is not None)) and room.text_id in room_filter
+		has_access = ((ag is not None) or (r is not None)) and (room_filter is None or room.text_id in room_filter)
 		# python or takes object when using "ag or r"...
 
 		room_json = {}  # dictionay object for this room's metadata
 		#room_json["approvers"] = [approver.approver.serialize for approver in room.approvers]
 		room_json["access"] = has_access
+		room_json["reachable"] = has_access and room.id in reachable
 		room_json["name"] = room.name
 		if has_access:
 			if ag:
-				room_json["expires"] = ag.expiration_datetime
+				room_json["expires"] = ag.expires
 				room_json["ag_id"] = ag.ag_id
 			else:
-				room_json["expires"] = r.expiration_datetime
+				room_json["expires"] = r.expires
 			if room_json["expires"].date() < date_next_month:
 				room_json["warn_date"] = True
 		return_dict[room.text_id] = room_json
@@ -0,0 +1,223 @@
+"""
+This module contains the building as a graph in memory: the rooms are the nodes and the card readers the edges.
+
+Questions about how rooms and doors are connected, like the opposite door of a card reader, the doors between some
+rooms or the rooms that can be reached through some doors, are answered from dictionaries of integer ids instead of
+joins of card_reader with itself. The graph is read from the database the first time it is used, into new
+dictionaries that replace the old ones at once when they are complete, so a question is always answered from one
+whole graph without taking the lock.
+
+Rooms and card readers added, changed or deleted through the ORM are noticed when the session is flushed: a
+building_change row is added in the same transaction and the graph of this process is read again the next time it is
+used after the commit. The other workers look for new building_change rows every BUILDING_GRAPH_SYNC_INTERVAL seconds
+and read their graph again when there are any. Code that changes rooms or card readers in another way, like bulk
+inserts, calls record_change() in its transaction.
+"""
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import event, func
+from sqlalchemy.orm import Session
+
+from visualize.models import db, Room, CardReader, BuildingChange
+
+# Session.info key set when rooms or card readers are changed in the current transaction
+_CHANGED = "building_graph_changed"
+
+
+class _Graph:
+	"""The rooms and card readers read at one time, never changed after it is built"""
+
+	def __init__(self, version, changes, rooms, card_readers):
+		self.version = version  # number of times the graph has been read
+		self.changes = changes  # (number, highest version) of the building_change rows when it was read
+		self.rooms = dict(rooms)  # room id -> text_id
+		self.doors = {}  # card reader id -> (room A id or None, room B id)
+		self.out = {}  # room id -> ids of the card readers from the room
+		self.into = {}  # room id -> ids of the card readers into the room
+		self.pairs = {}  # (room A id, room B id) -> ids of the card readers from room A to room B
+		self.entrances = set()  # ids of the card readers without a room A
+		self.exits = {}  # room id -> ids of the card readers from the room without a room B
+		for card_reader_id, room_a, room_b in card_readers:
+			if room_b is None:  # leads out of the building, or nowhere
+				if room_a is not None:
+					self.exits.setdefault(room_a, set()).add(card_reader_id)
+				continue
+			self.doors[card_reader_id] = (room_a, room_b)
+			self.into.setdefault(room_b, set()).add(card_reader_id)
+			if room_a is None:
+				self.entrances.add(card_reader_id)
+			else:
+				self.out.setdefault(room_a, set()).add(card_reader_id)
+				self.pairs.setdefault((room_a, room_b), set()).add(card_reader_id)
+
+	def neighbours(self, room_id):
+		return {self.doors[card_reader_id][1] for card_reader_id in self.out.get(room_id, ())} | \
+			{self.doors[card_reader_id][0] for card_reader_id in self.into.get(room_id, ())
+			 if card_reader_id not in self.entrances}
+
+
+class BuildingGraph:
+	"""Rooms and the card readers between them, as adjacency dictionaries of ids"""
+
+	def __init__(self):
+		self._graph = None  # the _Graph last read, None when it must be read again
+		self._version = 0  # number of times the graph has been read
+		self._checked = 0.0  # when the building_change table was looked at last
+		self._lock = threading.Lock()
+
+	def reset(self):
+		"""Forgets the graph, it is read from the database the next time it is used"""
+		self._graph = None
+
+	@property
+	def version(self):
+		"""A number that changes every time the graph is read again, for results computed from it"""
+		return self._current().version
+
+	def text_id(self, room_id):
+		"""Returns the text_id of the room, or None if it does not exist"""
+		return self._current().rooms.get(room_id)
+
+	def rooms_of(self, card_reader_ids):
+		"""Returns the ids of the rooms the card readers lead into"""
+		graph = self._current()
+		return {graph.doors[card_reader_id][1] for card_reader_id in card_reader_ids if card_reader_id in graph.doors}
+
+	def opposite(self, card_reader_id):
+		"""Returns the id of a card reader the other way through the same door, or None if there is none"""
+		graph = self._current()
+		room_a, room_b = graph.doors.get(card_reader_id, (None, None))
+		opposites = graph.pairs.get((room_b, room_a))
+		return min(opposites) if opposites and room_a is not None else None
+
+	def neighbours(self, room_id):
+		"""Returns the ids of the rooms with a card reader to or from the room"""
+		return self._current().neighbours(room_id)
+
+	def doors_of(self, room_id):
+		"""Returns the ids of the card readers to and from the room, the entrances and exits included"""
+		graph = self._current()
+		return graph.out.get(room_id, set()) | graph.into.get(room_id, set()) | graph.exits.get(room_id, set())
+
+	def doors_between(self, room_ids):
+		"""Returns the ids of the card readers from one of the rooms to another of them"""
+		graph = self._current()
+		room_ids = set(room_ids)
+		return {card_reader_id for room_id in room_ids for card_reader_id in graph.out.get(room_id, ())
+				if graph.doors[card_reader_id][1] in room_ids}
+
+	def entrances(self, room_id=None):
+		"""Returns the ids of the card readers into the building, or only into the room if it is given"""
+		graph = self._current()
+		if room_id is None:
+			return set(graph.entrances)
+		return graph.into.get(room_id, set()) & graph.entrances
+
+	def components(self, room_ids=None):
+		"""
+		Returns the groups of rooms connected to each other by card readers in any direction, as a list of sets of
+		room ids. Only the given rooms and the card readers between them are used, or the whole building.
+		"""
+		graph = self._current()
+		rooms = set(graph.rooms if room_ids is None else room_ids)
+		found = []
+		while rooms:
+			start = rooms.pop()
+			component = {start}
+			queue = deque([start])
+			while queue:
+				room_id = queue.popleft()
+				for neighbour in graph.neighbours(room_id) & rooms:
+					rooms.discard(neighbour)
+					component.add(neighbour)
+					queue.append(neighbour)
+			found.append(component)
+		return found
+
+	def reachable(self, card_reader_ids, start=None):
+		"""
+		Returns the ids of the rooms that can be reached through the card readers, from outside the building through
+		its entrances, or from the rooms in start if it is given.
+		"""
+		graph = self._current()
+		allowed = set(card_reader_ids)
+		if start is None:
+			rooms = {graph.doors[card_reader_id][1] for card_reader_id in graph.entrances & allowed}
+		else:
+			rooms = set(start) & set(graph.rooms)
+		queue = deque(rooms)
+		while queue:
+			for card_reader_id in graph.out.get(queue.popleft(), set()) & allowed:
+				room_id = graph.doors[card_reader_id][1]
+				if room_id not in rooms:
+					rooms.add(room_id)
+					queue.append(room_id)
+		return rooms
+
+	def _current(self):
+		"""Returns the graph, read again if it was reset or changed by another worker"""
+		graph = self._graph
+		if graph is None or time.monotonic() - self._checked >= current_app.config["BUILDING_GRAPH_SYNC_INTERVAL"]:
+			graph = self._load()
+		return graph
+
+	def _load(self):
+		with self._lock:
+			graph = self._graph
+			interval = current_app.config["BUILDING_GRAPH_SYNC_INTERVAL"]
+			if graph is not None and time.monotonic() - self._checked < interval:
+				return graph
+
+			# SELECT count(building_change.version), max(building_change.version) FROM building_change
+
+			# The rows are never deleted, so the count also changes when a lower version commits after a higher one
+			changes = tuple(db.session.query(func.count(BuildingChange.version), func.max(BuildingChange.version)).one())
+			self._checked = time.monotonic()
+			if graph is not None and graph.changes == changes:
+				return graph
+
+			# SELECT room.id, room.text_id FROM room
+			# SELECT card_reader.id, card_reader.room_a_id, card_reader.room_b_id FROM card_reader
+
+			self._version += 1
+			graph = _Graph(self._version, changes, db.session.query(Room.id, Room.text_id),
+						   db.session.query(CardReader.id, CardReader.room_a_id, CardReader.room_b_id))
+			self._graph = graph
+			return graph
+
+
+def record_change(session=None):
+	"""Adds a building_change row in the transaction of the session, when rooms or card readers are changed in SQL"""
+	session = session or db.session
+	session.execute(BuildingChange.__table__.insert().values(changed=datetime.now()))
+	session.info[_CHANGED] = True
+
+
+building_graph = BuildingGraph()
+
+
+@event.listens_for(Session, "after_flush")
+def _after_flush(session, flush_context):
+	if session.info.get(_CHANGED):
+		return
+	# A card reader is also in session.dirty when only one of its collections changed through a backref, like the
+	# access groups or has_access_to of the card reader, which is not a change of the building
+	if any(isinstance(instance, (Room, CardReader)) for instance in (*session.new, *session.deleted)) or \
+			any(isinstance(instance, (Room, CardReader)) and session.is_modified(instance, include_collections=False)
+				for instance in session.dirty):
+		record_change(session)
+
+
+@event.listens_for(Session, "after_commit")
+def _after_commit(session):
+	if session.info.pop(_CHANGED, None):
+		building_graph.reset()
+
+
+@event.listens_for(Session, "after_rollback")
+def _after_rollback(session):
+	session.info.pop(_CHANGED, None)
@@ -0,0 +1,116 @@
+"""
+This module approves and denies many room and access group requests at once.
+
+The requests of each type are looked up with one query, the card readers the approved room requests give access to
+are granted for all of them together (see access_grants.py) and the new belongs_to rows are inserted in bulk.
+Everything is done in one transaction, so an approver clearing a backlog waits for one commit instead of one for every
+request.
+A request that can not be decided gets an error in the results and does not stop the others.
+"""
+from datetime import date, timedelta
+
+from visualize import materialized_access, access_grants
+from visualize.models import db, RoomRequest, AccessGroupRequest, ApprovesRoomRequest, ApprovesAgRequest, \
+	BelongsTo, RequestStatus
+
+HALF_YEAR = 183  # number of days in half a year
+# Max number of requests decided at once
+MAX_ITEMS = 1000
+
+MESSAGES = {
+	("Room", True): "Request for room was approved",
+	("Room", False): "Request for room was denied",
+	("AG", True): "Request for ag was approved",
+	("AG", False): "Request for access group was denied",
+}
+
+
+def _pending(request, approves, approves_request_id, target, approver_id, request_ids):
+	"""Returns {request id: (reader id, room or access group id)} of the pending requests waiting for the approver"""
+
+	# SELECT room_request.id, room_request.reader_id, room_request.room_id FROM room_request
+	# JOIN approves_room_request ON approves_room_request.room_request_id = room_request.id
+	# WHERE approves_room_request.approver_id = [approver_id] AND room_request.id IN [request_ids]
+	# AND room_request.status = 'PENDING'
+
+	if not request_ids:
+		return {}
+	rows = db.session.query(request.id, request.reader_id, target) \
+		.join(approves, approves_request_id == request.id) \
+		.filter(approves.approver_id == approver_id, request.id.in_(request_ids),
+				request.status == RequestStatus.PENDING)
+	return {request_id: (reader_id, target_id) for request_id, reader_id, target_id in rows}
+
+
+def _grant_ags(memberships, reader_ids, expires):
+	"""Adds the readers to the access groups, given as (reader id, access group id) pairs"""
+	existing = set(db.session.query(BelongsTo.reader_id, BelongsTo.ag_id).filter(BelongsTo.reader_id.in_(reader_ids)))
+	db.session.bulk_insert_mappings(BelongsTo, [
+		{"reader_id": reader_id, "ag_id": ag_id, "expiration_datetime": expires}
+		for reader_id, ag_id in set(memberships) - existing])
+
+
+def _close(request, approves, approves_request_id, approver_id, approved, denied):
+	"""Removes the requests from the approver and sets their status"""
+	handled = approved + denied
+	if not handled:
+		return
+	db.session.query(approves).filter(approves.approver_id == approver_id, approves_request_id.in_(handled)) \
+		.delete(synchronize_session=False)
+	for request_ids, status in [(approved, RequestStatus.APPROVED), (denied, RequestStatus.DENIED)]:
+		if request_ids:
+			db.session.query(request).filter(request.id.in_(request_ids)) \
+				.update({request.status: status}, synchronize_session=False)
+
+
+def decide(approver_id, items):
+	"""
+	Approves or denies the requests waiting for the approver in one transaction.
+	:param items: list of {"request_id": int, "type": "Room" or "AG", "is_access_granted": bool}
+	:return: list of {"request_id", "type", "ok", "message"}, one for every item in the same order
+	"""
+	results = [{"request_id": item["request_id"], "type": item["type"], "ok": False, "message": None} for item in items]
+	wanted = {"Room": {}, "AG": {}}  # type -> request id -> index of the item
+	for index, item in enumerate(items):
+		if item["type"] not in wanted:
+			results[index]["message"] = "{} is not a valid type.".format(item["type"])
+		elif item["request_id"] in wanted[item["type"]]:
+			results[index]["message"] = "{} appears more than once.".format(item["request_id"])
+		else:
+			wanted[item["type"]][item["request_id"]] = index
+
+	rooms = _pending(RoomRequest, ApprovesRoomRequest, ApprovesRoomRequest.room_request_id, RoomRequest.room_id,
+					 approver_id, list(wanted["Room"]))
+	ags = _pending(AccessGroupRequest, ApprovesAgRequest, ApprovesAgRequest.ag_request_id, AccessGroupRequest.ag_id,
+				   approver_id, list(wanted["AG"]))
+
+	decided = {"Room": ([], []), "AG": ([], [])}  # type -> (approved request ids, denied request ids)
+	for request_type, found, name in [("Room", rooms, "room"), ("AG", ags, "ag")]:
+		for request_id, index in wanted[request_type].items():
+			if request_id not in found:
+				results[index]["message"] = "{} not a valid {} request for approver.".format(request_id, name)
+				continue
+			granted = items[index]["is_access_granted"]
+			decided[request_type][0 if granted else 1].append(request_id)
+			results[index].update(ok=True, message=MESSAGES[(request_type, granted)])
+
+	approved_rooms, denied_rooms = decided["Room"]
+	approved_ags, denied_ags = decided["AG"]
+	readers = {rooms[request_id][0] for request_id in approved_rooms} | \
+			  {ags[request_id][0] for request_id in approved_ags}
+
+	if readers:
+		expires = date.today() + timedelta(days=HALF_YEAR)
+		# The access groups first, the doors of a room depend on the rooms the reader can get into
+		if approved_ags:
+			_grant_ags([ags[request_id] for request_id in approved_ags], readers, expires)
+		if approved_rooms:
+			access_grants.grant_rooms(approved_rooms, expires)
+		materialized_access.refresh_readers(readers)
+
+	_close(RoomRequest, ApprovesRoomRequest, ApprovesRoomRequest.room_request_id, approver_id,
+		   approved_rooms, denied_rooms)
+	_close(AccessGroupRequest, ApprovesAgRequest, ApprovesAgRequest.ag_request_id, approver_id,
+		   approved_ags, denied_ags)
+	db.session.commit()
+	return results
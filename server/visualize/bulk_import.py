@@ -0,0 +1,161 @@
+"""
+This module imports many readers at once from CSV or JSON lines.
+
+The rows are parsed and validated in a single streaming pass. Valid rows are collected in batches,
+the passwords of a batch are hashed in a pool of processes and the batch is inserted in one transaction.
+Rows that can not be imported are returned in a report together with their line number.
+
+The pool of BULK_IMPORT_PROCESSES processes is started by the first import and shared by all imports of the server,
+so concurrent uploads do not start more processes. Batches of fewer than IN_PROCESS_HASHES passwords are hashed in the
+server process instead, where starting the pool would take longer than the hashing.
+"""
+import csv
+import json
+import multiprocessing
+import os
+import threading
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+from bcrypt import hashpw, gensalt
+from cerberus import Validator
+from flask import current_app
+
+from visualize import password_hashing
+from visualize.help_functions import validate_password
+from visualize.models import db, Reader
+from visualize.schemas import USER_SCHEMA
+
+BATCH_SIZE = 500
+FIELDS = ["email", "name", "surname", "password"]
+# Batches with fewer passwords than this are hashed without the pool of processes
+IN_PROCESS_HASHES = 16
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _hash_password(password, rounds):
+	"""Hashes a password, run in the worker processes"""
+	return hashpw(password.encode("utf-8"), gensalt(rounds)).decode("utf-8")
+
+
+def _shared_pool():
+	"""Returns the pool of processes shared by all imports, started the first time it is needed"""
+	global _pool
+	with _pool_lock:
+		if _pool is None:
+			# spawn instead of fork since the server may be running threads
+			_pool = ProcessPoolExecutor(max_workers=current_app.config["BULK_IMPORT_PROCESSES"] or os.cpu_count(),
+										mp_context=multiprocessing.get_context("spawn"))
+		return _pool
+
+
+def _hash_passwords(passwords, pool, rounds):
+	"""Hashes the passwords in the given pool, the shared pool or in this process if there are only a few"""
+	if pool is None and len(passwords) < IN_PROCESS_HASHES:
+		return [password_hashing.generate_password_hash(password) for password in passwords]
+	return list((pool or _shared_pool()).map(_hash_password, passwords, [rounds] * len(passwords), chunksize=16))
+
+
+def parse_csv(lines):
+	"""Yields (line number, row) for every row in CSV lines, the first line is a header with the field names"""
+	reader = csv.DictReader(lines)
+	for row in reader:
+		yield reader.line_num, row
+
+
+def parse_json_lines(lines):
+	"""Yields (line number, row) for every non-empty line of JSON objects"""
+	for line_number, line in enumerate(lines, start=1):
+		if not line.strip():
+			continue
+		try:
+			row = json.loads(line)
+		except ValueError:
+			row = None
+		yield line_number, row
+
+
+def validate_rows(rows, report):
+	"""
+	Yields the rows that pass the same checks as when a single user is created.
+	The failing rows are added to the report.
+	"""
+	validator = Validator(USER_SCHEMA, require_all=True)
+	seen_emails = set()
+	for line_number, row in rows:
+		if not isinstance(row, dict):
+			report.append({"line": line_number, "errors": "Row is not a valid object"})
+			continue
+		row = {field: row.get(field) for field in FIELDS}
+		if not validator(row):
+			report.append({"line": line_number, "email": row["email"], "errors": validator.errors})
+			continue
+		not_fulfilled = validate_password(row["password"])
+		if not_fulfilled:
+			report.append({"line": line_number, "email": row["email"], "errors": {"password": not_fulfilled}})
+			continue
+		if row["email"] in seen_emails:
+			report.append({"line": line_number, "email": row["email"], "errors": "Email appears more than once"})
+			continue
+		seen_emails.add(row["email"])
+		yield line_number, row
+
+
+def _batches(rows, size):
+	"""Groups the rows into lists of at most size rows"""
+	batch = []
+	for row in rows:
+		batch.append(row)
+		if len(batch) == size:
+			yield batch
+			batch = []
+	if batch:
+		yield batch
+
+
+def _insert_batch(batch, pool, rounds, report):
+	"""Hashes the passwords of the batch and inserts the new readers in one transaction"""
+	emails = [row["email"] for line_number, row in batch]
+	existing = {email for (email,) in db.session.query(Reader.email).filter(Reader.email.in_(emails))}
+
+	new_rows = []
+	for line_number, row in batch:
+		if row["email"] in existing:
+			report.append({"line": line_number, "email": row["email"], "errors": "This email is already in use!"})
+		else:
+			new_rows.append(row)
+
+	passwords = [row["password"] for row in new_rows]
+	hashes = _hash_passwords(passwords, pool, rounds)
+	db.session.bulk_insert_mappings(Reader, [
+		{"email": row["email"], "name": row["name"], "surname": row["surname"], "password": pw_hash,
+		 "card_id": uuid.uuid4().hex, "token_epoch": 0}
+		for row, pw_hash in zip(new_rows, hashes)])
+	db.session.commit()
+	return len(new_rows)
+
+
+def import_readers(lines, file_format="csv", processes=None):
+	"""
+	Imports readers from an iterable of text lines in the given format ("csv" or "jsonl").
+	:param processes: if given the passwords are hashed in a pool of this many processes of its own, e.g. for the
+		import command, instead of the pool shared by the server
+	:return: dict with the number of created readers and a list of the rows that failed
+	"""
+	parse = parse_csv if file_format == "csv" else parse_json_lines
+	rounds = current_app.config.get("BCRYPT_LOG_ROUNDS", 12)
+	report = []
+	created = 0
+
+	pool = ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context("spawn")) \
+		if processes else None
+	try:
+		for batch in _batches(validate_rows(parse(lines), report), BATCH_SIZE):
+			created += _insert_batch(batch, pool, rounds, report)
+	finally:
+		if pool is not None:
+			pool.shutdown()
+
+	return {"created": created, "failed": sorted(report, key=lambda row: row["line"])}
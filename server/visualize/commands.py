@@ -0,0 +1,116 @@
+"""
+This module contains the commands that can be run with the flask command line tool, e.g. `flask purge-blacklist`.
+"""
+import os
+import time
+from datetime import datetime, date, timedelta
+
+import click
+from flask.cli import with_appcontext
+
+from visualize import materialized_access, door_sync, swipe_log
+from visualize.occupancy import occupancy
+from visualize.bulk_import import import_readers
+from visualize.models import db, blacklist, CardReader
+
+
+@click.command("purge-blacklist")
+@click.option("--batch-size", default=1000, help="Max number of rows deleted per transaction.")
+@click.option("--pause", default=0.1, help="Seconds to sleep between batches.")
+@click.option("--interval", default=0, help="Keep running and purge every interval seconds.")
+@with_appcontext
+def purge_blacklist(batch_size, pause, interval):
+	"""Deletes the blacklisted tokens that have expired."""
+	while True:
+		deleted = blacklist.purge_expired(batch_size, pause)
+		click.echo("Deleted {} expired tokens from the blacklist.".format(deleted))
+		if not interval:
+			break
+		time.sleep(interval)
+
+
+@click.command("import-readers")
+@click.argument("file", type=click.File("r", encoding="utf-8"))
+@click.option("--format", "file_format", type=click.Choice(["csv", "jsonl"]), default="csv",
+			  help="CSV with the header email,name,surname,password or one JSON object per line.")
+@click.option("--processes", default=None, type=int, help="Number of processes hashing passwords.")
+@with_appcontext
+def import_readers_command(file, file_format, processes):
+	"""Creates the readers in FILE, the rows that fail are printed."""
+	result = import_readers(file, file_format, processes)
+	for row in result["failed"]:
+		click.echo("Line {}: {}".format(row["line"], row["errors"]))
+	click.echo("Created {} readers, {} rows failed.".format(result["created"], len(result["failed"])))
+
+
+@click.command("check-effective-access")
+@click.option("--repair", is_flag=True, help="Rebuild the table if it differs.")
+@with_appcontext
+def check_effective_access(repair):
+	"""Compares the effective_access table with the access computed from scratch and prints the differences."""
+	missing, extra = materialized_access.check()
+	for row in missing:
+		click.echo("Missing: {}".format(dict(zip(materialized_access.COLUMNS, row))))
+	for row in extra:
+		click.echo("Extra: {}".format(dict(zip(materialized_access.COLUMNS, row))))
+	click.echo("{} missing and {} extra rows.".format(len(missing), len(extra)))
+
+	if repair and (missing or extra):
+		materialized_access.rebuild()
+		db.session.commit()
+		click.echo("The table has been rebuilt.")
+
+
+@click.command("export-allowlists")
+@click.argument("directory", type=click.Path(file_okay=False))
+@with_appcontext
+def export_allowlists(directory):
+	"""Writes the binary allow-list of every card reader to DIRECTORY/<card_reader_id>.bin."""
+	os.makedirs(directory, exist_ok=True)
+	card_reader_ids = [card_reader_id for (card_reader_id,) in db.session.query(CardReader.id)]
+	for card_reader_id in card_reader_ids:
+		with open(os.path.join(directory, "{}.bin".format(card_reader_id)), "wb") as file:
+			file.write(door_sync.allowlist(card_reader_id))
+	click.echo("Exported the allow-lists of {} card readers at version {}.".format(
+		len(card_reader_ids), door_sync.current_version()))
+
+
+@click.command("purge-access-changes")
+@click.option("--days", default=30, help="Keep the changes of this many days.")
+@with_appcontext
+def purge_access_changes(days):
+	"""Deletes old changes of the door controller sync feed, controllers that are further behind start over."""
+	deleted = door_sync.purge_changes(datetime.now() - timedelta(days=days))
+	click.echo("Deleted {} access changes.".format(deleted))
+
+
+@click.command("purge-swipes")
+@click.option("--days", default=90, help="Keep the swipes of this many days.")
+@with_appcontext
+def purge_swipes(days):
+	"""Drops the tables of the swipe log that are older than the given number of days."""
+	dropped = swipe_log.drop_days_before(date.today() - timedelta(days=days))
+	click.echo("Dropped the swipes of {} days.".format(dropped))
+
+
+@click.command("replay-occupancy")
+@click.option("--from-scratch", is_flag=True, help="Read the whole swipe log instead of starting at the checkpoint.")
+@with_appcontext
+def replay_occupancy(from_scratch):
+	"""Builds the room occupancy from the latest checkpoint and the swipe log, and saves a new checkpoint."""
+	start = time.perf_counter()
+	read = occupancy.replay(from_scratch)
+	counts = occupancy.counts()
+	click.echo("Read {} swipes in {:.2f}s, {} people in {} rooms.".format(
+		read, time.perf_counter() - start, sum(counts.values()), len(counts)))
+
+
+def register_commands(app):
+	"""Adds all commands in this module to the app"""
+	app.cli.add_command(purge_blacklist)
+	app.cli.add_command(import_readers_command)
+	app.cli.add_command(check_effective_access)
+	app.cli.add_command(export_allowlists)
+	app.cli.add_command(purge_access_changes)
+	app.cli.add_command(purge_swipes)
+	app.cli.add_command(replay_occupancy)
@@ -0,0 +1,52 @@
+"""
+This module configures the connection pool of the database and reports how busy it is.
+
+SQLite, the database of development and of the tests unless SQLALCHEMY_DATABASE_URI is set, keeps the pool
+SQLAlchemy picks for it. A server database like PostgreSQL gets a pool of DB_POOL_SIZE connections that may grow by
+DB_MAX_OVERFLOW when they are all in use, after which a request waits DB_POOL_TIMEOUT seconds for a connection. With
+DB_POOL_PRE_PING a connection is checked before it is used, so connections closed by the database server or a restart
+are replaced instead of failing a request. PostgreSQL cancels statements that run longer than DB_STATEMENT_TIMEOUT
+milliseconds.
+"""
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.pool import QueuePool
+
+
+def engine_options(config):
+	"""Returns the options for create_engine of the configured database, for SQLALCHEMY_ENGINE_OPTIONS"""
+	url = make_url(config["SQLALCHEMY_DATABASE_URI"])
+	if url.get_backend_name() == "sqlite":
+		return {}
+
+	options = {
+		"pool_size": config["DB_POOL_SIZE"],
+		"max_overflow": config["DB_MAX_OVERFLOW"],
+		"pool_timeout": config["DB_POOL_TIMEOUT"],
+		"pool_pre_ping": config["DB_POOL_PRE_PING"],
+	}
+	if url.get_backend_name() == "postgresql" and config["DB_STATEMENT_TIMEOUT"]:
+		options["connect_args"] = {"options": "-c statement_timeout={}".format(config["DB_STATEMENT_TIMEOUT"])}
+	return options
+
+
+def pool_status(engine):
+	"""
+	Returns the state of the connection pool of the engine, with the share of the connections that are in use as
+	saturation. A saturation of 1 means requests are waiting for a connection.
+	"""
+	pool = engine.pool
+	status = {"backend": engine.url.get_backend_name(), "pool": type(pool).__name__}
+	if not isinstance(pool, QueuePool):
+		return status
+
+	# The pool may open max_overflow more connections than its size, a negative max_overflow is no limit
+	max_overflow = pool._max_overflow
+	status.update({
+		"size": pool.size(),
+		"max_overflow": max_overflow,
+		"checked_in": pool.checkedin(),
+		"checked_out": pool.checkedout(),
+	})
+	if max_overflow >= 0:
+		status["saturation"] = round(pool.checkedout() / (pool.size() + max_overflow), 3)
+	return status
@@ -0,0 +1,78 @@
+"""
+This module contains the user directory, all readers with their role, as shown to admins.
+
+The directory is read with one query that outer joins the approver and admin tables to the reader table and derives
+the role from which of them the reader is in, reading only the columns that are shown. The whole directory is grouped
+by role as it always was, the readers first, then the approvers and then the admins. It can also be read a page at a
+time, ordered by the id of the readers: every page ends with a cursor, the id of its last reader, and the next page is
+read from after that id with the primary key, so every page costs the same.
+"""
+from visualize.auth import role_column, with_roles
+from visualize.models import db, Reader
+
+# Max number of readers in one page
+MAX_LIMIT = 1000
+
+
+def parse_args(args):
+	"""
+	Reads the cursor and the page size from the query string of a request.
+	:return: (after, limit), raises ValueError with a message if an argument is not valid
+	"""
+	after = None
+	if args.get("cursor"):
+		after = args.get("cursor", type=int)
+		if after is None:
+			raise ValueError("Not a cursor")
+
+	limit = args.get("limit", type=int)
+	if "limit" in args and (limit is None or not 0 < limit <= MAX_LIMIT):
+		raise ValueError("limit must be between 1 and {}".format(MAX_LIMIT))
+	return after, limit
+
+
+def readers(after=None, limit=None):
+	"""
+	Returns the readers with their role, ordered by id, or by role and then id when all readers are read.
+	:param after: the id of the reader to start after, None for the first page
+	:param limit: max number of readers, None for all
+	:return: (list of readers, cursor of the next page or None if this is the last)
+	"""
+
+	# SELECT reader.id, reader.name, reader.surname, reader.email, reader.card_id,
+	# CASE WHEN admin.approver_id IS NOT NULL THEN 'admin' WHEN approver.reader_id IS NOT NULL THEN 'approver'
+	# ELSE 'reader' END FROM reader
+	# LEFT OUTER JOIN approver ON approver.reader_id = reader.id
+	# LEFT OUTER JOIN admin ON admin.approver_id = reader.id
+	# [WHERE reader.id > [after]] ORDER BY [role DESC,] reader.id [LIMIT [limit + 1]]
+
+	query = with_roles(db.session.query(Reader.id, Reader.name, Reader.surname, Reader.email, Reader.card_id,
+										role_column()))
+	if after is not None:
+		query = query.filter(Reader.id > after)
+	if after is None and limit is None:
+		# 'reader' > 'approver' > 'admin'
+		query = query.order_by(role_column().desc())
+	query = query.order_by(Reader.id)
+	if limit is not None:
+		query = query.limit(limit + 1)
+	rows = query.all()
+
+	cursor = None
+	if limit is not None and len(rows) > limit:
+		rows = rows[:limit]
+		cursor = str(rows[-1][0])
+	return [{"name": name, "surname": surname, "email": email, "card_id": card_id, "role": role}
+			for reader_id, name, surname, email, card_id, role in rows], cursor
+
+
+def page(args):
+	"""
+	Returns the readers for the query string of a request, see parse_args. When a limit is given the next_cursor
+	is also returned, None on the last page. Raises ValueError with a message if an argument is not valid.
+	"""
+	after, limit = parse_args(args)
+	users, cursor = readers(after, limit)
+	if limit is None:
+		return {"users": users}
+	return {"users": users, "next_cursor": cursor}
@@ -0,0 +1,177 @@
+"""
+This module contains the in-memory index that answers if a card may open a card reader.
+
+The index maps the card id of every reader to the reader, and every reader to the card readers it may open and
+when that access expires. It is built from the effective_access table, so both direct access and access through
+access groups are included. The code that changes access marks the affected readers with readers_changed(),
+and when the transaction is committed only those readers are read again, the next time the index is used.
+The readers changed by other workers are found in the access changes (see door_sync.ChangeFeed), so a card blocked or
+access removed on another worker is refused here within DOOR_SYNC_INTERVAL seconds.
+"""
+import threading
+import time
+
+from sqlalchemy import event, func, select, and_, Table, MetaData, Column, Integer, String
+from sqlalchemy.orm import Session
+
+from visualize.door_sync import ChangeFeed
+from visualize.models import db, Reader, EffectiveAccess
+
+# Session.info key for the readers changed in the current transaction, None in the set means all readers
+_CHANGED = "door_access_changed"
+# Max number of ids in one IN clause when changed readers are read again
+CHUNK_SIZE = 500
+
+
+class AccessIndex:
+	"""card_id -> reader id -> {card reader id: expiry timestamp}, updated for the readers that have changed"""
+
+	def __init__(self):
+		self._readers = {}  # card_id -> reader id
+		self._cards = {}  # reader id -> card_id
+		self._access = {}  # reader id -> {card reader id: expiry timestamp}
+		self._pending = set()  # reader ids to read again, None means everything
+		self._loaded = False
+		self._feed = ChangeFeed()
+		self._lock = threading.Lock()
+
+	def load(self):
+		"""Reads the card ids and the access of all readers"""
+		with self._lock:
+			self._feed.start()
+			self._pending = set()
+			self._readers, self._cards, self._access = {}, {}, {}
+			self._read(Reader.query.filter(Reader.card_id != None), EffectiveAccess.query)
+			self._loaded = True
+
+	def mark(self, reader_ids):
+		"""Marks readers as changed, they are read again the next time the index is used"""
+		with self._lock:
+			if None in reader_ids:
+				self._loaded = False
+			elif self._loaded:
+				self._pending.update(reader_ids)
+
+	def is_allowed(self, card_id, card_reader_id, now=None):
+		"""Checks if the card may open the card reader at the given time (default now)"""
+		if self._loaded:
+			changed = self._feed.changed_readers()
+			if changed:
+				self.mark(changed)
+		if not self._loaded:
+			self.load()
+		elif self._pending:
+			self._apply_pending()
+
+		reader_id = self._readers.get(card_id)
+		if reader_id is None:
+			return False
+		expires = self._access.get(reader_id, {}).get(card_reader_id)
+		return expires is not None and expires > (now or time.time())
+
+	def _apply_pending(self):
+		"""Reads the readers that have changed again"""
+		with self._lock:
+			pending = list(self._pending)
+			self._pending = set()
+			for i in range(0, len(pending), CHUNK_SIZE):
+				chunk = pending[i:i + CHUNK_SIZE]
+				cards, access = self._query(Reader.query.filter(Reader.id.in_(chunk), Reader.card_id != None),
+											EffectiveAccess.query.filter(EffectiveAccess.reader_id.in_(chunk)))
+				# The new access is read before the old is replaced, so swipes are never denied in between
+				for reader_id in chunk:
+					if self._cards.get(reader_id) != cards.get(reader_id):
+						self._readers.pop(self._cards.pop(reader_id, None), None)
+					self._access[reader_id] = access.get(reader_id, {})
+				self._add(cards, access)
+
+	def _read(self, readers, access):
+		"""Adds the card ids of the readers and their effective access to the index, the lock must be held"""
+		self._add(*self._query(readers, access))
+
+	def _add(self, cards, access):
+		for reader_id, card_id in cards.items():
+			self._readers[card_id] = reader_id
+			self._cards[reader_id] = card_id
+		self._access.update(access)
+
+	@staticmethod
+	def _query(readers, access):
+		"""Returns {reader id: card_id} and {reader id: {card reader id: expiry timestamp}} from the queries"""
+		cards = dict(readers.with_entities(Reader.id, Reader.card_id))
+		doors_by_reader = {}
+		for reader_id, card_reader_id, expires in access.with_entities(
+				EffectiveAccess.reader_id, EffectiveAccess.card_reader_id, EffectiveAccess.expires):
+			doors = doors_by_reader.setdefault(reader_id, {})
+			# A reader can have access to the same card reader both directly and through access groups
+			doors[card_reader_id] = max(doors.get(card_reader_id, 0), expires.timestamp())
+		return cards, doors_by_reader
+
+
+access_index = AccessIndex()
+
+
+def readers_changed(reader_ids):
+	"""Marks the access or card of the readers as changed when the current transaction is committed"""
+	db.session.info.setdefault(_CHANGED, set()).update(reader_ids)
+
+
+def all_changed():
+	"""Marks the access of all readers as changed when the current transaction is committed"""
+	readers_changed([None])
+
+
+@event.listens_for(Session, "after_commit")
+def _after_commit(session):
+	changed = session.info.pop(_CHANGED, None)
+	if changed:
+		access_index.mark(changed)
+
+
+@event.listens_for(Session, "after_rollback")
+def _after_rollback(session):
+	session.info.pop(_CHANGED, None)
+
+
+# The checks of one call to check_many, only seen by the connection that created it
+_checks = Table("door_check", MetaData(),
+				Column("i", Integer, primary_key=True),
+				Column("card_id", String),
+				Column("card_reader_id", Integer),
+				prefixes=["TEMPORARY"])
+
+
+def check_many(checks):
+	"""
+	Checks many (card_id, card_reader_id, timestamp) at once against the database instead of the index.
+	The checks are inserted in a temporary table and joined with the effective access, so the number of queries
+	is the same however many checks there are. Blocked cards have no card_id any more, so they never match.
+	:return: list with True or False for every check
+	"""
+	connection = db.session.connection()
+	_checks.create(connection)
+	try:
+		connection.execute(_checks.insert(), [{"i": i, "card_id": card_id, "card_reader_id": card_reader_id}
+											  for i, (card_id, card_reader_id, timestamp) in enumerate(checks)])
+
+		# SELECT door_check.i, max(effective_access.expires) FROM door_check
+		# LEFT JOIN reader ON reader.card_id = door_check.card_id
+		# LEFT JOIN effective_access ON effective_access.reader_id = reader.id
+		#   AND effective_access.card_reader_id = door_check.card_reader_id
+		# GROUP BY door_check.i
+
+		# The left joins make the database go through the checks and look up the reader by card and then the access
+		# by (reader_id, card_reader_id), instead of going through all the access to every card reader in the checks
+		rows = connection.execute(
+			select([_checks.c.i, func.max(EffectiveAccess.expires)])
+			.select_from(_checks
+						 .outerjoin(Reader.__table__, Reader.card_id == _checks.c.card_id)
+						 .outerjoin(EffectiveAccess.__table__,
+									and_(EffectiveAccess.reader_id == Reader.id,
+										 EffectiveAccess.card_reader_id == _checks.c.card_reader_id)))
+			.group_by(_checks.c.i))
+		expires = {i: expiry.timestamp() for i, expiry in rows if expiry is not None}
+	finally:
+		_checks.drop(connection)
+
+	return [expires.get(i, 0) > timestamp for i, (card_id, card_reader_id, timestamp) in enumerate(checks)]
@@ -0,0 +1,270 @@
+"""
+This module contains the versioned allow-lists of the card readers, used by door controllers that must keep working
+when the server is down.
+
+A controller downloads the allow-list of its card reader once, a compact binary list of card ids and expiry times
+together with the version it was made at. It then polls for the changes made after that version: grants,
+revocations and blocked cards, read from the access_change table with a single indexed range query.
+The changes are recorded by the code that changes access (see materialized_access.py) and blocks cards.
+
+The same changes tell the in-memory caches of every worker which readers to read again, see ChangeFeed.
+
+The latest version is kept in memory for DOOR_SYNC_INTERVAL seconds (and forgotten when this process commits a change),
+so a poll from a controller that is up to date does not touch the database. On PostgreSQL a version can be committed
+after a higher one (see id_watermark.py), so a controller is only moved past a missing version when the changes after it
+are older than ID_GAP_TIMEOUT seconds, and is sent them again once the missing version has been committed.
+"""
+import struct
+import threading
+import time
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import event, func, or_
+from sqlalchemy.orm import Session
+
+from visualize.id_watermark import IdWatermark, gap_timeout
+from visualize.models import db, AccessChange, EffectiveAccess, Reader
+
+# Max number of changes returned by one poll, the controller polls again at once when there are more
+SYNC_LIMIT = 1000
+
+# Allow-list format, little endian: header with the version (uint64) and the number of cards (uint32),
+# followed by every card as the 16 bytes of its id and its expiry as seconds since the epoch (uint32).
+HEADER = struct.Struct("<QI")
+CARD = struct.Struct("<16sI")
+
+# Session.info key set when the current transaction records changes
+_CHANGED = "door_sync_changed"
+# The latest version and when it was read
+_latest = {"version": None, "read": 0.0}
+
+
+def current_version():
+	"""Returns the version of the latest change, 0 when nothing has changed"""
+	version = db.session.query(func.max(AccessChange.version)).scalar() or 0
+	_latest["version"], _latest["read"] = version, time.monotonic()
+	return version
+
+
+def cached_version():
+	"""Returns the latest version read less than DOOR_SYNC_INTERVAL seconds ago, or None"""
+	if time.monotonic() - _latest["read"] < current_app.config["DOOR_SYNC_INTERVAL"]:
+		return _latest["version"]
+	return None
+
+
+def _changed():
+	db.session.info[_CHANGED] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _after_commit(session):
+	if session.info.pop(_CHANGED, False):
+		_latest["version"] = None
+
+
+@event.listens_for(Session, "after_rollback")
+def _after_rollback(session):
+	session.info.pop(_CHANGED, None)
+
+
+def snapshot(reader_ids):
+	"""Returns the cards of the readers and the card readers they may open, to be compared after a change"""
+	cards = dict(db.session.query(Reader.id, Reader.card_id).filter(Reader.id.in_(reader_ids)))
+	access = {}
+	for reader_id, card_reader_id, expires in db.session.query(
+			EffectiveAccess.reader_id, EffectiveAccess.card_reader_id, func.max(EffectiveAccess.expires)) \
+			.filter(EffectiveAccess.reader_id.in_(reader_ids)) \
+			.group_by(EffectiveAccess.reader_id, EffectiveAccess.card_reader_id):
+		access[(reader_id, card_reader_id)] = expires
+	return cards, access
+
+
+def record_changes(reader_ids, before):
+	"""Compares the access of the readers with a snapshot taken before the change and records the differences"""
+	cards_before, access_before = before
+	cards, access = snapshot(reader_ids)
+	now = datetime.now()
+	changes = []
+
+	for key, expires in access.items():
+		if access_before.get(key) != expires:
+			changes.append({"kind": "grant", "card_id": cards.get(key[0]), "reader_id": key[0],
+							"card_reader_id": key[1], "expires": expires, "changed": now})
+	for key in access_before.keys() - access.keys():
+		# The reader may have been deleted, then its card is only found in the snapshot
+		changes.append({"kind": "revoke", "card_id": cards.get(key[0], cards_before.get(key[0])), "reader_id": key[0],
+						"card_reader_id": key[1], "expires": None, "changed": now})
+
+	# Changes of readers without a card are kept for the caches of other workers, the controllers do not get them
+	if changes:
+		db.session.bulk_insert_mappings(AccessChange, changes)
+		_changed()
+
+
+def card_blocked(card_id, reader_id):
+	"""Records that the card of the reader may not open any card reader any more"""
+	db.session.add(AccessChange(kind="block", card_id=card_id, reader_id=reader_id, changed=datetime.now()))
+	_changed()
+
+
+def reset():
+	"""Records that the allow-lists of all card readers must be downloaded again, e.g. after a rebuild"""
+	db.session.add(AccessChange(kind="reset", changed=datetime.now()))
+	_changed()
+
+
+def changes_since(version, card_reader_id=None, limit=SYNC_LIMIT):
+	"""
+	Returns the changes after the given version, for one card reader or for all.
+	:return: dict with the changes, the version to poll from next and if there are more changes to fetch
+	"""
+
+	# Nothing has changed since the controller polled last
+	cached = cached_version()
+	if cached is not None and version >= cached:
+		return {"version": version, "more": False, "reset": False, "changes": []}
+
+	# The latest version is read first, so a change made while the changes are read is not skipped
+	latest = _committed_version(version, current_version(), gap_timeout())
+
+	# SELECT * FROM access_change
+	# WHERE version > [version] AND version <= [latest] AND (card_id IS NOT NULL OR kind = 'reset')
+	#   AND (card_reader_id = [card_reader_id] OR card_reader_id IS NULL)
+	# ORDER BY version LIMIT [limit + 1]
+
+	query = AccessChange.query.filter(AccessChange.version > version, AccessChange.version <= latest,
+									  or_(AccessChange.card_id != None, AccessChange.kind == "reset"))
+	if card_reader_id is not None:
+		query = query.filter(or_(AccessChange.card_reader_id == card_reader_id, AccessChange.card_reader_id == None))
+	rows = query.order_by(AccessChange.version).limit(limit + 1).all()
+
+	more = len(rows) > limit
+	rows = rows[:limit]
+	# Changes of other card readers are skipped, unless there are more changes to fetch
+	next_version = rows[-1].version if more else max(version, latest)
+
+	# The changes before the oldest kept change have been purged, the controller has to start over
+	oldest = db.session.query(func.min(AccessChange.version)).scalar()
+	reset_needed = oldest is not None and version < oldest - 1
+
+	return {
+		"version": next_version,
+		"more": more,
+		"reset": reset_needed,
+		"changes": [{
+			"version": row.version,
+			"kind": row.kind,
+			"card_id": row.card_id,
+			"card_reader_id": row.card_reader_id,
+			"expires": int(row.expires.timestamp()) if row.expires else None
+		} for row in rows]
+	}
+
+
+def _committed_version(version, latest, timeout):
+	"""
+	Returns the highest version up to latest that a controller at the given version can be moved to, the version
+	before the first missing one that was taken less than timeout seconds ago and may still be committed.
+	"""
+	if not timeout or latest <= version:
+		return latest
+
+	# SELECT version FROM access_change
+	# WHERE version > [version] AND version <= [latest] AND changed >= [now - timeout] ORDER BY version
+
+	recent = [v for (v,) in db.session.query(AccessChange.version)
+		.filter(AccessChange.version > version, AccessChange.version <= latest,
+				AccessChange.changed >= datetime.now() - timedelta(seconds=timeout))
+		.order_by(AccessChange.version)]
+	if not recent:
+		return latest
+
+	# The version before the first recent one may be missing too, unless the controller already has it
+	first = recent[0]
+	if first - 1 > version and AccessChange.query.get(first - 1) is None:
+		return first - 2
+	for previous, current in zip(recent, recent[1:]):
+		if current != previous + 1:
+			return previous
+	return latest
+
+
+class ChangeFeed:
+	"""
+	The readers whose access or card was changed by any worker, for a cache in memory. The changes are read at most
+	every DOOR_SYNC_INTERVAL seconds, so a cache sees the changes of other workers within that time. Changes
+	committed by this process are also told to the caches directly, in after_commit hooks.
+	"""
+
+	def __init__(self):
+		self._position = None
+		self._read = 0.0
+		self._lock = threading.Lock()
+
+	def start(self):
+		"""Starts at the latest change, called before the cache is read so that no change made meanwhile is missed"""
+		with self._lock:
+			self._position = IdWatermark(db.session.query(func.max(AccessChange.version)).scalar() or 0)
+			self._read = time.monotonic()
+
+	def changed_readers(self):
+		"""
+		Returns the ids of the readers changed since the last call, None in the set when everything has to be read
+		again, or an empty set if the changes were read less than DOOR_SYNC_INTERVAL seconds ago.
+		"""
+		if time.monotonic() - self._read < current_app.config["DOOR_SYNC_INTERVAL"]:
+			return set()
+		with self._lock:
+			if self._position is None:
+				return {None}
+			if time.monotonic() - self._read < current_app.config["DOOR_SYNC_INTERVAL"]:
+				return set()
+
+			# SELECT version, kind, reader_id FROM access_change WHERE version > [position] OR version IN [gaps]
+
+			rows = db.session.query(AccessChange.version, AccessChange.kind, AccessChange.reader_id) \
+				.filter(self._position.condition(AccessChange.version)).all()
+			self._position.seen([version for version, _, _ in rows], gap_timeout())
+			self._read = time.monotonic()
+			return {None if kind == "reset" else reader_id for _, kind, reader_id in rows}
+
+
+def allowlist(card_reader_id):
+	"""Returns the allow-list of a card reader in the binary format described above"""
+	# Changes after a missing version are sent again in the sync feed, applying them twice does not matter
+	version = _committed_version(0, current_version(), gap_timeout())
+
+	# SELECT reader.card_id, max(effective_access.expires) FROM effective_access
+	# JOIN reader ON reader.id = effective_access.reader_id
+	# WHERE effective_access.card_reader_id = [card_reader_id] AND reader.card_id IS NOT NULL
+	# GROUP BY reader.card_id
+
+	cards = db.session.query(Reader.card_id, func.max(EffectiveAccess.expires)) \
+		.join(EffectiveAccess, EffectiveAccess.reader_id == Reader.id) \
+		.filter(EffectiveAccess.card_reader_id == card_reader_id, Reader.card_id != None) \
+		.group_by(Reader.card_id).all()
+
+	parts = [HEADER.pack(version, len(cards))]
+	parts.extend(CARD.pack(bytes.fromhex(card_id), int(expires.timestamp())) for card_id, expires in cards)
+	return b"".join(parts)
+
+
+def parse_allowlist(data):
+	"""Returns the version and a dict from card id to expiry timestamp of a binary allow-list"""
+	version, count = HEADER.unpack_from(data)
+	cards = {}
+	for i in range(count):
+		card, expires = CARD.unpack_from(data, HEADER.size + i * CARD.size)
+		cards[card.hex()] = expires
+	return version, cards
+
+
+def purge_changes(older_than):
+	"""Deletes the changes made before the given datetime, controllers that are further behind start over"""
+	# The latest change is kept so the version never goes back
+	deleted = AccessChange.query.filter(AccessChange.changed < older_than, AccessChange.version < current_version()) \
+		.delete(synchronize_session=False)
+	db.session.commit()
+	return deleted
@@ -66,6 +66,24 @@ def unauthorized(message):
 	return error(message), 401
 
 
+def conflict(message):
+	"""
+	A 409 response indicates that the request conflicts with the current state of the resource,
+	e.g. because it was changed by someone else since the client read it.
+	The client should read the resource again and retry.
+	"""
+	return error(message), 409
+
+
+def service_unavailable(message):
+	"""
+	A 503 response indicates that the server is temporarily unable to handle the request,
+	e.g. because it is overloaded. The client should try again later,
+	after the time given in the Retry-After header if there is one.
+	"""
+	return error(message), 503
+
+
 def validate_password(password):
 	"""
 	Checks if the password has the right format.
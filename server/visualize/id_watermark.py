@@ -0,0 +1,87 @@
+"""
+This module keeps track of the rows of an append-only table that have been read, by their increasing id.
+
+The caches of other workers (revoked tokens, the swipe log) and the door controllers find new rows by asking for the
+ids after the last one they have read. That assumes that rows become visible in the order of their ids, which holds
+for SQLite, where one transaction writes at a time, but not for PostgreSQL: ids are taken from a sequence when the row
+is inserted, before the commit, so a transaction that took id 5 can commit after the one that took id 6. A reader that
+has seen 6 would skip 5 for good.
+
+The ids that were skipped are therefore kept as gaps and read again, until ID_GAP_TIMEOUT seconds after they were
+found. This assumes that a transaction writing these tables commits within ID_GAP_TIMEOUT seconds of its insert, a gap
+that is older than that is taken to be a rolled back or deleted row. On SQLite a gap can only be a rolled back or
+deleted row, so gaps are not kept there.
+"""
+import time
+
+from flask import current_app
+from sqlalchemy import and_, or_
+
+from visualize.models import db
+
+# Max number of gaps kept, the oldest ones are forgotten first
+MAX_GAPS = 100000
+
+
+def gap_timeout():
+	"""Returns how many seconds a skipped id is read again, 0 when ids are visible in their order"""
+	if db.engine.url.get_backend_name() == "sqlite":
+		return 0
+	return current_app.config["ID_GAP_TIMEOUT"]
+
+
+def id_ranges(ids):
+	"""Returns the sorted ids as [(first, last), ...] ranges of consecutive ids"""
+	ranges = []
+	for i in sorted(ids):
+		if ranges and ranges[-1][1] == i - 1:
+			ranges[-1][1] = i
+		else:
+			ranges.append([i, i])
+	return [tuple(r) for r in ranges]
+
+
+class IdWatermark:
+	"""The highest id read so far and the lower ids that were skipped and may still be committed"""
+
+	def __init__(self, last_id=0):
+		self.last_id = last_id
+		self._gaps = {}  # id -> time.monotonic() when it was found missing
+
+	@property
+	def gaps(self):
+		return sorted(self._gaps)
+
+	@property
+	def safe_id(self):
+		"""The highest id below which every row has been read, where a reader restored from a checkpoint starts"""
+		return min(self._gaps) - 1 if self._gaps else self.last_id
+
+	def condition(self, column):
+		"""Returns the filter for the rows not read yet: the ids after the last one and the gaps"""
+		ranges = id_ranges(self._gaps)
+		if not ranges:
+			return column > self.last_id
+		return or_(column > self.last_id, *[column == first if first == last else and_(column >= first, column <= last)
+											for first, last in ranges])
+
+	def seen(self, ids, timeout):
+		"""
+		Marks the ids as read, the ids skipped after the last one become gaps that are read again for timeout
+		seconds. Expired gaps are forgotten.
+		"""
+		now = time.monotonic()
+		ids = set(ids)
+		for i in ids:
+			self._gaps.pop(i, None)
+		highest = max(ids, default=self.last_id)
+		if highest > self.last_id:
+			if timeout > 0:
+				# Only the MAX_GAPS ids below the highest one are looked at, e.g. the first read after a purge
+				for i in range(max(self.last_id + 1, highest - MAX_GAPS), highest):
+					if i not in ids:
+						self._gaps[i] = now
+			self.last_id = highest
+		self._gaps = {i: found for i, found in self._gaps.items() if now - found < timeout}
+		if len(self._gaps) > MAX_GAPS:
+			self._gaps = dict(sorted(self._gaps.items())[-MAX_GAPS:])
@@ -0,0 +1,181 @@
+"""
+This module keeps the versions of the map the frontend draws, and the latest one in memory ready to be sent.
+
+Every change of the map adds a row to map_version with the JSON Patch operations from the version before (see
+map_patch.py), so a client with an old version only has to download what changed since, and the whole map is only
+stored for the latest version. A new version gets the next number in the same transaction that clears the map of the
+version before it, so of two changes based on the same version only the first is saved and the other gets a
+MapConflict. Before the first version the map is the one in the file MAP_FILE, where it was saved before.
+
+The latest map is kept as encoded JSON, the same JSON gzipped and a strong ETag of the JSON, so answering a request is
+a comparison of the If-None-Match header and no work at all when the client already has the map. Clients that accept
+gzip get the gzipped map, with its own ETag since it is another representation of the same map. The shapes are also put
+in a MapGrid (see map_grid.py), so a client can ask for only the part of the map it shows. Versions saved by other
+workers are seen within MAP_SYNC_INTERVAL seconds.
+"""
+import gzip
+import hashlib
+import os
+import pickle
+import threading
+import time
+from datetime import datetime
+
+from flask import current_app, json, Response
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+
+from visualize import map_patch
+from visualize.map_grid import MapGrid
+from visualize.models import db, MapVersion
+
+
+class MapConflict(Exception):
+	"""Raised when a change is based on a version of the map that is not the latest one any more"""
+
+
+class MapEntry:
+	"""A version of the map, encoded and ready to be sent"""
+
+	def __init__(self, map_repr, version):
+		self.map = map_repr
+		self.version = version
+		# NaN and Infinity are not JSON, a map with them raises ValueError
+		self.body = json.dumps(map_repr, sort_keys=True, separators=(",", ":"), allow_nan=False).encode("utf-8")
+		# level 6 makes the map 3% bigger than level 9, in a quarter of the time
+		self.gzipped = gzip.compress(self.body, compresslevel=6, mtime=0)
+		self.etag = hashlib.sha256(self.body).hexdigest()[:32]
+		self.gzip_etag = self.etag + "-gzip"
+		self.grid = MapGrid(map_repr)
+
+
+class MapCache:
+	"""The latest version of the map, read again when another worker has saved a newer one"""
+
+	def __init__(self):
+		self._entry = None
+		self._last_sync = 0.0
+		self._lock = threading.Lock()
+
+	def get(self):
+		"""Returns the MapEntry of the latest version of the map"""
+		if self._entry is None or time.monotonic() - self._last_sync >= current_app.config["MAP_SYNC_INTERVAL"]:
+			with self._lock:
+				self._sync()
+		return self._entry
+
+	def save(self, map_repr):
+		"""
+		Saves the whole map as a new version, returns the number of the version.
+		Raises ValueError with a message if the map can not be sent as JSON.
+		"""
+		version, old_map = self._latest()
+		return self._add_version(version, map_patch.diff(old_map, map_repr), map_repr)
+
+	def patch(self, version, operations):
+		"""
+		Applies the JSON Patch operations to the map and saves it as a new version, returns the number of the version.
+		Raises MapConflict if version is not the latest version and ValueError with a message if the operations
+		can not be applied or the map can not be sent as JSON.
+		"""
+		latest, old_map = self._latest()
+		if version != latest:
+			raise MapConflict("The map has changed since version {}, the latest version is {}.".format(version, latest))
+		return self._add_version(latest, operations, map_patch.apply(old_map, operations))
+
+	def changes_since(self, version):
+		"""
+		Returns (the MapEntry of the latest version, the JSON Patch operations that change the map of the version into
+		the latest one), the operations are None if they are not known and the whole map has to be sent.
+		"""
+		entry = self.get()
+		if not 0 <= version <= entry.version:
+			return entry, None
+
+		# SELECT map_version.operations FROM map_version
+		# WHERE map_version.version > [version] AND map_version.version <= [latest] ORDER BY map_version.version
+
+		rows = db.session.query(MapVersion.operations) \
+			.filter(MapVersion.version > version, MapVersion.version <= entry.version) \
+			.order_by(MapVersion.version).all()
+		if len(rows) != entry.version - version:
+			return entry, None
+		return entry, [operation for (operations,) in rows for operation in operations]
+
+	def response(self, request):
+		"""Returns the map as an answer to the request, or 304 Not Modified if it has the same ETag"""
+		entry = self.get()
+		gzipped = request.accept_encodings["gzip"] > 0
+		etag = entry.gzip_etag if gzipped else entry.etag
+
+		if request.if_none_match.contains(etag):
+			response = Response(status=304)
+		else:
+			response = Response(entry.gzipped if gzipped else entry.body, mimetype="application/json")
+			if gzipped:
+				response.headers["Content-Encoding"] = "gzip"
+		response.set_etag(etag)
+		response.headers["X-Map-Version"] = str(entry.version)
+		response.headers["Cache-Control"] = "no-cache"  # the client asks every time, but with If-None-Match
+		response.headers["Vary"] = "Accept-Encoding"
+		return response
+
+	def reset(self):
+		"""Forgets the map, it is read from the database the next time it is asked for"""
+		with self._lock:
+			self._entry = None
+
+	def _sync(self):
+		"""Reads the latest version if it is not the one in memory, the lock must be held"""
+		version, map_repr = self._latest()
+		if self._entry is None or self._entry.version != version:
+			self._entry = MapEntry(map_repr, version)
+		self._last_sync = time.monotonic()
+
+	def _add_version(self, version, operations, map_repr):
+		"""Adds the version after the given one and commits, raises MapConflict if it was added by someone else"""
+		# The map is encoded before anything is written, a map that can not be sent is never the latest version
+		try:
+			entry = MapEntry(map_repr, version + 1)
+		except ValueError:
+			raise ValueError("The map can not contain NaN or Infinity")
+
+		# UPDATE map_version SET map = NULL WHERE map_version.version = [version]
+		# INSERT INTO map_version (version, created, operations, map) VALUES ([version + 1], ...)
+
+		db.session.query(MapVersion).filter_by(version=version).update({MapVersion.map: None})
+		db.session.add(MapVersion(version=version + 1, created=datetime.now(), operations=operations, map=map_repr))
+		try:
+			db.session.commit()
+		except IntegrityError:
+			db.session.rollback()
+			raise MapConflict("The map was changed by someone else at the same time, version {} is taken."
+							  .format(version + 1))
+		with self._lock:
+			if self._entry is None or self._entry.version < version + 1:
+				self._entry = entry
+		return version + 1
+
+	def _latest(self):
+		"""
+		Returns (version, map) of the latest version in the database, (0, the map in MAP_FILE) if there is none.
+		The map is not read again if it is the one in memory.
+		"""
+
+		# SELECT max(map_version.version) FROM map_version
+		# SELECT map_version.map FROM map_version WHERE map_version.version = [version]
+
+		version = db.session.query(func.max(MapVersion.version)).scalar() or 0
+		entry = self._entry
+		if entry is not None and entry.version == version:
+			return version, entry.map
+		if version:
+			return version, db.session.query(MapVersion.map).filter_by(version=version).scalar()
+		path = current_app.config["MAP_FILE"]
+		if not os.path.exists(path):
+			return 0, {}
+		with open(path, "rb") as file:
+			return 0, pickle.load(file)
+
+
+map_cache = MapCache()
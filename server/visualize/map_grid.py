@@ -0,0 +1,105 @@
+"""
+This module finds the shapes of the map inside a viewport, so a client showing one corridor does not download the
+whole campus.
+
+When a version of the map is read or saved, the rectangles of all rooms are put in a grid of square cells, each cell
+with the rectangles that overlap it. The size of the cells is chosen so there is about one rectangle per cell. A
+viewport only looks at the rectangles in the cells it overlaps, or at all of them if that is fewer. A rectangle that
+overlaps more cells than there are rectangles is not put in cells but looked at for every viewport. Shapes that are not
+rectangles with finite numbers up to MAX_COORDINATE for x, y, width and height are left out.
+"""
+import math
+
+# Max width and height of a viewport, in the units of the map
+MAX_SIZE = 10 ** 7
+# Max absolute value of the numbers of a rectangle, so the size of the whole map is a finite number
+MAX_COORDINATE = 10 ** 15
+
+
+def _rectangle(shape):
+	"""Returns (x1, y1, x2, y2) of the shape, or None if it is not a rectangle"""
+	try:
+		x, y, width, height = shape["x"], shape["y"], shape["width"], shape["height"]
+	except (KeyError, TypeError):
+		return None
+	for value in x, y, width, height:
+		if value.__class__ not in (int, float):  # bool is an int, but not a coordinate
+			return None
+		if not (math.isfinite(value) and abs(value) <= MAX_COORDINATE):  # NaN and Infinity are floats in JSON
+			return None
+	x2, y2 = x + width, y + height
+	return (x, y, x2, y2) if width >= 0 and height >= 0 else (min(x, x2), min(y, y2), max(x, x2), max(y, y2))
+
+
+class MapGrid:
+	"""The rectangles of a map in square cells of the same size"""
+
+	def __init__(self, map_repr):
+		self._shapes = []  # (text_id, shape, (x1, y1, x2, y2)) in the order of the map
+		for text_id, shapes in map_repr.items():
+			for shape in shapes if isinstance(shapes, list) else ():
+				rectangle = _rectangle(shape)
+				if rectangle is not None:
+					self._shapes.append((text_id, shape, rectangle))
+
+		self._cells = {}  # (column, row) -> indexes in _shapes
+		self._large = []  # indexes in _shapes of the rectangles that overlap too many cells
+		self._cell_size = 1
+		if not self._shapes:
+			return
+		width = max(r[2] for _, _, r in self._shapes) - min(r[0] for _, _, r in self._shapes)
+		height = max(r[3] for _, _, r in self._shapes) - min(r[1] for _, _, r in self._shapes)
+		self._cell_size = max(math.sqrt(width * height / len(self._shapes)), 1)
+		cells, size = self._cells, self._cell_size
+		for i, (_, _, (x1, y1, x2, y2)) in enumerate(self._shapes):
+			columns = range(math.floor(x1 / size), math.floor(x2 / size) + 1)
+			rows = range(math.floor(y1 / size), math.floor(y2 / size) + 1)
+			if len(columns) * len(rows) > len(self._shapes):
+				self._large.append(i)
+				continue
+			for column in columns:
+				for row in rows:
+					cell = cells.get((column, row))
+					if cell is None:
+						cells[column, row] = [i]
+					else:
+						cell.append(i)
+
+	def viewport(self, x, y, width, height):
+		"""Returns {text_id: [shapes]} with the shapes that overlap the viewport, touching the edge included"""
+		x1, y1, x2, y2 = x, y, x + width, y + height
+		if self._count_cells(x1, y1, x2, y2) >= len(self._shapes):
+			indexes = range(len(self._shapes))
+		else:
+			indexes = {i for cell in self._cells_of(x1, y1, x2, y2) for i in self._cells.get(cell, ())}
+			indexes = sorted(indexes.union(self._large))
+
+		found = {}
+		for i in indexes:
+			text_id, shape, (shape_x1, shape_y1, shape_x2, shape_y2) = self._shapes[i]
+			if shape_x1 <= x2 and x1 <= shape_x2 and shape_y1 <= y2 and y1 <= shape_y2:
+				found.setdefault(text_id, []).append(shape)
+		return found
+
+	def _count_cells(self, x1, y1, x2, y2):
+		columns = math.floor(x2 / self._cell_size) - math.floor(x1 / self._cell_size) + 1
+		rows = math.floor(y2 / self._cell_size) - math.floor(y1 / self._cell_size) + 1
+		return columns * rows
+
+	def _cells_of(self, x1, y1, x2, y2):
+		for column in range(math.floor(x1 / self._cell_size), math.floor(x2 / self._cell_size) + 1):
+			for row in range(math.floor(y1 / self._cell_size), math.floor(y2 / self._cell_size) + 1):
+				yield column, row
+
+
+def parse_args(args):
+	"""
+	Reads the viewport from the query string of a request, as x, y, width and height in the units of the map.
+	:return: (x, y, width, height), raises ValueError with a message if an argument is not valid
+	"""
+	values = [args.get(name, type=float) for name in ("x", "y", "width", "height")]
+	if any(value is None or not math.isfinite(value) for value in values):
+		raise ValueError("x, y, width and height must be numbers")
+	if not (0 <= values[2] <= MAX_SIZE and 0 <= values[3] <= MAX_SIZE):
+		raise ValueError("width and height must be between 0 and {}".format(MAX_SIZE))
+	return tuple(values)
@@ -0,0 +1,109 @@
+"""
+This module applies and creates JSON Patch (RFC 6902) operations on the representation of the map.
+
+The operations "add", "remove", "replace" and "test" are supported, with paths as JSON Pointers (RFC 6901), like
+{"op": "replace", "path": "/isy1/0/x", "value": 2686}. The map is {room text_id: [rectangles]}, so an edit of the
+map editor is a few operations on one room instead of the whole building.
+"""
+import copy
+
+OPERATIONS = ["add", "remove", "replace", "test"]
+
+
+def pointer(*keys):
+	"""Returns the JSON Pointer of the keys, like pointer("isy1", 0) == "/isy1/0" """
+	return "".join("/" + str(key).replace("~", "~0").replace("/", "~1") for key in keys)
+
+
+def _keys(path):
+	if path == "":
+		return []
+	if not path.startswith("/"):
+		raise ValueError("{} is not a valid path.".format(path))
+	return [key.replace("~1", "/").replace("~0", "~") for key in path[1:].split("/")]
+
+
+def _index(container, key, adding):
+	"""Returns the list index of the key, "-" is the end of the list when adding"""
+	if adding and key == "-":
+		return len(container)
+	if not key.isdigit() or (len(key) > 1 and key[0] == "0"):
+		raise ValueError("{} is not a valid list index.".format(key))
+	index = int(key)
+	if index > len(container) or (index == len(container) and not adding):
+		raise ValueError("List index {} is out of range.".format(index))
+	return index
+
+
+def _parent(document, path):
+	"""Returns the container of the path and the last key of it"""
+	keys = _keys(path)
+	if not keys:
+		raise ValueError("The whole map can not be changed by a patch.")
+	container = document
+	for key in keys[:-1]:
+		if isinstance(container, list):
+			container = container[_index(container, key, False)]
+		elif isinstance(container, dict) and key in container:
+			container = container[key]
+		else:
+			raise ValueError("{} does not exist.".format(path))
+	if not isinstance(container, (list, dict)):
+		raise ValueError("{} does not exist.".format(path))
+	return container, keys[-1]
+
+
+def _apply(document, operation):
+	op, path = operation["op"], operation["path"]
+	container, key = _parent(document, path)
+	is_list = isinstance(container, list)
+	if op == "add":
+		if is_list:
+			container.insert(_index(container, key, True), copy.deepcopy(operation["value"]))
+		else:
+			container[key] = copy.deepcopy(operation["value"])
+		return
+
+	if is_list:
+		key = _index(container, key, False)
+	elif key not in container:
+		raise ValueError("{} does not exist.".format(path))
+	if op == "remove":
+		del container[key]
+	elif op == "replace":
+		container[key] = copy.deepcopy(operation["value"])
+	elif op == "test":
+		if container[key] != operation["value"]:
+			raise ValueError("{} is not {}.".format(path, operation["value"]))
+	else:
+		raise ValueError("{} is not a valid operation.".format(op))
+
+
+def apply(document, operations):
+	"""
+	Returns a copy of the document with the operations applied in order, the document itself is not changed.
+	Only the rooms the operations change are copied, the others are shared with the document.
+	Raises ValueError with a message if an operation can not be applied, then no operation is applied.
+	"""
+	document = dict(document)
+	copied = set()
+	for operation in operations:
+		if operation["op"] in ("add", "replace", "test") and "value" not in operation:
+			raise ValueError("The {} operation of {} has no value.".format(operation["op"], operation["path"]))
+		keys = _keys(operation["path"])
+		if len(keys) > 1 and keys[0] in document and keys[0] not in copied:
+			document[keys[0]] = copy.deepcopy(document[keys[0]])
+			copied.add(keys[0])
+		_apply(document, operation)
+	return document
+
+
+def diff(old, new):
+	"""Returns the operations that change the old map into the new one, room by room"""
+	operations = [{"op": "remove", "path": pointer(text_id)} for text_id in old if text_id not in new]
+	for text_id, shapes in new.items():
+		if text_id not in old:
+			operations.append({"op": "add", "path": pointer(text_id), "value": shapes})
+		elif old[text_id] != shapes:
+			operations.append({"op": "replace", "path": pointer(text_id), "value": shapes})
+	return operations
@@ -0,0 +1,157 @@
+"""
+This module keeps the effective_access table up to date.
+
+The effective access of a reader is the union of the card readers it has been given access to directly (has_access_to)
+and the card readers of the access groups it belongs to (belongs_to and gives_access_to), together with the room
+each card reader leads into. The code that changes access calls the functions below in the same transaction,
+before it commits, so only the rows of the affected reader or access group are recomputed.
+The affected readers are also marked as changed in the door access index and for the reachable rooms, and the card
+readers they may open are compared before and after so the door controllers get the changes (see door_sync.py).
+"""
+from collections import Counter
+
+from sqlalchemy import select, literal, null
+
+from visualize import door_access, door_sync, reachability
+from visualize.models import db, EffectiveAccess, HasAccessTo, BelongsTo, CardReader, gives_access_to
+
+COLUMNS = ["reader_id", "room_id", "card_reader_id", "source", "ag_id", "expires"]
+
+effective_access = EffectiveAccess.__table__
+has_access_to = HasAccessTo.__table__
+belongs_to = BelongsTo.__table__
+card_reader = CardReader.__table__
+
+
+def _direct_access(reader_ids=None):
+	"""Returns a select of the access given directly to card readers, for some readers or for all"""
+
+	# SELECT has_access_to.reader_id, card_reader.room_b_id, card_reader.id, 'room', NULL,
+	#   has_access_to.expiration_datetime
+	# FROM has_access_to JOIN card_reader ON card_reader.id = has_access_to.card_reader_id
+	# WHERE card_reader.room_b_id IS NOT NULL AND has_access_to.reader_id IN [reader_ids]
+
+	query = select([has_access_to.c.reader_id, card_reader.c.room_b_id, card_reader.c.id,
+					literal("room"), null(), has_access_to.c.expiration_datetime]) \
+		.select_from(has_access_to.join(card_reader, card_reader.c.id == has_access_to.c.card_reader_id)) \
+		.where(card_reader.c.room_b_id != None)  # "is not None" does not work with SQLAlchemy
+	if reader_ids is not None:
+		query = query.where(has_access_to.c.reader_id.in_(reader_ids))
+	return query
+
+
+def _ag_access(reader_ids=None, ag_id=None):
+	"""Returns a select of the access given through access groups, for some readers, one access group or for all"""
+
+	# SELECT belongs_to.reader_id, card_reader.room_b_id, card_reader.id, 'ag', belongs_to.ag_id,
+	#   belongs_to.expiration_datetime
+	# FROM belongs_to
+	# JOIN gives_access_to ON gives_access_to.ag_id = belongs_to.ag_id
+	# JOIN card_reader ON card_reader.id = gives_access_to.cr_id
+	# WHERE card_reader.room_b_id IS NOT NULL AND belongs_to.reader_id IN [reader_ids] AND belongs_to.ag_id = [ag_id]
+
+	query = select([belongs_to.c.reader_id, card_reader.c.room_b_id, card_reader.c.id,
+					literal("ag"), belongs_to.c.ag_id, belongs_to.c.expiration_datetime]) \
+		.select_from(belongs_to
+					 .join(gives_access_to, gives_access_to.c.ag_id == belongs_to.c.ag_id)
+					 .join(card_reader, card_reader.c.id == gives_access_to.c.cr_id)) \
+		.where(card_reader.c.room_b_id != None)
+	if reader_ids is not None:
+		query = query.where(belongs_to.c.reader_id.in_(reader_ids))
+	if ag_id is not None:
+		query = query.where(belongs_to.c.ag_id == ag_id)
+	return query
+
+
+def _insert(query):
+	"""Inserts the rows of the select into effective_access"""
+	db.session.execute(effective_access.insert().from_select(COLUMNS, query))
+
+
+def refresh_reader(reader_id):
+	"""Recomputes the effective access of one reader, after its direct access or access groups changed"""
+	refresh_readers([reader_id])
+
+
+def refresh_readers(reader_ids):
+	"""Recomputes the effective access of many readers with the same number of queries as for one"""
+	reader_ids = list(reader_ids)
+	db.session.flush()
+	before = door_sync.snapshot(reader_ids)
+	db.session.execute(effective_access.delete().where(effective_access.c.reader_id.in_(reader_ids)))
+	_insert(_direct_access(reader_ids))
+	_insert(_ag_access(reader_ids=reader_ids))
+	door_sync.record_changes(reader_ids, before)
+	door_access.readers_changed(reader_ids)
+	reachability.readers_changed(reader_ids)
+
+
+def refresh_ag(ag_id):
+	"""Recomputes the effective access given by one access group, after its card readers changed"""
+	db.session.flush()
+	members = [reader_id for (reader_id,) in
+			   db.session.execute(select([belongs_to.c.reader_id]).where(belongs_to.c.ag_id == ag_id))]
+	before = door_sync.snapshot(members)
+	db.session.execute(effective_access.delete().where(effective_access.c.ag_id == ag_id))
+	_insert(_ag_access(ag_id=ag_id))
+	door_sync.record_changes(members, before)
+	door_access.readers_changed(members)
+	reachability.readers_changed(members)
+
+
+def remove_reader(reader_id):
+	"""Removes all effective access of a reader that is being deleted"""
+	before = door_sync.snapshot([reader_id])
+	db.session.execute(effective_access.delete().where(effective_access.c.reader_id == reader_id))
+	door_sync.record_changes([reader_id], before)
+	door_access.readers_changed([reader_id])
+	reachability.readers_changed([reader_id])
+
+
+def rebuild():
+	"""Recomputes the whole table, used when access has been added without the functions above"""
+	db.session.flush()
+	db.session.execute(effective_access.delete())
+	_insert(_direct_access())
+	_insert(_ag_access())
+	door_sync.reset()
+	door_access.all_changed()
+	reachability.all_changed()
+
+
+def rebuild_if_empty():
+	"""
+	Rebuilds the table and commits if it is empty while access has been given, as when db.create_all has just made it
+	for a database from before it existed. Called when the server starts, returns if the table was rebuilt.
+	"""
+	def has_rows(column):
+		return db.session.execute(select([column]).limit(1)).first() is not None
+
+	def empty():
+		return not has_rows(effective_access.c.id) and (has_rows(has_access_to.c.reader_id) or
+														 has_rows(belongs_to.c.reader_id))
+
+	if not empty():
+		return False
+	if db.engine.url.get_backend_name() == "postgresql":
+		# Workers starting at the same time rebuild it once, the others find it filled after the lock
+		db.session.execute("LOCK TABLE effective_access IN SHARE ROW EXCLUSIVE MODE")
+		if not empty():
+			db.session.commit()
+			return False
+	rebuild()
+	db.session.commit()
+	return True
+
+
+def check():
+	"""
+	Compares the table with the effective access computed from scratch.
+	:return: (missing, extra) lists of rows as tuples in the order of COLUMNS,
+	missing rows should be in the table but are not and extra rows are in the table but should not be.
+	"""
+	expected = Counter(tuple(row) for row in db.session.execute(_direct_access()))
+	expected.update(tuple(row) for row in db.session.execute(_ag_access()))
+	actual = Counter(tuple(row) for row in db.session.execute(
+		select([effective_access.c[column] for column in COLUMNS])))
+	return list((expected - actual).elements()), list((actual - expected).elements())
@@ -4,6 +4,7 @@ from flask_sqlalchemy import SQLAlchemy
 db = SQLAlchemy()
 bcrypt = Bcrypt()
 
+from visualize.models.access_change import AccessChange
 from visualize.models.ag_request import AccessGroupRequest
 from visualize.models.ag import AccessGroup, gives_access_to
 from visualize.models.admin import Admin
@@ -11,8 +12,12 @@ from visualize.models.approver import Approver
 from visualize.models.approves_ag_request import ApprovesAgRequest
 from visualize.models.approves_room_request import ApprovesRoomRequest
 from visualize.models.belongs_to import BelongsTo
+from visualize.models.building_change import BuildingChange
 from visualize.models.card_reader import CardReader
+from visualize.models.effective_access import EffectiveAccess
 from visualize.models.has_access_to import HasAccessTo
+from visualize.models.map_version import MapVersion
+from visualize.models.occupancy_checkpoint import OccupancyCheckpoint
 from visualize.models.reader import Reader
 from visualize.models.responsible_for_ag import ResponsibleForAg
 from visualize.models.responsible_for_room import ResponsibleForRoom
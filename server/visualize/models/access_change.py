@@ -0,0 +1,23 @@
+"""
+Class for table access_change
+"""
+from . import db
+
+
+class AccessChange(db.Model):
+	"""
+	This class represents a change of which cards may open a card reader, used by the door controllers to keep their
+	allow-lists up to date. The version increases with every change and is never reused.
+	"""
+	__table_args__ = {'sqlite_autoincrement': True}
+
+	version = db.Column(db.Integer, primary_key=True)
+	# "grant" when a card may open a card reader (or its expiry changed), "revoke" when it may not any more,
+	# "block" when a card has been blocked at all card readers and "reset" when all allow-lists must be downloaded again
+	kind = db.Column(db.String(6), nullable=False)
+	card_id = db.Column(db.String(), nullable=True)
+	# The reader whose access changed, so the caches of other workers can read it again (none for "reset")
+	reader_id = db.Column(db.Integer, nullable=True)
+	card_reader_id = db.Column(db.Integer, nullable=True)
+	expires = db.Column(db.DateTime, nullable=True)
+	changed = db.Column(db.DateTime, nullable=False, index=True)
@@ -6,7 +6,9 @@ from . import db
 # many to many relationship table between access goups and card readers
 gives_access_to = db.Table('gives_access_to',
 						   db.Column('ag_id', db.Integer, db.ForeignKey('access_group.id'), primary_key=True),
-						   db.Column('cr_id', db.Integer, db.ForeignKey('card_reader.id'), primary_key=True))
+						   db.Column('cr_id', db.Integer, db.ForeignKey('card_reader.id'), primary_key=True),
+						   # The access groups of a card reader are looked up by cr_id
+						   db.Index("ix_gives_access_to_cr", "cr_id"))
 
 
 class AccessGroup(db.Model):
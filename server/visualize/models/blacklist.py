@@ -1,28 +1,244 @@
 """
 Class for table Blacklist.
 """
+import threading
+import time
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import event, func, inspect, text
+from sqlalchemy.orm import Session
+
+from visualize.id_watermark import IdWatermark, gap_timeout
 from . import db
 
 
 class Blacklist(db.Model):
     __tablename__ = 'blacklist'
+    # Ids are never reused, the revocation cache relies on them to find new rows.
+    __table_args__ = {'sqlite_autoincrement': True}
     id = db.Column(db.Integer, primary_key=True)
-    jti = db.Column(db.String(36), nullable=False)
+    jti = db.Column(db.String(36), nullable=False, unique=True)
+    # When the token expires, after that the row is no longer needed.
+    expires = db.Column(db.DateTime, nullable=False, index=True)
 
-    def __init__(self, jti):
+    def __init__(self, jti, expires):
         self.jti = jti
+        self.expires = expires
+
+
+class BlacklistedReader(db.Model):
+    """
+    Revokes all tokens of a reader issued before its token epoch was increased,
+    e.g. when the role of the reader changes.
+    """
+    __tablename__ = 'blacklisted_reader'
+    __table_args__ = {'sqlite_autoincrement': True}
+    id = db.Column(db.Integer, primary_key=True)
+    # No foreign key, the row must outlive a deleted reader.
+    reader_id = db.Column(db.Integer, nullable=False, index=True)
+    # Tokens with a lower epoch than this are revoked.
+    token_epoch = db.Column(db.Integer, nullable=False)
+    # When the last token issued with the old epoch expires.
+    expires = db.Column(db.DateTime, nullable=False, index=True)
+
+    def __init__(self, reader_id, token_epoch, expires):
+        self.reader_id = reader_id
+        self.token_epoch = token_epoch
+        self.expires = expires
+
+
+class RevocationCache(object):
+    """
+    In-memory copy of the blacklisted jtis so that the token check does not need a query per request.
+
+    Revocations made by this process are added directly. Revocations made by other workers are picked up
+    by syncing the rows with a higher id than the last seen one, at most every sync_interval seconds.
+    Ids that were skipped because their transaction had not committed yet are read again, see id_watermark.py.
+    """
 
+    def __init__(self):
+        self._jtis = {}
+        self._readers = {}
+        self._jti_rows = IdWatermark()
+        self._reader_rows = IdWatermark()
+        self._last_sync = 0.0
+        self._lock = threading.Lock()
 
-def add_jti_to_blacklist(jti):
-    blacklisted_jti = Blacklist(jti)
+    def load(self):
+        """Replaces the content of the cache with all the rows in the blacklist tables."""
+        with self._lock:
+            self._jtis = {}
+            self._readers = {}
+            self._jti_rows = IdWatermark()
+            self._reader_rows = IdWatermark()
+            self._sync()
+
+    def add(self, jti, expires):
+        """Adds a jti revoked by this process."""
+        with self._lock:
+            self._jtis[jti] = expires
+
+    def add_reader(self, reader_id, token_epoch, expires):
+        """Adds a reader whose tokens were revoked by this process."""
+        with self._lock:
+            self._readers[reader_id] = (max(token_epoch, self.reader_epoch(reader_id)), expires)
+
+    def reader_epoch(self, reader_id):
+        """Returns the lowest token epoch that is still valid for the reader."""
+        return self._readers.get(reader_id, (0, None))[0]
+
+    def contains(self, jti, sync_interval):
+        """
+        Returns wether the given jti is revoked.
+        :param jti: JWT identifier
+        :param sync_interval: max number of seconds since the last sync with the database
+        :return: bool
+        """
+        self.sync_if_older(sync_interval)
+        return jti in self._jtis
+
+    def sync_if_older(self, sync_interval):
+        """Syncs with the database if the last sync was more than sync_interval seconds ago."""
+        if time.monotonic() - self._last_sync >= sync_interval:
+            with self._lock:
+                if time.monotonic() - self._last_sync >= sync_interval:
+                    self._sync()
+
+    def _sync(self):
+        """
+        Fetches the rows added since the last sync and forgets the jtis of expired tokens.
+        Uses the primary key so the lookup stays cheap.
+        """
+        timeout = gap_timeout()
+        rows = db.session.query(Blacklist.id, Blacklist.jti, Blacklist.expires) \
+            .filter(self._jti_rows.condition(Blacklist.id)).all()
+        for row in rows:
+            self._jtis[row.jti] = row.expires
+        self._jti_rows.seen([row.id for row in rows], timeout)
+        rows = db.session.query(BlacklistedReader).filter(self._reader_rows.condition(BlacklistedReader.id)).all()
+        for row in rows:
+            if row.token_epoch >= self.reader_epoch(row.reader_id):
+                self._readers[row.reader_id] = (row.token_epoch, row.expires)
+        self._reader_rows.seen([row.id for row in rows], timeout)
+        now = datetime.now()
+        self._jtis = {jti: expires for jti, expires in self._jtis.items() if expires > now}
+        self._readers = {reader_id: value for reader_id, value in self._readers.items() if value[1] > now}
+        self._last_sync = time.monotonic()
+
+
+revocation_cache = RevocationCache()
+
+# Session.info key with the readers whose tokens are revoked by the current transaction
+_REVOKED_READERS = "revoked_readers"
+
+
+def add_jti_to_blacklist(jti, expires):
+    """
+    Blacklists the token with the given jti until it expires.
+    :param jti: JWT identifier
+    :param expires: datetime when the token expires
+    """
+    blacklisted_jti = Blacklist(jti, expires)
     db.session.add(blacklisted_jti)
     db.session.commit()
+    revocation_cache.add(jti, expires)
 
 
-def is_jti_in_blacklist(jti):
+def upgrade_table():
+    """
+    Adds the expiry of the tokens to a blacklist table made before it was stored, db.create_all does not change tables
+    that exist. The old rows are kept until the longest lived token issued now expires, and duplicate jtis are removed
+    so that they can be unique.
+    """
+    if "expires" in {column["name"] for column in inspect(db.engine).get_columns(Blacklist.__tablename__)}:
+        return
+    config = current_app.config
+    expires = datetime.now() + max(config["JWT_ACCESS_TOKEN_EXPIRES"], config["JWT_REFRESH_TOKEN_EXPIRES"])
+    with db.engine.begin() as connection:
+        connection.execute("ALTER TABLE blacklist ADD COLUMN expires TIMESTAMP")
+        connection.execute(text("UPDATE blacklist SET expires = :expires"), expires=expires)
+        connection.execute("DELETE FROM blacklist WHERE id NOT IN (SELECT min(id) FROM blacklist GROUP BY jti)")
+        connection.execute("CREATE UNIQUE INDEX ix_blacklist_jti ON blacklist (jti)")
+        connection.execute("CREATE INDEX ix_blacklist_expires ON blacklist (expires)")
+
+
+def is_jti_in_blacklist(jti, sync_interval=None):
     """
     Returns wether the given jti is blacklisted.
     :param jti: JWT identifier
+    :param sync_interval: if given the revocation cache is used, syncing at most this often (seconds)
     :return: bool
     """
+    if sync_interval is not None:
+        return revocation_cache.contains(jti, sync_interval)
     return Blacklist.query.filter_by(jti=jti).first() != None
+
+
+def revoke_reader_tokens(reader):
+    """
+    Revokes all tokens issued to the reader so far by increasing its token epoch.
+    The change is added to the session, the caller is responsible for the commit.
+    :param reader: the Reader whose tokens are revoked
+    """
+    config = current_app.config
+    reader.token_epoch = (reader.token_epoch or 0) + 1
+    expires = datetime.now() + max(config["JWT_ACCESS_TOKEN_EXPIRES"], config["JWT_REFRESH_TOKEN_EXPIRES"])
+    db.session.add(BlacklistedReader(reader.id, reader.token_epoch, expires))
+    # The cache is only updated if the revocation is committed
+    db.session.info.setdefault(_REVOKED_READERS, []).append((reader.id, reader.token_epoch, expires))
+
+
+@event.listens_for(Session, "after_commit")
+def _after_commit(session):
+    for reader_id, token_epoch, expires in session.info.pop(_REVOKED_READERS, []):
+        revocation_cache.add_reader(reader_id, token_epoch, expires)
+
+
+@event.listens_for(Session, "after_rollback")
+def _after_rollback(session):
+    session.info.pop(_REVOKED_READERS, None)
+
+
+def is_reader_epoch_revoked(reader_id, token_epoch, sync_interval=None):
+    """
+    Returns wether tokens with the given epoch have been revoked for the reader.
+    :param reader_id: id of the reader the token was issued to
+    :param token_epoch: the epoch stored in the token
+    :param sync_interval: if given the revocation cache is used, syncing at most this often (seconds)
+    :return: bool
+    """
+    if sync_interval is not None:
+        revocation_cache.sync_if_older(sync_interval)
+        return token_epoch < revocation_cache.reader_epoch(reader_id)
+    epoch = db.session.query(func.max(BlacklistedReader.token_epoch)).filter_by(reader_id=reader_id).scalar()
+    return epoch is not None and token_epoch < epoch
+
+
+def purge_expired(batch_size=1000, pause=0.0):
+    """
+    Deletes the rows of tokens that have expired. The rows are deleted in batches of batch_size,
+    each in its own transaction, so the tables are never locked for long.
+    :param batch_size: max number of rows deleted per transaction
+    :param pause: seconds to sleep between batches
+    :return: number of deleted rows
+    """
+    now = datetime.now()
+    return _purge_table(Blacklist, now, batch_size, pause) + _purge_table(BlacklistedReader, now, batch_size, pause)
+
+
+def _purge_table(model, now, batch_size, pause):
+    """Deletes the rows in the table of the model that expired before now, in batches"""
+    deleted = 0
+    while True:
+        ids = [row.id for row in db.session.query(model.id)
+               .filter(model.expires <= now).limit(batch_size).all()]
+        if not ids:
+            break
+        model.query.filter(model.id.in_(ids)).delete(synchronize_session=False)
+        db.session.commit()
+        deleted += len(ids)
+        if len(ids) < batch_size:
+            break
+        time.sleep(pause)
+    return deleted
@@ -0,0 +1,15 @@
+"""
+Class for table building_change
+"""
+from . import db
+
+
+class BuildingChange(db.Model):
+	"""
+	This class represents a committed change of the rooms or card readers, so the building graphs kept by other workers
+	are read again. A row is added by every transaction that changes them and never changed or deleted.
+	"""
+	__table_args__ = {'sqlite_autoincrement': True}
+
+	version = db.Column(db.Integer, primary_key=True)
+	changed = db.Column(db.DateTime, nullable=False)
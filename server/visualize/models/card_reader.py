@@ -7,6 +7,10 @@ from . import db
 class CardReader(db.Model):
 	"""This class represents a card reader forming a connection from room A to room B."""
 
+	# The doors of a room are looked up by room A or room B, and the opposite door by both
+	__table_args__ = (db.Index("ix_card_reader_rooms", "room_a_id", "room_b_id"),
+					  db.Index("ix_card_reader_room_b", "room_b_id"))
+
 	id = db.Column(db.Integer, primary_key=True)
 	room_a_id = db.Column(db.Integer, db.ForeignKey('room.id'))
 	room_b_id = db.Column(db.Integer, db.ForeignKey('room.id'))
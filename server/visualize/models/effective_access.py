@@ -0,0 +1,24 @@
+"""
+Class for table effective_access
+"""
+from . import db
+
+
+class EffectiveAccess(db.Model):
+	"""
+	This class represents the access a reader has through a card reader into a room, either given directly (has_access_to)
+	or through an access group (belongs_to and gives_access_to). The table is kept up to date by the code that changes
+	access, see visualize/materialized_access.py, so reading the access of a reader or a room is a single indexed query.
+	"""
+
+	# The access of a reader is read by reader_id, and a single card reader by (reader_id, card_reader_id)
+	__table_args__ = (db.Index("ix_effective_access_reader_card_reader", "reader_id", "card_reader_id"),)
+
+	id = db.Column(db.Integer, primary_key=True)
+	reader_id = db.Column(db.Integer, db.ForeignKey('reader.id'), nullable=False)
+	room_id = db.Column(db.Integer, db.ForeignKey('room.id'), nullable=False, index=True)
+	card_reader_id = db.Column(db.Integer, db.ForeignKey('card_reader.id'), nullable=False, index=True)
+	# "room" for access given directly to the card reader, "ag" for access through an access group
+	source = db.Column(db.String(4), nullable=False)
+	ag_id = db.Column(db.Integer, db.ForeignKey('access_group.id'), nullable=True, index=True)
+	expires = db.Column(db.DateTime, nullable=False)
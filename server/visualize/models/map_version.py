@@ -0,0 +1,18 @@
+"""
+Class for table map_version
+"""
+from . import db
+
+
+class MapVersion(db.Model):
+	"""
+	This class represents a version of the map drawn by the frontend. A new version is only ever added, never changed,
+	except that the whole map is only kept for the latest version. See map_cache.py.
+	"""
+
+	version = db.Column(db.Integer, primary_key=True, autoincrement=False)
+	created = db.Column(db.DateTime, nullable=False)
+	# JSON Patch operations that change the map of the previous version into this one
+	operations = db.Column(db.JSON, nullable=False)
+	# {room text_id: [rectangles]}, None for all versions but the latest
+	map = db.Column(db.JSON(none_as_null=True), nullable=True)
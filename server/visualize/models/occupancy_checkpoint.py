@@ -0,0 +1,18 @@
+"""
+Class for table occupancy_checkpoint
+"""
+from . import db
+
+
+class OccupancyCheckpoint(db.Model):
+	"""
+	This class represents a saved state of the room occupancy, so it can be restored after a restart by reading only
+	the swipes logged after it. See occupancy.py.
+	"""
+
+	id = db.Column(db.Integer, primary_key=True)
+	created = db.Column(db.DateTime, nullable=False)
+	# {"YYYYMMDD": id of the last swipe of the day included} for the days still read from the swipe log
+	positions = db.Column(db.JSON, nullable=False)
+	# {card_id: room id} for everyone inside
+	locations = db.Column(db.JSON, nullable=False)
@@ -1,18 +1,26 @@
 """
 Class for table reader
 """
-from . import db, bcrypt
+from sqlalchemy import MetaData, inspect
+from sqlalchemy.schema import CreateTable
+
+from . import db
+from visualize import password_hashing
 import uuid
 
 
 class Reader(db.Model):
 	"""This class represents a user with the role reader."""
+	# Ids are never reused, revoked tokens of a deleted reader are kept by its id (see models/blacklist.py)
+	__table_args__ = {'sqlite_autoincrement': True}
 	id = db.Column(db.Integer, primary_key=True)
 	email = db.Column(db.String(), unique=True, nullable=False)
 	password = db.Column(db.String(), nullable=False)
 	name = db.Column(db.String(), nullable=False)
 	surname = db.Column(db.String(), nullable=False)
-	card_id = db.Column(db.String(), nullable=True)
+	card_id = db.Column(db.String(), nullable=True, index=True)
+	# Increased when the tokens of the reader should be revoked, e.g. when its role changes
+	token_epoch = db.Column(db.Integer, nullable=False, default=0)
 	card_readers = db.relationship("HasAccessTo", backref="reader", lazy=True, cascade="all, delete, delete-orphan")
 	access_groups = db.relationship("BelongsTo", backref="reader", lazy=True, cascade="all, delete, delete-orphan")
 	room_requests = db.relationship("RoomRequest", backref="reader", lazy=True, cascade="all, delete, delete-orphan")
@@ -25,7 +33,7 @@ class Reader(db.Model):
 		self.name = name
 		self.surname = surname
 		self.card_id = uuid.uuid4().hex
-		self.password = bcrypt.generate_password_hash(password).decode("utf-8")
+		self.password = password_hashing.generate_password_hash(password)
 
 	@property
 	def serialize(self):
@@ -46,8 +54,37 @@ class Reader(db.Model):
 
 	def set_password(self, password):
 		"""Hashes and sets the hashed password to the user in the database"""
-		self.password = bcrypt.generate_password_hash(password).decode("utf-8")
+		self.password = password_hashing.generate_password_hash(password)
 
 	def check_password(self, password):
 		"""Checks if the hash of the given password matches with the saved one"""
-		return bcrypt.check_password_hash(self.password, password)
+		return password_hashing.check_password_hash(self.password, password)
+
+	def password_needs_rehash(self):
+		"""Checks if the password was hashed with another work factor than the configured one"""
+		return password_hashing.needs_rehash(self.password)
+
+
+def upgrade_table():
+	"""
+	Adds the token epoch to a reader table made before it was stored, db.create_all does not change tables that exist.
+	On SQLite the table is made again with AUTOINCREMENT, so that a new reader does not get the id of a deleted one and
+	with it the revoked tokens of that reader (see models/blacklist.py). Ids deleted above the highest one left before
+	the upgrade can still be given out once.
+	"""
+	if "token_epoch" in {column["name"] for column in inspect(db.engine).get_columns(Reader.__tablename__)}:
+		return
+	table = Reader.__table__
+	with db.engine.begin() as connection:
+		connection.execute("ALTER TABLE reader ADD COLUMN token_epoch INTEGER NOT NULL DEFAULT 0")
+		if db.engine.url.get_backend_name() == "sqlite":
+			# The way SQLite changes a table: a new one, the rows copied and the new one renamed to the old name
+			columns = ", ".join(column.name for column in table.columns)
+			connection.execute(CreateTable(table.tometadata(MetaData(), name="reader_upgraded")))
+			connection.execute("INSERT INTO reader_upgraded ({0}) SELECT {0} FROM reader".format(columns))
+			connection.execute("DROP TABLE reader")
+			connection.execute("ALTER TABLE reader_upgraded RENAME TO reader")
+		indexes = {index["name"] for index in inspect(connection).get_indexes(Reader.__tablename__)}
+		for index in table.indexes:
+			if index.name not in indexes:
+				index.create(connection)
@@ -9,10 +9,15 @@ from .request_status import RequestStatus
 class RoomRequest(db.Model):
 	"""This class represents the current requests for rooms readers have asked for."""
 
+	# The order feed is read in (datetime_requested, id) order, for all requests or for one reader or room
+	__table_args__ = (db.Index("ix_room_request_requested", "datetime_requested", "id"),
+					  db.Index("ix_room_request_reader_requested", "reader_id", "datetime_requested", "id"),
+					  db.Index("ix_room_request_room_requested", "room_id", "datetime_requested", "id"))
+
 	id = db.Column(db.Integer, primary_key=True)
 	reader_id = db.Column(db.Integer, db.ForeignKey('reader.id'))
 	room_id = db.Column(db.Integer, db.ForeignKey('room.id'))
-	datetime_requested = db.Column(db.DateTime, nullable=False, default=datetime.now())
+	datetime_requested = db.Column(db.DateTime, nullable=False, default=datetime.now)
 	justification = db.Column(db.String, nullable=False)
 	status = db.Column(db.Enum(RequestStatus), nullable=False, default=RequestStatus.PENDING)
 
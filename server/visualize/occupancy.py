@@ -0,0 +1,238 @@
+"""
+This module contains the occupancy of the rooms, how many people are in every room and in which room everyone is.
+
+A card reader leads from room A to room B, so a swipe that opened the door means that the card moved into room B.
+Card readers without a room B lead out of the building. The occupancy is kept in memory and is updated from the swipe
+log (see swipe_log.py) at most every OCCUPANCY_SYNC_INTERVAL seconds, by reading the swipes written after the last
+one it has read and the ones before it that were not committed yet (see id_watermark.py). Every
+OCCUPANCY_CHECKPOINT_INTERVAL seconds the state is saved in the occupancy_checkpoint table, and after a restart it is
+restored from the latest checkpoint and the swipes logged after it.
+Only the logs of yesterday and today are read again, swipes written to older days are not counted.
+
+Without a checkpoint the whole log has to be read, which is done by `flask replay-occupancy` or by a thread started by
+the first request, which gets OccupancyNotReady until the thread is done.
+"""
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import select
+
+from visualize import swipe_log
+from visualize.id_watermark import IdWatermark, gap_timeout
+from visualize.models import db, CardReader, Room, Reader, OccupancyCheckpoint
+
+# Max number of card ids in one IN clause when the readers of the cards are looked up
+CHUNK_SIZE = 500
+
+
+def _day_key(day):
+	return day.strftime("%Y%m%d")
+
+
+class OccupancyNotReady(Exception):
+	"""Raised while the occupancy is built from the whole swipe log, since there is no checkpoint to start from"""
+
+
+class Occupancy:
+	"""card_id -> room id and room id -> number of people, updated from the swipe log"""
+
+	def __init__(self):
+		self._locations = {}  # card_id -> room id
+		self._counts = {}  # room id -> number of people
+		self._positions = {}  # day -> IdWatermark of the swipes read from the log of the day
+		self._doors = {}  # card reader id -> room id it leads into, None for outside
+		self._rooms = {}  # room id -> text_id
+		self._loaded = False
+		self._read = 0.0  # when the log was read last
+		self._saved = 0.0  # when the last checkpoint was saved
+		self._builder = None  # the thread reading the whole log when there was no checkpoint
+		self._lock = threading.Lock()
+
+	def counts(self):
+		"""Returns {room text_id: number of people} for the rooms with people in them"""
+		self.refresh()
+		with self._lock:
+			return {self._rooms[room_id]: count for room_id, count in self._counts.items()}
+
+	def inside(self):
+		"""Returns {card_id: room text_id} for everyone inside"""
+		self.refresh()
+		with self._lock:
+			return {card_id: self._rooms[room_id] for card_id, room_id in self._locations.items()}
+
+	def refresh(self):
+		"""
+		Reads the new swipes if the log was read more than OCCUPANCY_SYNC_INTERVAL seconds ago.
+		Raises OccupancyNotReady while the occupancy is built without a checkpoint.
+		"""
+		config = current_app.config
+		if self._loaded and time.monotonic() - self._read < config["OCCUPANCY_SYNC_INTERVAL"]:
+			return
+		with self._lock:
+			if not self._loaded:
+				checkpoint = OccupancyCheckpoint.query.order_by(OccupancyCheckpoint.id.desc()).first()
+				if checkpoint is None:
+					self._build()
+					raise OccupancyNotReady("The occupancy is being built from the swipe log, try again later")
+				self._restore(checkpoint)
+				self._saved = time.monotonic()
+				self._loaded = True
+			self._read_log()
+			self._read = time.monotonic()
+			if self._read - self._saved >= config["OCCUPANCY_CHECKPOINT_INTERVAL"]:
+				self._save()
+				self._saved = self._read
+
+	def replay(self, from_scratch=False):
+		"""
+		Builds the occupancy again from the latest checkpoint and the swipes logged after it, or from the whole log.
+		:return: the number of swipes read
+		"""
+		with self._lock:
+			checkpoint = None if from_scratch else \
+				OccupancyCheckpoint.query.order_by(OccupancyCheckpoint.id.desc()).first()
+			self._restore(checkpoint)
+			read = self._read_log()
+			self._save()
+			self._read = self._saved = time.monotonic()
+			self._loaded = True
+			return read
+
+	def wait(self, timeout=None):
+		"""Waits until the occupancy built without a checkpoint is ready"""
+		builder = self._builder
+		if builder is not None:
+			builder.join(timeout)
+
+	def _build(self):
+		"""Starts a thread that builds the occupancy from the whole log, if none is running, the lock must be held"""
+		if self._builder is not None and self._builder.is_alive():
+			return
+		app = current_app._get_current_object()
+
+		def build():
+			# The log is read into another Occupancy, so requests are not held up by the lock meanwhile
+			built = Occupancy()
+			try:
+				with app.app_context():
+					built.replay(from_scratch=True)
+			except Exception:
+				app.logger.exception("Building the occupancy from the swipe log failed")
+				return
+			with self._lock:
+				self._locations, self._counts, self._positions = built._locations, built._counts, built._positions
+				self._doors, self._rooms = built._doors, built._rooms
+				self._read = self._saved = time.monotonic()
+				self._loaded = True
+
+		self._builder = threading.Thread(target=build, name="occupancy-builder", daemon=True)
+		self._builder.start()
+
+	def reset(self):
+		"""Forgets the state, it is restored from the database the next time it is used"""
+		with self._lock:
+			self._locations, self._counts, self._positions = {}, {}, {}
+			self._loaded = False
+
+	def _move(self, card_id, room_id):
+		"""Moves the card into the room, None is outside"""
+		old = self._locations.pop(card_id, None)
+		if old is not None:
+			self._counts[old] -= 1
+			if not self._counts[old]:
+				del self._counts[old]
+		if room_id is not None:
+			self._locations[card_id] = room_id
+			self._counts[room_id] = self._counts.get(room_id, 0) + 1
+
+	def _restore(self, checkpoint):
+		"""Sets the state to the checkpoint, or to an empty building before the first swipe if it is None"""
+		self._locations, self._counts, self._positions, self._rooms = {}, {}, {}, {}
+		self._load_doors()
+		if checkpoint is None:
+			return
+		self._positions = {datetime.strptime(day, "%Y%m%d").date(): IdWatermark(position)
+						   for day, position in checkpoint.positions.items()}
+		for card_id, room_id in checkpoint.locations.items():
+			if room_id in self._rooms:  # rooms can have been removed since
+				self._move(card_id, room_id)
+
+	def _load_doors(self):
+		self._doors = dict(db.session.query(CardReader.id, CardReader.room_b_id))
+		self._rooms.update(db.session.query(Room.id, Room.text_id))
+
+	def _read_log(self):
+		"""Applies the swipes that opened a door and were written after the last one read, returns the number read"""
+		days = swipe_log.days()
+		if self._positions:
+			days = [day for day in days if day >= min(self._positions)]
+
+		read = 0
+		doors_loaded = False
+		timeout = gap_timeout()
+		for day in days:
+			table = swipe_log.day_table(day)
+			position = self._positions.setdefault(day, IdWatermark())
+
+			# SELECT id, card_id, card_reader_id, allowed FROM swipe_YYYYMMDD
+			# WHERE id > [position] OR id IN [gaps] ORDER BY id
+
+			rows = db.session.execute(
+				select([table.c.id, table.c.card_id, table.c.card_reader_id, table.c.allowed])
+				.where(position.condition(table.c.id)).order_by(table.c.id))
+			swipe_ids = []
+			for swipe_id, card_id, card_reader_id, allowed in rows:
+				if allowed:
+					if card_reader_id not in self._doors and not doors_loaded:
+						self._load_doors()  # a card reader added after the doors were read
+						doors_loaded = True
+					if card_reader_id in self._doors:
+						self._move(card_id, self._doors[card_reader_id])
+				swipe_ids.append(swipe_id)
+			position.seen(swipe_ids, timeout)
+			read += len(swipe_ids)
+
+		# Later swipes are only looked for in the logs of yesterday and today
+		since = date.today() - timedelta(days=1)
+		self._positions = {day: position for day, position in self._positions.items() if day >= since}
+		self._positions.setdefault(since, IdWatermark())
+		return read
+
+	def _save(self):
+		"""
+		Saves the state as the latest checkpoint and deletes the older ones, in a transaction of its own so that
+		nothing else in the session of the request is committed.
+		"""
+		table = OccupancyCheckpoint.__table__
+		with db.engine.begin() as connection:
+			checkpoint_id = connection.execute(table.insert().values(
+				created=datetime.now(),
+				# Swipes after the first one that may not be committed yet are read again after a restore, a card
+				# moved twice by the same swipes ends up in the same room
+				positions={_day_key(day): position.safe_id for day, position in self._positions.items()},
+				locations=dict(self._locations))).inserted_primary_key[0]
+			connection.execute(table.delete().where(table.c.id < checkpoint_id))
+
+
+occupancy = Occupancy()
+
+
+def evacuation_list():
+	"""Returns the card, room, email and name of everyone inside, sorted by room"""
+	inside = occupancy.inside()
+
+	# The card of a reader can have been removed since the swipe, then only the card id is known
+	card_ids = list(inside)
+	readers = {}
+	for i in range(0, len(card_ids), CHUNK_SIZE):
+		readers.update((reader.card_id, reader)
+					   for reader in Reader.query.filter(Reader.card_id.in_(card_ids[i:i + CHUNK_SIZE])))
+
+	people = []
+	for card_id, room in sorted(inside.items(), key=lambda item: (item[1], item[0])):
+		reader = readers.get(card_id)
+		people.append({"card_id": card_id, "room": room, "email": reader.email if reader else None,
+					   "name": reader.name if reader else None, "surname": reader.surname if reader else None})
+	return people
@@ -0,0 +1,267 @@
+"""
+This module contains the order feed, the room and access group requests waiting for an approver, as shown to
+approvers and admins.
+
+The orders are read with one query for room requests, one for access group requests and one for the rooms of the
+access groups in them, each joining the reader, the approver and the room or access group. The number of queries
+is the same however many orders there are.
+
+The whole feed lists the room requests and then the access group requests, each by when they were made and by id.
+It can be read a page at a time: every page ends with a cursor, the position of its last order, and the next page
+is read with a range query after that position (keyset pagination), so every page costs the same. The pages are
+ordered by when the requests were made, then room requests before access group requests and then by id, so that a
+cursor is a single position.
+"""
+import base64
+from datetime import datetime, timedelta
+
+from sqlalchemy import or_
+from sqlalchemy.orm import aliased
+
+from visualize.models import db, Reader, Room, CardReader, AccessGroup, RoomRequest, AccessGroupRequest, \
+	ApprovesRoomRequest, ApprovesAgRequest, gives_access_to
+
+# The approver is a reader, its name and email are in the reader table
+ApproverReader = aliased(Reader)
+
+# The types of orders, in the order orders made at the same time are listed
+TYPES = ["Room", "AG"]
+# Max number of orders in one page
+MAX_LIMIT = 500
+
+
+def _person(email, name, surname):
+	return {"email": email, "name": name, "surname": surname}
+
+
+def encode_cursor(key):
+	"""Returns the cursor of the (datetime_requested, type, id) position of an order"""
+	requested, order_type, request_id = key
+	text = "{}|{}|{}".format(requested.isoformat(), order_type, request_id)
+	return base64.urlsafe_b64encode(text.encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor):
+	"""Returns the (datetime_requested, type, id) position in a cursor, raises ValueError if it is not a cursor"""
+	try:
+		requested, order_type, request_id = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8").split("|")
+		key = datetime.fromisoformat(requested), order_type, int(request_id)
+	except (TypeError, UnicodeError, ValueError) as e:
+		raise ValueError("Not a cursor") from e
+	if order_type not in TYPES:
+		raise ValueError("Not a cursor")
+	return key
+
+
+def parse_args(args):
+	"""
+	Reads the filters, the cursor and the page size from the query string of a request.
+	:return: (filters, after, limit), raises ValueError with a message if an argument is not valid
+	"""
+	filters = {}
+	if args.get("type"):
+		if args["type"] not in TYPES:
+			raise ValueError("type must be one of {}".format(TYPES))
+		filters["type"] = args["type"]
+	for name in ("reader", "room"):
+		if args.get(name):
+			filters[name] = args[name]
+	if args.get("ag"):
+		filters["ag"] = args.get("ag", type=int)
+		if filters["ag"] is None:
+			raise ValueError("ag must be the id of an access group")
+	for name in ("from", "to"):
+		if args.get(name):
+			try:
+				filters[name] = datetime.strptime(args[name], "%Y-%m-%d")
+			except ValueError:
+				raise ValueError("{} must be a date as YYYY-MM-DD".format(name))
+
+	after = decode_cursor(args["cursor"]) if args.get("cursor") else None
+
+	limit = args.get("limit", type=int)
+	if "limit" in args and (limit is None or not 0 < limit <= MAX_LIMIT):
+		raise ValueError("limit must be between 1 and {}".format(MAX_LIMIT))
+	return filters, after, limit
+
+
+def _filter(query, request, approves, order_type, approver_id, filters, after, limit):
+	"""Adds the conditions on the approver, the filters and the position to a query of orders of one type"""
+	if approver_id is not None:
+		query = query.filter(approves.approver_id == approver_id)
+	if "reader" in filters:
+		query = query.filter(Reader.email == filters["reader"])
+	if "from" in filters:
+		query = query.filter(request.datetime_requested >= filters["from"])
+	if "to" in filters:
+		query = query.filter(request.datetime_requested < filters["to"] + timedelta(days=1))
+
+	if after is not None:
+		requested, after_type, request_id = after
+		rank, after_rank = TYPES.index(order_type), TYPES.index(after_type)
+
+		# Orders of the same type as the last one continue after its id among the orders made at the same time,
+		# the types listed after it start at that time and the types listed before it after that time
+
+		if rank > after_rank:
+			query = query.filter(request.datetime_requested >= requested)
+		elif rank < after_rank:
+			query = query.filter(request.datetime_requested > requested)
+		else:
+			query = query.filter(request.datetime_requested >= requested,
+								 or_(request.datetime_requested > requested, request.id > request_id))
+
+	query = query.order_by(request.datetime_requested, request.id)
+	if limit is not None:
+		query = query.limit(limit + 1)
+	return query
+
+
+def room_orders(approver_id=None, with_approver=True, filters=None, after=None, limit=None):
+	"""
+	Returns the room requests waiting for the approver, or for all approvers if approver_id is None,
+	as ((datetime_requested, type, id), order) pairs.
+	"""
+	filters = filters or {}
+
+	# SELECT room_request.*, reader.*, approver.*, room.* FROM approves_room_request
+	# JOIN room_request ON room_request.id = approves_room_request.room_request_id
+	# JOIN reader ON reader.id = room_request.reader_id
+	# JOIN reader AS approver ON approver.id = approves_room_request.approver_id
+	# JOIN room ON room.id = room_request.room_id
+	# [WHERE approves_room_request.approver_id = [approver_id] AND ...filters and position...]
+	# ORDER BY room_request.datetime_requested, room_request.id
+
+	query = db.session.query(
+		RoomRequest.id, RoomRequest.justification, RoomRequest.datetime_requested,
+		Reader.email, Reader.name, Reader.surname,
+		ApproverReader.email, ApproverReader.name, ApproverReader.surname,
+		Room.name, Room.text_id) \
+		.select_from(ApprovesRoomRequest) \
+		.join(RoomRequest, RoomRequest.id == ApprovesRoomRequest.room_request_id) \
+		.join(Reader, Reader.id == RoomRequest.reader_id) \
+		.join(ApproverReader, ApproverReader.id == ApprovesRoomRequest.approver_id) \
+		.join(Room, Room.id == RoomRequest.room_id)
+	if "room" in filters:
+		query = query.filter(Room.text_id == filters["room"])
+	query = _filter(query, RoomRequest, ApprovesRoomRequest, "Room", approver_id, filters, after, limit)
+
+	return [((requested, "Room", request_id), {
+		"type": "Room",
+		"reader": _person(email, name, surname),
+		"approver": _person(approver_email, approver_name, approver_surname) if with_approver else {},
+		"access_name": room_name,
+		"request_id": request_id,
+		"room_id": room_text_id,
+		"justification": justification,
+		"requested_datetime": requested.strftime('%Y-%m-%d')
+	}) for (request_id, justification, requested, email, name, surname,
+			approver_email, approver_name, approver_surname, room_name, room_text_id) in query]
+
+
+def ag_orders(approver_id=None, with_approver=True, filters=None, after=None, limit=None):
+	"""
+	Returns the access group requests waiting for the approver, or for all approvers if approver_id is None,
+	as ((datetime_requested, type, id), order) pairs.
+	"""
+	filters = filters or {}
+
+	query = db.session.query(
+		AccessGroupRequest.id, AccessGroupRequest.justification, AccessGroupRequest.datetime_requested,
+		Reader.email, Reader.name, Reader.surname,
+		ApproverReader.email, ApproverReader.name, ApproverReader.surname,
+		AccessGroup.id.label("ag_id"), AccessGroup.name) \
+		.select_from(ApprovesAgRequest) \
+		.join(AccessGroupRequest, AccessGroupRequest.id == ApprovesAgRequest.ag_request_id) \
+		.join(Reader, Reader.id == AccessGroupRequest.reader_id) \
+		.join(ApproverReader, ApproverReader.id == ApprovesAgRequest.approver_id) \
+		.join(AccessGroup, AccessGroup.id == AccessGroupRequest.ag_id)
+	if "ag" in filters:
+		query = query.filter(AccessGroupRequest.ag_id == filters["ag"])
+	query = _filter(query, AccessGroupRequest, ApprovesAgRequest, "AG", approver_id, filters, after, limit)
+	rows = query.all()
+
+	# The access groups are few compared to the requests for them
+	rooms = rooms_of_ags({row.ag_id for row in rows}) if rows else {}
+
+	return [((requested, "AG", request_id), {
+		"type": "AG",
+		"rooms": rooms.get(ag_id, []),
+		"reader": _person(email, name, surname),
+		"approver": _person(approver_email, approver_name, approver_surname) if with_approver else {},
+		"access_name": ag_name,
+		"request_id": request_id,
+		"ag_id": ag_id,
+		"justification": justification,
+		"requested_datetime": requested.strftime('%Y-%m-%d')
+	}) for (request_id, justification, requested, email, name, surname,
+			approver_email, approver_name, approver_surname, ag_id, ag_name) in rows]
+
+
+def rooms_of_ags(ag_ids):
+	"""Returns {access group id: [room text_id, ...]} for the access groups with the given ids"""
+
+	# SELECT gives_access_to.ag_id, room.text_id FROM room
+	# JOIN card_reader ON card_reader.room_b_id = room.id
+	# JOIN gives_access_to ON gives_access_to.cr_id = card_reader.id
+	# WHERE gives_access_to.ag_id IN [ag_ids]
+	# ORDER BY gives_access_to.ag_id, gives_access_to.cr_id
+
+	rows = db.session.query(gives_access_to.c.ag_id, Room.text_id) \
+		.join(CardReader, CardReader.room_b_id == Room.id) \
+		.join(gives_access_to, gives_access_to.c.cr_id == CardReader.id) \
+		.filter(gives_access_to.c.ag_id.in_(ag_ids)) \
+		.order_by(gives_access_to.c.ag_id, gives_access_to.c.cr_id)
+
+	rooms = {}
+	for ag_id, text_id in rows:
+		# Several card readers of an access group can lead into the same room
+		ag_rooms = rooms.setdefault(ag_id, [])
+		if text_id not in ag_rooms:
+			ag_rooms.append(text_id)
+	return rooms
+
+
+def orders(approver_id=None, with_approver=True, filters=None, after=None, limit=None):
+	"""
+	Returns the orders waiting for the approver, or for all approvers if approver_id is None, in the order of the feed.
+	:param filters: dict with any of type ("Room" or "AG"), reader (email), room (text_id), ag (id),
+	from and to (datetime, both days included)
+	:param after: the position to start after, from decode_cursor
+	:param limit: max number of orders, None for all
+	:return: (list of orders, cursor of the next page or None if this is the last). Without limit and after the
+	room requests come before the access group requests, as in the feed before it had pages.
+	"""
+	filters = filters or {}
+	# A filter on rooms only leaves room requests and a filter on access groups only access group requests
+	types = [t for t in TYPES if filters.get("type", t) == t
+			 and not (t == "Room" and "ag" in filters and "room" not in filters)
+			 and not (t == "AG" and "room" in filters and "ag" not in filters)]
+
+	rows = []
+	if "Room" in types:
+		rows += room_orders(approver_id, with_approver, filters, after, limit)
+	if "AG" in types:
+		rows += ag_orders(approver_id, with_approver, filters, after, limit)
+	if limit is None and after is None:
+		rows.sort(key=lambda row: (TYPES.index(row[0][1]), row[0][0], row[0][2]))
+	else:
+		rows.sort(key=lambda row: (row[0][0], TYPES.index(row[0][1]), row[0][2]))
+
+	cursor = None
+	if limit is not None and len(rows) > limit:
+		rows = rows[:limit]
+		cursor = encode_cursor(rows[-1][0])
+	return [order for key, order in rows], cursor
+
+
+def page(args, approver_id=None, with_approver=True):
+	"""
+	Returns the orders for the query string of a request, see parse_args. When a limit is given the next_cursor
+	is also returned, None on the last page. Raises ValueError with a message if an argument is not valid.
+	"""
+	filters, after, limit = parse_args(args)
+	page_orders, cursor = orders(approver_id, with_approver, filters, after, limit)
+	if limit is None:
+		return {"orders": page_orders}
+	return {"orders": page_orders, "next_cursor": cursor}
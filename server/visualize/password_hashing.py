@@ -0,0 +1,60 @@
+"""
+This module runs the bcrypt hashing and checking of passwords in a bounded pool of threads.
+The pool bounds the CPU spent on bcrypt, it does not take the hashing off the request path: the request waits for its
+hash, and during a login rush at most BCRYPT_POOL_SIZE hashes are computed at the same time while the other logins wait
+in line. bcrypt releases the GIL while it works, so requests that do not hash passwords are still answered.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+
+from visualize.models import bcrypt
+
+_executor = None
+_lock = threading.Lock()
+
+
+def init_app(app):
+	"""Creates the pool with the size given in the config of the app"""
+	global _executor
+	with _lock:
+		if _executor is not None:
+			_executor.shutdown(wait=False)
+		_executor = ThreadPoolExecutor(max_workers=app.config["BCRYPT_POOL_SIZE"], thread_name_prefix="bcrypt")
+
+
+def _run(function, *args):
+	"""Runs the function in the pool and waits for the result"""
+	global _executor
+	if _executor is None:
+		with _lock:
+			if _executor is None:
+				_executor = ThreadPoolExecutor(max_workers=current_app.config.get("BCRYPT_POOL_SIZE", 4),
+											   thread_name_prefix="bcrypt")
+	return _executor.submit(function, *args).result()
+
+
+def configured_rounds():
+	"""Returns the bcrypt work factor configured for the current app"""
+	return current_app.config.get("BCRYPT_LOG_ROUNDS", 12)
+
+
+def generate_password_hash(password):
+	"""Returns the bcrypt hash of the password as a string, using the configured work factor"""
+	return _run(bcrypt.generate_password_hash, password, configured_rounds()).decode("utf-8")
+
+
+def check_password_hash(pw_hash, password):
+	"""Checks if the password matches the hash"""
+	return _run(bcrypt.check_password_hash, pw_hash, password)
+
+
+def hash_rounds(pw_hash):
+	"""Returns the work factor a hash was created with, the hash looks like $2b$12$..."""
+	return int(pw_hash.split("$")[2])
+
+
+def needs_rehash(pw_hash):
+	"""Checks if the hash was created with another work factor than the configured one"""
+	return hash_rounds(pw_hash) != configured_rounds()
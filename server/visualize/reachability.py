@@ -0,0 +1,166 @@
+"""
+This module computes the rooms a reader can actually get into.
+
+Having access to the card reader into a room is not enough to get there, the reader must also be able to open the
+doors on the way from outside the building. The rooms a reader can reach are found with a breadth first search in the
+building graph (see building_graph.py), starting at the entrances (card readers without a room A) and only going
+through the card readers the reader may open now, given directly or through its access groups.
+The result is kept for every reader until the access of the reader changes, one of the card readers it used expires
+or the building graph is read again. The code that changes access marks the readers with readers_changed(), which
+materialized_access.py does, and they are forgotten when the transaction is committed. The readers changed by other
+workers are read from the access_change table (see door_sync.ChangeFeed) within DOOR_SYNC_INTERVAL seconds.
+
+The rooms of a reader are computed without holding the lock. A reader marked meanwhile may have been computed from
+its old access, so every reader has a generation that mark() increases, and the rooms are only kept if the generation
+is still the one taken before the access was read.
+"""
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import event, select, and_
+from sqlalchemy.orm import Session
+
+from visualize.building_graph import building_graph
+from visualize.door_sync import ChangeFeed
+from visualize.models import db, HasAccessTo, BelongsTo, gives_access_to
+
+# Session.info key for the readers changed in the current transaction, None in the set means all readers
+_CHANGED = "reachability_changed"
+# Max number of ids in one IN clause when the access of many readers is read
+CHUNK_SIZE = 500
+
+has_access_to = HasAccessTo.__table__
+belongs_to = BelongsTo.__table__
+
+
+class ReachabilityEngine:
+	"""reader id -> the rooms the reader can reach, computed when asked for and kept until it changes"""
+
+	def __init__(self):
+		self._reachable = {}  # reader id -> (graph version, frozenset of room ids, timestamp of the first expiry)
+		self._generations = {}  # reader id -> number of times the reader has been marked
+		self._generation = 0  # number of times all readers have been marked
+		self._feed = ChangeFeed()
+		self._started = False
+		self._lock = threading.Lock()
+
+	def rooms(self, reader_id):
+		"""Returns the ids of the rooms the reader can reach from outside the building"""
+		return self.rooms_many([reader_id])[reader_id]
+
+	def rooms_many(self, reader_ids):
+		"""Returns {reader id: ids of the rooms it can reach} for many readers, read with one query per chunk"""
+		self._sync()
+		version, now = building_graph.version, time.time()
+		found, missing = {}, []
+		with self._lock:
+			for reader_id in reader_ids:
+				known = self._reachable.get(reader_id)
+				if known is not None and known[0] == version and known[2] > now:
+					found[reader_id] = known[1]
+				else:
+					missing.append(reader_id)
+
+		for i in range(0, len(missing), CHUNK_SIZE):
+			chunk = missing[i:i + CHUNK_SIZE]
+			with self._lock:
+				generation = self._generation
+				generations = {reader_id: self._generations.get(reader_id, 0) for reader_id in chunk}
+			computed = {reader_id: (version, frozenset(building_graph.reachable(doors)), expires)
+						for reader_id, (doors, expires) in self._doors(chunk).items()}
+			with self._lock:
+				if self._generation == generation:
+					self._reachable.update((reader_id, known) for reader_id, known in computed.items()
+										   if self._generations.get(reader_id, 0) == generations[reader_id])
+			found.update((reader_id, rooms) for reader_id, (_, rooms, _) in computed.items())
+		return found
+
+	def mark(self, reader_ids):
+		"""Forgets the rooms of the readers, None in reader_ids means all readers"""
+		with self._lock:
+			if None in reader_ids:
+				self._reachable, self._generations = {}, {}
+				self._generation += 1
+			else:
+				for reader_id in reader_ids:
+					self._reachable.pop(reader_id, None)
+					self._generations[reader_id] = self._generations.get(reader_id, 0) + 1
+
+	def reset(self):
+		"""Forgets the rooms of all readers"""
+		self.mark([None])
+
+	def _sync(self):
+		"""Forgets the rooms of the readers whose access was changed by other workers"""
+		if not self._started:
+			# Nothing is kept yet, changes from here on are read from the feed
+			self._feed.start()
+			self._started = True
+			return
+		changed = self._feed.changed_readers()
+		if changed:
+			self.mark(changed)
+
+	@staticmethod
+	def _doors(reader_ids):
+		"""Returns {reader id: (ids of the card readers it may open now, timestamp when the first of them expires)}"""
+		now = datetime.now()
+		doors = {reader_id: (set(), float("inf")) for reader_id in reader_ids}
+
+		def add(reader_id, card_reader_ids, expires):
+			card_readers, first_expiry = doors[reader_id]
+			card_readers.update(card_reader_ids)
+			doors[reader_id] = (card_readers, min(first_expiry, expires.timestamp()))
+
+		# SELECT has_access_to.reader_id, has_access_to.card_reader_id, has_access_to.expiration_datetime
+		# FROM has_access_to WHERE has_access_to.reader_id IN [reader_ids] AND has_access_to.expiration_datetime > [now]
+
+		for reader_id, card_reader_id, expires in db.session.execute(
+				select([has_access_to.c.reader_id, has_access_to.c.card_reader_id, has_access_to.c.expiration_datetime])
+				.where(and_(has_access_to.c.reader_id.in_(reader_ids), has_access_to.c.expiration_datetime > now))):
+			add(reader_id, [card_reader_id], expires)
+
+		# The access groups are read first and the card readers of each group once, instead of a row for every
+		# card reader of every member as in effective_access
+		# SELECT belongs_to.reader_id, belongs_to.ag_id, belongs_to.expiration_datetime FROM belongs_to
+		# WHERE belongs_to.reader_id IN [reader_ids] AND belongs_to.expiration_datetime > [now]
+		# SELECT gives_access_to.ag_id, gives_access_to.cr_id FROM gives_access_to WHERE gives_access_to.ag_id IN [ags]
+
+		memberships = db.session.execute(
+			select([belongs_to.c.reader_id, belongs_to.c.ag_id, belongs_to.c.expiration_datetime])
+			.where(and_(belongs_to.c.reader_id.in_(reader_ids), belongs_to.c.expiration_datetime > now))).fetchall()
+		ag_doors = {}
+		ag_ids = {ag_id for _, ag_id, _ in memberships}
+		if ag_ids:
+			for ag_id, card_reader_id in db.session.execute(
+					select([gives_access_to.c.ag_id, gives_access_to.c.cr_id]).where(gives_access_to.c.ag_id.in_(ag_ids))):
+				ag_doors.setdefault(ag_id, []).append(card_reader_id)
+		for reader_id, ag_id, expires in memberships:
+			add(reader_id, ag_doors.get(ag_id, ()), expires)
+		return doors
+
+
+reachability = ReachabilityEngine()
+
+
+def readers_changed(reader_ids):
+	"""Marks the access of the readers as changed when the current transaction is committed"""
+	db.session.info.setdefault(_CHANGED, set()).update(reader_ids)
+
+
+def all_changed():
+	"""Marks the access of all readers as changed when the current transaction is committed"""
+	readers_changed([None])
+
+
+@event.listens_for(Session, "after_commit")
+def _after_commit(session):
+	changed = session.info.pop(_CHANGED, None)
+	if changed:
+		reachability.mark(changed)
+
+
+@event.listens_for(Session, "after_rollback")
+def _after_rollback(session):
+	session.info.pop(_CHANGED, None)
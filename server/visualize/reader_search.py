@@ -0,0 +1,208 @@
+"""
+This module contains the search for readers by email, name and surname, used for autocompletion.
+
+The words of the email, name and surname of every reader are kept in memory in a sorted list of (word, reader id)
+pairs, so the readers with a word starting with what was typed are found with a binary search. The pairs are read in
+order from the word that the fewest readers start with and the search stops when enough readers are found, so a
+search for a single letter costs about the same as one for a full name. The index is read
+from the database the first time it is used. After that the readers with a higher id than the last one read are
+added before every search, which is a range query on the primary key, reader ids are never reused. Lower ids that were
+skipped because their transaction had not committed yet are read again, see id_watermark.py. Readers deleted by
+this process are removed directly, the ones deleted by other workers are removed when they would have been returned,
+since the results are read again from the database.
+
+Changes to the email, name or surname of existing readers, and deletions by other workers that were not returned yet,
+are not seen by that range query. The whole index is therefore read again every READER_SEARCH_RELOAD_INTERVAL seconds,
+into a new index that replaces the old one when it is complete, while the searches go on with the old one. Such
+changes are found by the search within that interval.
+"""
+import re
+import threading
+import time
+from bisect import bisect_left, insort
+
+from flask import current_app
+
+from visualize.id_watermark import IdWatermark, gap_timeout
+from visualize.models import db, Reader
+
+# Max number of readers returned by a search
+MAX_LIMIT = 50
+
+_WORD_SEPARATORS = re.compile(r"[^\w]+")
+# Sorts after every word starting with the same letters
+_LAST_CHARACTER = "\U0010ffff"
+
+
+def words(email, name, surname):
+	"""
+	Returns the words a reader can be found by: the email, the words before the @ and the words of the name and
+	surname. The words of the domain are left out, most readers share them.
+	"""
+	email = email.lower()
+	found = {email}
+	for text in (email.split("@")[0], name.lower(), surname.lower()):
+		found.update(word for word in _WORD_SEPARATORS.split(text) if word)
+	return frozenset(found)
+
+
+class ReaderIndex:
+	"""Sorted (word, reader id) pairs of the words of every reader"""
+
+	def __init__(self):
+		self._entries = []  # sorted (word, reader id)
+		self._readers = {}  # reader id -> words
+		self._rows = IdWatermark()  # the reader ids read from the database
+		self._loaded = False
+		self._reloaded = 0.0  # when the whole index was read last
+		self._removed = None  # the ids removed while the whole index is read again, None when it is not
+		self._lock = threading.Lock()
+
+	def search(self, text, limit=10):
+		"""
+		Returns the readers with a word starting with every word of the text, as serialized readers. They are
+		ordered by their word starting with the least common word of the text, so the exact matches come first and
+		then the longer words in alphabetical order.
+		"""
+		terms = text.lower().split()
+		if not terms:
+			return []
+
+		interval = current_app.config["READER_SEARCH_RELOAD_INTERVAL"]
+		with self._lock:
+			if not self._loaded:
+				self._readers, self._entries, self._rows = self._read_all()
+				self._reloaded = time.monotonic()
+				self._loaded = True
+			reload = self._removed is None and time.monotonic() - self._reloaded >= interval
+			if reload:
+				self._removed = set()
+		if reload:
+			self._reload()
+
+		self._sync()
+		with self._lock:
+			ids = self._find(terms, limit)
+
+		# SELECT reader.* FROM reader WHERE reader.id IN [ids]
+
+		readers = {reader.id: reader for reader in Reader.query.filter(Reader.id.in_(ids))} if ids else {}
+		for reader_id in ids:
+			if reader_id not in readers:  # deleted by another worker
+				self.remove(reader_id)
+		return [readers[reader_id].serialize for reader_id in ids if reader_id in readers]
+
+	def add(self, reader_id, email, name, surname):
+		"""Adds a reader, or updates it if it is already in the index"""
+		with self._lock:
+			self._add(reader_id, email, name, surname)
+
+	def remove(self, reader_id):
+		"""Removes a reader from the index"""
+		with self._lock:
+			self._remove(reader_id)
+
+	def reset(self):
+		"""Forgets all readers, they are read from the database the next time the index is used"""
+		with self._lock:
+			self._entries, self._readers = [], {}
+			self._rows = IdWatermark()
+			self._loaded = False
+			self._removed = None
+
+	def _find(self, terms, limit):
+		"""Returns the ids of at most limit readers with a word starting with every term, best first"""
+		ranges = [(bisect_left(self._entries, (term,)), bisect_left(self._entries, (term + _LAST_CHARACTER,)), term)
+				  for term in terms]
+		start, end, first = min(ranges, key=lambda found: found[1] - found[0])
+		others = [term for term in terms if term != first]
+
+		ids = []
+		for i in range(start, end):
+			reader_id = self._entries[i][1]
+			if reader_id not in ids and \
+					all(any(word.startswith(term) for word in self._readers[reader_id]) for term in others):
+				ids.append(reader_id)
+				if len(ids) == limit:
+					break
+		return ids
+
+	def _add(self, reader_id, email, name, surname):
+		if reader_id in self._readers:
+			self._remove(reader_id)
+		self._readers[reader_id] = words(email, name, surname)
+		for word in self._readers[reader_id]:
+			insort(self._entries, (word, reader_id))
+
+	def _remove(self, reader_id):
+		if self._removed is not None:
+			self._removed.add(reader_id)
+		reader_words = self._readers.pop(reader_id, None)
+		if reader_words is None:
+			return
+		for word in reader_words:
+			i = bisect_left(self._entries, (word, reader_id))
+			if i < len(self._entries) and self._entries[i] == (word, reader_id):
+				del self._entries[i]
+
+	def _sync(self):
+		"""Reads the readers added since the last sync, the query is made without holding the lock"""
+		with self._lock:
+			position = self._rows
+			condition = position.condition(Reader.id)
+
+		# SELECT reader.id, reader.email, reader.name, reader.surname FROM reader
+		# WHERE reader.id > [last id] OR reader.id IN [gaps] ORDER BY reader.id
+
+		timeout = gap_timeout()
+		rows = db.session.query(Reader.id, Reader.email, Reader.name, Reader.surname) \
+			.filter(condition).order_by(Reader.id).all()
+		with self._lock:
+			# The index was read again or reset meanwhile, the rows are in it or are read by the next sync
+			if self._rows is not position:
+				return
+			for reader_id, email, name, surname in rows:
+				self._add(reader_id, email, name, surname)
+			position.seen([reader_id for reader_id, _, _, _ in rows], timeout)
+
+	def _read_all(self):
+		"""Returns the words of every reader, the sorted entries and the IdWatermark of the read ids"""
+
+		# SELECT reader.id, reader.email, reader.name, reader.surname FROM reader
+
+		readers = {reader_id: words(email, name, surname) for reader_id, email, name, surname in
+				   db.session.query(Reader.id, Reader.email, Reader.name, Reader.surname)}
+		entries = sorted((word, reader_id) for reader_id, reader_words in readers.items() for word in reader_words)
+		return readers, entries, IdWatermark(max(readers, default=0))
+
+	def _reload(self):
+		"""Reads the whole index again without holding the lock and replaces the old one with it"""
+		try:
+			readers, entries, rows = self._read_all()
+		except Exception:
+			with self._lock:
+				self._removed = None
+			raise
+		with self._lock:
+			# Readers removed meanwhile may have been read, the ones added meanwhile are read again by the next sync
+			if self._removed:
+				entries = [entry for entry in entries if entry[1] not in self._removed]
+				for reader_id in self._removed:
+					readers.pop(reader_id, None)
+			self._readers, self._entries, self._rows = readers, entries, rows
+			self._reloaded = time.monotonic()
+			self._removed = None
+
+
+reader_index = ReaderIndex()
+
+
+def parse_args(args):
+	"""
+	Reads the text to search for and the max number of results from the query string of a request.
+	:return: (text, limit), raises ValueError with a message if an argument is not valid
+	"""
+	limit = args.get("limit", type=int) if "limit" in args else 10
+	if limit is None or not 0 < limit <= MAX_LIMIT:
+		raise ValueError("limit must be between 1 and {}".format(MAX_LIMIT))
+	return args.get("q", ""), limit
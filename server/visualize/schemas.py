@@ -1 +1,14 @@
 """This module contains the schemas that are used to verify user input"""
+
+# A new user, used when users are created one at a time and when they are imported in bulk
+USER_SCHEMA = {
+	"email": {"type": "string", "regex": "^[a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\\.[a-zA-Z0-9-.]+$"},
+	"name": {"type": "string", "regex": "[a-zA-Z]+$", "minlength": 2, "maxlength": 12},
+	"surname": {"type": "string", "regex": "[a-zA-Z]+$", "minlength": 2, "maxlength": 12},
+	"password": {"type": "string"}
+}
+
+# A card swiped at a card reader, other fields sent by the door controller are ignored
+SWIPE_SCHEMA = {
+	"card_id": {"type": "string"}
+}
@@ -0,0 +1,253 @@
+"""
+This module contains the log of the swipes made at the card readers, who swiped where and when and if the door opened.
+
+Door controllers send their swipes in batches. The swipes are kept in an in-memory buffer and written in bulk by a
+writer thread, when SWIPE_FLUSH_SIZE swipes have been buffered or the oldest one has waited SWIPE_FLUSH_INTERVAL
+seconds, so no request waits for a commit. The log is append-only and split into one table per day, swipe_YYYYMMDD,
+so old days are removed by dropping their tables. When the writer falls behind and SWIPE_BUFFER_MAX swipes are waiting,
+new batches are refused until it has caught up and the controllers send them again later. Swipes that can not be
+written, e.g. with a card reader id out of range for the database, are set aside instead of holding up the ones after
+them, see rejected().
+"""
+import atexit
+import os
+import threading
+import time
+from datetime import datetime, date
+
+from sqlalchemy import Table, MetaData, Column, Integer, String, Float, Boolean, inspect, select
+from sqlalchemy.exc import DataError, IntegrityError
+
+from visualize.models import db
+
+# Prefix of the day tables, followed by the date as YYYYMMDD
+TABLE_PREFIX = "swipe_"
+# Max number of swipes kept after they could not be written
+MAX_REJECTED = 10000
+
+_metadata = MetaData()
+_buffer = None
+_lock = threading.Lock()
+
+
+def day_table(day):
+	"""Returns the table with the swipes of the day"""
+	name = TABLE_PREFIX + day.strftime("%Y%m%d")
+	if name not in _metadata.tables:
+		# The id is the position in the log of the day and the time is stored as seconds since the epoch,
+		# there are no other indexes so appending stays cheap
+		Table(name, _metadata,
+			  Column("id", Integer, primary_key=True),
+			  Column("card_id", String, nullable=False),
+			  Column("card_reader_id", Integer, nullable=False),
+			  Column("time", Float, nullable=False),
+			  Column("allowed", Boolean, nullable=False))
+	return _metadata.tables[name]
+
+
+def write(connection, swipes):
+	"""
+	Appends (card_id, card_reader_id, timestamp, allowed) swipes to the tables of their days.
+	:return: the swipes that were not written since their timestamp is not a day
+	"""
+	by_day = {}
+	rejected = []
+	for swipe in swipes:
+		card_id, card_reader_id, timestamp, allowed = swipe
+		try:
+			day = date.fromtimestamp(timestamp)
+		except (ValueError, OverflowError, OSError):
+			rejected.append(swipe)
+			continue
+		by_day.setdefault(day, []).append(
+			{"card_id": card_id, "card_reader_id": card_reader_id, "time": timestamp, "allowed": allowed})
+
+	with connection.begin():
+		for day, rows in by_day.items():
+			table = day_table(day)
+			table.create(connection, checkfirst=True)
+			connection.execute(table.insert(), rows)
+	return rejected
+
+
+class SwipeBuffer:
+	"""Swipes waiting to be written, flushed by a writer thread on size or time"""
+
+	def __init__(self, app):
+		self.app = app
+		self._swipes = []
+		self._oldest = None  # when the oldest buffered swipe was added
+		self._writing = 0  # number of swipes being written
+		self._rejected = []  # the latest swipes that could not be written
+		self._lock = threading.Lock()
+		self._write_lock = threading.Lock()  # one flush at a time, so the order of the swipes is kept
+		self._wake = threading.Event()
+		self._stopped = False
+		self._thread = None
+		self._pid = None
+
+	@property
+	def flush_size(self):
+		return self.app.config["SWIPE_FLUSH_SIZE"]
+
+	@property
+	def flush_interval(self):
+		return self.app.config["SWIPE_FLUSH_INTERVAL"]
+
+	@property
+	def max_size(self):
+		return self.app.config["SWIPE_BUFFER_MAX"]
+
+	def add(self, swipes):
+		"""Buffers the swipes, returns False without buffering any of them when the buffer is full"""
+		with self._lock:
+			if len(self._swipes) + self._writing + len(swipes) > self.max_size:
+				return False
+			if not self._swipes:
+				self._oldest = time.monotonic()
+			self._swipes.extend(swipes)
+			full = len(self._swipes) >= self.flush_size
+		self._start()
+		if full:
+			self._wake.set()
+		return True
+
+	def pending(self):
+		"""Returns the number of swipes that have not been written yet"""
+		with self._lock:
+			return len(self._swipes) + self._writing
+
+	def rejected(self):
+		"""Returns the latest swipes that could not be written"""
+		with self._lock:
+			return list(self._rejected)
+
+	def flush(self):
+		"""Writes the buffered swipes, returns how many were written"""
+		with self._write_lock:
+			with self._lock:
+				swipes, self._swipes = self._swipes, []
+				self._writing = len(swipes)
+			if not swipes:
+				return 0
+			written = 0
+			try:
+				with self.app.app_context():
+					with db.engine.connect() as connection:
+						try:
+							rejected = write(connection, swipes)
+							written = len(swipes)
+						except (DataError, IntegrityError):
+							# Some swipe can not be stored, the swipes are written one at a time to find it
+							rejected = []
+							for swipe in swipes:
+								try:
+									rejected += write(connection, [swipe])
+								except (DataError, IntegrityError):
+									rejected.append(swipe)
+								written += 1
+			except Exception:
+				# The swipes not written are put back first in the buffer and written in the next flush
+				with self._lock:
+					self._swipes[:0] = swipes[written:]
+					self._oldest = time.monotonic()
+				raise
+			finally:
+				with self._lock:
+					self._writing = 0
+			if rejected:
+				self.app.logger.warning("%s swipes could not be written and were set aside, e.g. %s",
+										len(rejected), rejected[0])
+				with self._lock:
+					self._rejected = (self._rejected + rejected)[-MAX_REJECTED:]
+			return len(swipes) - len(rejected)
+
+	def stop(self):
+		"""Stops the writer thread and writes what is left in the buffer"""
+		self._stopped = True
+		self._wake.set()
+		if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+			self._thread.join()
+		self.flush()
+
+	def _start(self):
+		"""Starts the writer thread the first time swipes are added in this process"""
+		if self._pid == os.getpid():
+			return
+		with self._lock:
+			if self._pid != os.getpid() and not self._stopped:
+				self._pid = os.getpid()
+				self._thread = threading.Thread(target=self._run, name="swipe-writer", daemon=True)
+				self._thread.start()
+				atexit.register(self.stop)
+
+	def _run(self):
+		while not self._stopped:
+			with self._lock:
+				full = len(self._swipes) >= self.flush_size
+				age = time.monotonic() - self._oldest if self._swipes else 0
+			if not full and age < self.flush_interval:
+				self._wake.wait(self.flush_interval - age)
+				self._wake.clear()
+				continue
+			try:
+				self.flush()
+			except Exception:
+				self.app.logger.exception("Writing swipes failed, trying again in %s seconds", self.flush_interval)
+				self._wake.wait(self.flush_interval)
+				self._wake.clear()
+
+
+def init_app(app):
+	"""Creates the buffer, the flush policy is read from the config of the app"""
+	global _buffer
+	with _lock:
+		if _buffer is not None:
+			_buffer.stop()
+		_buffer = SwipeBuffer(app)
+
+
+def add(swipes):
+	"""Buffers (card_id, card_reader_id, timestamp, allowed) swipes, returns False when the writer is behind"""
+	return _buffer.add(swipes)
+
+
+def pending():
+	"""Returns the number of swipes that have not been written yet"""
+	return _buffer.pending()
+
+
+def flush():
+	"""Writes the buffered swipes at once, returns how many were written"""
+	return _buffer.flush()
+
+
+def rejected():
+	"""Returns the latest swipes that could not be written and were set aside"""
+	return _buffer.rejected()
+
+
+def days():
+	"""Returns the days that have swipes, oldest first"""
+	names = inspect(db.engine).get_table_names()
+	return sorted(datetime.strptime(name[len(TABLE_PREFIX):], "%Y%m%d").date()
+				  for name in names if name.startswith(TABLE_PREFIX))
+
+
+def swipes_of_day(day, card_reader_id=None):
+	"""Returns the swipes of a day as (card_id, card_reader_id, timestamp, allowed), ordered by time"""
+	if day not in days():
+		return []
+	table = day_table(day)
+	query = select([table.c.card_id, table.c.card_reader_id, table.c.time, table.c.allowed]).order_by(table.c.time)
+	if card_reader_id is not None:
+		query = query.where(table.c.card_reader_id == card_reader_id)
+	return [tuple(row) for row in db.session.execute(query)]
+
+
+def drop_days_before(day):
+	"""Drops the tables of the days before the given day, returns how many were dropped"""
+	old = [d for d in days() if d < day]
+	for d in old:
+		day_table(d).drop(db.engine)
+	return len(old)